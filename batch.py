@@ -0,0 +1,115 @@
+"""Векторизованный вызов арифметических функций MEL по столбцам.
+
+Функция подходит, если анализатор вывел числовые типы всех её
+параметров, результата и каждого узла тела, а тело - один
+`return выражение` из параметров, числовых литералов, арифметики,
+унарного минуса и вызовов чистых встроенных функций над числами. Такое
+выражение вычисляется один раз для целых столбцов аргументов
+поэлементными операциями vectors вместо вызова функции на каждую строку.
+"""
+from typing import AbstractSet, Optional, Sequence
+
+from mel_ast import *
+from mel_builtins import BUILTINS
+from mel_types import INT, FLOAT
+from vectors import VECTOR_OPS, vector_binop
+
+NUMERIC_TYPES = (INT, FLOAT)
+
+
+class VectorKernel:
+    """Выражение функции, вычисляемое над столбцами параметров."""
+    __slots__ = ('params', 'expr')
+
+    def __init__(self, params: Sequence[str], expr: ExprNode):
+        self.params = tuple(params)
+        self.expr = expr
+
+    def __call__(self, columns: Sequence[Sequence]) -> list:
+        if len(columns) != len(self.params):
+            raise TypeError(f"Ожидалось {len(self.params)} столбцов, получено {len(columns)}")
+        # столбцы NumPy и прочие последовательности - в списки Python
+        columns = [column if type(column) is list else column.tolist() if hasattr(column, 'tolist')
+                   else list(column) for column in columns]
+        size = column_length(columns)
+        result = _evaluate(self.expr, dict(zip(self.params, columns)))
+        return result if type(result) is list else [result] * size
+
+
+def _evaluate(node: ExprNode, env: dict):
+    # Значение - скаляр (литерал и выражения из литералов) или столбец
+    cls = type(node)
+    if cls is LiteralNode:
+        return node.value
+    if cls is IdentNode:
+        return env[node.name]
+    if cls is BinOpNode or cls is TypedBinOpNode:
+        left, right = _evaluate(node.arg1, env), _evaluate(node.arg2, env)
+        if type(left) is list or type(right) is list:
+            return vector_binop(node.op, left, right)
+        return VECTOR_OPS[node.op](left, right)
+    if cls is UnaryOpNode:
+        value = _evaluate(node.arg, env)
+        return vector_binop(BinOp.MUL, -1, value) if type(value) is list else -value
+    if cls is CoerceNode:
+        value = _evaluate(node.arg, env)
+        return [node.func(x) for x in value] if type(value) is list else node.func(value)
+    if cls is FuncCallNode:
+        func = BUILTINS[node.func.name].func
+        args = [_evaluate(arg, env) for arg in node.params]
+        if not any(type(arg) is list for arg in args):
+            return func(*args)
+        size = next(len(arg) for arg in args if type(arg) is list)
+        return [func(*row) for row in zip(*(arg if type(arg) is list else [arg] * size for arg in args))]
+    raise TypeError(f"Узел {cls.__name__} не векторизуется")
+
+
+def _arithmetic_only(node: ExprNode, params: AbstractSet[str], functions: AbstractSet[str]) -> bool:
+    if node.sem_type not in NUMERIC_TYPES:
+        return False
+    cls = type(node)
+    if cls is LiteralNode:
+        return True
+    if cls is IdentNode:
+        return node.name in params
+    if cls is BinOpNode or cls is TypedBinOpNode:
+        return node.op in VECTOR_OPS and _arithmetic_only(node.arg1, params, functions) and _arithmetic_only(node.arg2, params, functions)
+    if cls is UnaryOpNode:
+        return node.op == UnaryOp.NEG and _arithmetic_only(node.arg, params, functions)
+    if cls is CoerceNode:
+        return _arithmetic_only(node.arg, params, functions)
+    if cls is FuncCallNode:
+        builtin = BUILTINS.get(node.func.name)
+        # функция программы с тем же именем перекрывает встроенную
+        if builtin is None or node.func.name in functions or not builtin.pure:
+            return False
+        # параметр любого типа (abs) получает числа: аргументы проверены ниже
+        return all(t is None or t in NUMERIC_TYPES for t in builtin.param_types) \
+            and all(_arithmetic_only(arg, params, functions) for arg in node.params)
+    return False
+
+
+def vector_kernel(func: FuncDeclNode, info: Optional[dict], params: Sequence[str],
+                  functions: AbstractSet[str]) -> Optional[VectorKernel]:
+    """VectorKernel для функции или None, если она не только арифметическая.
+
+    info - запись SemanticAnalyzer.functions, functions - имена функций
+    программы.
+    """
+    if info is None or info.get('return_type') not in NUMERIC_TYPES \
+            or any(t not in NUMERIC_TYPES for t in info['param_types']):
+        return None
+    body = func.body
+    if type(body) is not StmtListNode or len(body.stmts) != 1 or type(body.stmts[0]) is not ReturnNode:
+        return None
+    expr = body.stmts[0].result
+    if not _arithmetic_only(expr, frozenset(params), functions):
+        return None
+    return VectorKernel(params, expr)
+
+
+def column_length(columns: Sequence[Sequence]) -> int:
+    lengths = {len(column) for column in columns}
+    if len(lengths) > 1:
+        raise ValueError(f"Столбцы разной длины: {sorted(lengths)}")
+    return lengths.pop() if lengths else 0
@@ -0,0 +1,420 @@
+import asyncio
+import copy
+import os
+import pickle
+import subprocess
+import tempfile
+import sys
+import time
+import tracemalloc
+
+import binast
+import bytecode
+import cooperative
+import server
+import mel_parser
+from mel_ast import AstNode, IdentNode, StmtListNode
+from interpreter import Interpreter
+from program import compile_program
+from semantics import SemanticAnalyzer, flatten
+from specialize import specialize
+
+UNIT = '''
+int f(int a, int b) {
+    int s = 0;
+    int i = 0;
+    while (i < a) {
+        s = s + i * b;
+        i = i + 1;
+    }
+    if (s > 10) {
+        s = s - 1;
+    } else {
+        s = s + 1;
+    }
+    return s;
+}
+int[] arr = {1, 2, 3};
+arr[0] = f(3, 4);
+float g = 1.5;
+'''
+
+
+def _rename(node, mapping):
+    if isinstance(node, IdentNode):
+        node.name = mapping.get(node.name, node.name)
+    elif isinstance(node, (list, tuple)):
+        for item in node:
+            _rename(item, mapping)
+    elif isinstance(node, AstNode):
+        for value in vars(node).values():
+            _rename(value, mapping)
+
+
+def make_program(units: int) -> StmtListNode:
+    # Разбор (LALR, модуль mel_parser_standalone) здесь не измеряется:
+    # один блок разбирается один раз и размножается копиями с
+    # переименованными функциями.
+    unit = mel_parser.parse(UNIT)
+    stmts = []
+    for k in range(units):
+        copy_ = copy.deepcopy(unit)
+        _rename(copy_, {'f': f'f{k}', 'arr': f'arr{k}', 'g': f'g{k}'})
+        stmts.extend(copy_.stmts)
+    return StmtListNode(*stmts)
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def report(name, elapsed, peak=None):
+    line = f'{name:<40} {elapsed * 1000:10.1f} ms'
+    if peak is not None:
+        line += f' {peak / 1024:10.0f} KiB'
+    print(line)
+
+
+def bench_semantics(units=2000):
+    for workers in (None, 1, max(2, os.cpu_count())):
+        prog = make_program(units)
+
+        def analyze():
+            errors = SemanticAnalyzer(workers=workers).analyze(prog)
+            assert not errors, errors[:5]
+
+        report(f'semantics ({units} units, workers={workers})', *measure(analyze))
+
+
+NUMERIC_KERNEL = '''
+float x = 0.0;
+float acc = 0.0;
+int k = 0;
+int i = 0;
+while (i < n) {
+    x = x * 0.5 + i * 2.0 - 1.0;
+    acc = acc + x * x;
+    k = k + i % 7;
+    if (acc > 1000000.0) {
+        acc = acc / 2;
+    }
+    i = i + 1;
+}
+'''
+
+
+def bench_specialize(n=50000):
+    generic = compile_program(NUMERIC_KERNEL, externs={'n': 'int'}, optimize=False)
+    specialized = compile_program(NUMERIC_KERNEL, externs={'n': 'int'})
+    results = []
+    for name, program in (('generic', generic), ('specialized', specialized)):
+        start = time.perf_counter()
+        results.append(program.run({'n': n}))
+        report(f'numeric kernel, {name} ({n} iterations)', time.perf_counter() - start)
+    assert results[0] == results[1]
+
+
+VM_PROGRAMS = {
+    'loop': '''
+int s = 0;
+int i = 0;
+while (i < 200000) {
+    s = s + i % 7 * 3;
+    i = i + 1;
+}
+''',
+    'calls': '''
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+int r = fib(20);
+''',
+}
+
+
+def bench_vm():
+    for name, source in VM_PROGRAMS.items():
+        ast = mel_parser.parse(source)
+        assert not SemanticAnalyzer().analyze(ast)
+        module = bytecode.compile_program(specialize(ast))
+
+        start = time.perf_counter()
+        interpreter = Interpreter()
+        interpreter.eval(ast)
+        report(f'{name}, tree interpreter', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        variables = bytecode.VM(module).run()
+        report(f'{name}, bytecode vm', time.perf_counter() - start)
+        assert all(variables[k] == v for k, v in interpreter.variables.items())
+
+
+def bench_binast(units=2000):
+    prog = make_program(units)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'prog.mela')
+        binast.dump(prog, path)
+        data = pickle.dumps(prog)
+        print(f'binary ast {os.path.getsize(path) // 1024} KiB, pickle {len(data) // 1024} KiB')
+        report('pickle.loads', *measure(pickle.loads, data))
+
+        def inspect():
+            with binast.load(path) as ast:
+                return [stmt.node_type for stmt in flatten(ast.root.stmts)]
+
+        def materialize():
+            with binast.load(path) as ast:
+                return ast.materialize()
+
+        report('binast.load + top-level views', *measure(inspect))
+        report('binast.load + materialize', *measure(materialize))
+
+
+MEMO_KERNEL = '''
+int weight(int k) {
+    int s = 0;
+    for (int j = 0; j < 20; j = j + 1) {
+        s = s + k * j % 13;
+    }
+    return s;
+}
+int total = 0;
+int i = 0;
+while (i < 20000) {
+    total = total + weight(i % 50);
+    i = i + 1;
+}
+'''
+
+
+def bench_memo():
+    for memoize in (False, True):
+        program = compile_program(MEMO_KERNEL, memoize=memoize)
+        start = time.perf_counter()
+        program.run()
+        report(f'pure helper calls, memoize={memoize}', time.perf_counter() - start)
+    print(program.memo.stats())
+
+
+STARTUP_SCRIPTS = {
+    'python': 'pass',
+    'import mel_parser': 'import mel_parser',
+    'import + first parse': 'import mel_parser; mel_parser.parse("int x = 1;")',
+    # без собранного модуля: lark и компиляция грамматики
+    'import + first parse (lark)': 'import sys; sys.modules["mel_parser_standalone"] = None; '
+                                   'import mel_parser; mel_parser.parse("int x = 1;")',
+}
+
+
+def bench_startup(repeat=5):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for name, script in STARTUP_SCRIPTS.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', script], cwd=cwd, check=True)
+            times.append(time.perf_counter() - start)
+        report(f'{name} (best of {repeat})', min(times))
+
+
+STRING_BUILDER = '''
+string s = "";
+int i = 0;
+while (i < n) {
+    s = s + "0123456789abcdef";
+    i = i + 1;
+}
+'''
+
+
+def bench_strings():
+    program = compile_program(STRING_BUILDER, externs={'n': 'int'})
+    for n in (20000, 40000, 80000):
+        start = time.perf_counter()
+        program.run({'n': n})
+        report(f'string building ({n} appends)', time.perf_counter() - start)
+
+
+VECTOR_LOOP = '''
+float[] a = zeros(n);
+int i = 0;
+while (i < n) {
+    a[i] = a[i] * 2.0 + 1.0;
+    i = i + 1;
+}
+'''
+VECTOR_EXPR = '''
+float[] a = zeros(n);
+a = a * 2.0 + 1.0;
+'''
+
+
+def bench_vectors():
+    n = 100000
+    for label, code in (('element loop', VECTOR_LOOP), ('array expression', VECTOR_EXPR)):
+        program = compile_program(code, externs={'n': 'int'})
+        start = time.perf_counter()
+        program.run({'n': n})
+        report(f'{label} ({n} elements)', time.perf_counter() - start)
+
+
+BATCH_KERNEL = '''
+float score(float x, int k) {
+    return x * 2.0 - k * 0.5 + 1.0;
+}
+'''
+
+
+def bench_batch():
+    program = compile_program(BATCH_KERNEL)
+    n = 100000
+    xs, ks = [i * 0.5 for i in range(n)], list(range(n))
+    context = program.new_context()
+    start = time.perf_counter()
+    for x, k in zip(xs, ks):
+        context.call('score', x, k)
+    report(f'call per row ({n} rows)', time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in context.call_batch('score', zip(xs, ks)):
+        pass
+    report(f'call_batch ({n} rows)', time.perf_counter() - start)
+    start = time.perf_counter()
+    context.call_columns('score', [xs, ks])
+    report(f'call_columns, vectorized ({n} rows)', time.perf_counter() - start)
+
+
+INLINE_LOOP = '''
+float sq(float x) {
+    return x * x;
+}
+float norm(float a, float b) {
+    return sq(a) + sq(b);
+}
+float s = 0.0;
+int i = 0;
+while (i < n) {
+    s = s + norm(1.5, 2.5);
+    i = i + 1;
+}
+'''
+
+
+def bench_inline():
+    n = 100000
+    for inline in (False, True):
+        program = compile_program(INLINE_LOOP, externs={'n': 'int'}, memoize=False, inline=inline)
+        start = time.perf_counter()
+        program.run({'n': n})
+        report(f'{n} calls, inline={inline}', time.perf_counter() - start)
+
+
+CSE_LOOP = '''
+float s = 0.0;
+float scale = 1.5;
+int i = 0;
+while (i < n) {
+    float t = (i * 2 + 1) * (i * 2 + 1) * scale * 0.5;
+    s = s + t + (i * 2 + 1) * (scale * scale + 2.0);
+    i = i + 1;
+}
+'''
+
+
+def bench_cse():
+    n = 100000
+    for cse in (False, True):
+        program = compile_program(CSE_LOOP, externs={'n': 'int'}, cse=cse)
+        start = time.perf_counter()
+        program.run({'n': n})
+        report(f'{n} iterations, cse={cse}', time.perf_counter() - start)
+
+
+def bench_async(scripts=20):
+    module = bytecode.compile_checked(compile_program(VM_PROGRAMS['loop']))
+    start = time.perf_counter()
+    bytecode.VM(module).run()
+    report('loop, vm', time.perf_counter() - start)
+
+    async def serve():
+        runner = cooperative.AsyncRunner(module)
+        loop = asyncio.get_running_loop()
+        # наибольшая задержка цикла событий, пока выполняются программы
+        lag, running = 0.0, True
+
+        async def probe():
+            nonlocal lag
+            while running:
+                before = loop.time()
+                await asyncio.sleep(0)
+                lag = max(lag, loop.time() - before)
+
+        watcher = asyncio.ensure_future(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(runner.run() for _ in range(scripts)))
+        elapsed = time.perf_counter() - start
+        running = False
+        await watcher
+        return elapsed, lag
+
+    elapsed, lag = asyncio.run(serve())
+    report(f'loop x{scripts}, async', elapsed / scripts)
+    report(f'max wait for a loop turn, {scripts} scripts', lag)
+
+
+SERVER_SCRIPT = 'int f(int a) { return a * a + 1; }\nint r = f(n);\n'
+
+
+def bench_server(requests=200):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    script = (f'from program import compile_program; '
+              f'compile_program({SERVER_SCRIPT!r}, externs={{"n": "int"}}).run({{"n": 3}})')
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', script], cwd=cwd, check=True)
+    report('cold process per request', time.perf_counter() - start)
+
+    with server.WorkerPool(2) as pool:
+        for i in range(requests):
+            # каждый десятый запрос - новый текст, остальные попадают в кеш
+            source = SERVER_SCRIPT + f'int k{i // 10} = 0;\n'
+            reply = pool.handle({'source': source, 'externs': {'n': 'int'}, 'globals': {'n': i}})
+            assert reply['ok'], reply
+        for name, value in pool.latency.percentiles().items():
+            if name != 'count':
+                report(f'warm pool, {name}', value)
+
+
+BENCHMARKS = {
+    'semantics': bench_semantics,
+    'specialize': bench_specialize,
+    'vm': bench_vm,
+    'binast': bench_binast,
+    'memo': bench_memo,
+    'startup': bench_startup,
+    'strings': bench_strings,
+    'vectors': bench_vectors,
+    'batch': bench_batch,
+    'inline': bench_inline,
+    'cse': bench_cse,
+    'async': bench_async,
+    'server': bench_server,
+}
+
+
+def main(argv):
+    sys.setrecursionlimit(10000)
+    for name in argv or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
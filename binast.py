@@ -0,0 +1,386 @@
+"""Плоский двоичный формат деревьев mel_ast.
+
+Файл - набор массивов int32: таблица узлов (класс, первое поле, число
+полей), таблица полей (имя и вид значения в одном числе, два операнда), элементы списков
+и таблица строк. Загрузка через mmap не копирует данные: массивы читаются
+через memoryview. Узлы доступны как ленивые NodeView, а настоящие объекты
+AstNode создаются только для запрошенных поддеревьев.
+
+Поддерево 0 - корень. Узлы пронумерованы в ширину, поэтому кодирование и
+материализация не используют рекурсию по глубине дерева.
+"""
+import importlib
+import mmap
+import operator
+import struct
+import sys
+import types
+from array import array
+from enum import Enum
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+
+from mel_ast import AstNode
+
+MAGIC = b'MELA'
+VERSION = 1
+
+# Виды значений полей
+(K_NONE, K_BOOL, K_INT, K_BIGINT, K_FLOAT, K_STR, K_NODE, K_RECORD,
+ K_LIST, K_TUPLE, K_ENUM, K_FUNC) = range(12)
+
+# Модули, классы которых можно создавать при загрузке
+RECORD_MODULES = ('mel_ast', 'mel_types')
+
+NODE_SIZE = 3
+FIELD_SIZE = 3
+KIND_BITS = 4
+KIND_MASK = (1 << KIND_BITS) - 1
+ITEM_SIZE = 3
+SECTIONS = ('classes', 'nodes', 'fields', 'items', 'strings', 'string_data', 'floats')
+HEADER = struct.Struct('<4sI' + 'II' * len(SECTIONS))
+
+
+def _class_name(obj) -> str:
+    return f'{type(obj).__module__}.{type(obj).__qualname__}'
+
+
+def _func_name(func) -> str:
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+_functions = None
+
+
+def function_table() -> Dict[str, Callable]:
+    """Функции, которые можно сохранить и загрузить: ровно те, что
+    specialize кладёт в TypedBinOpNode и CoerceNode. Любое другое имя,
+    например builtins.eval, при загрузке отвергается."""
+    global _functions
+    if _functions is None:
+        from specialize import SPECIALIZED_OPS
+        from vectors import VECTOR_FUNCS
+        funcs = [float, operator.truediv, *SPECIALIZED_OPS.values(), *VECTOR_FUNCS.values()]
+        _functions = {_func_name(func): func for func in funcs}
+    return _functions
+
+
+class _Encoder:
+    def __init__(self):
+        self.classes: Dict[str, int] = {}
+        self.strings: Dict[str, int] = {}
+        self.nodes = array('i')
+        self.fields = array('i')
+        self.items = array('i')
+        self.floats = array('d')
+        self.index: Dict[int, int] = {}
+        self.queue: List[Any] = []
+
+    def string(self, text: str) -> int:
+        if text not in self.strings:
+            self.strings[text] = len(self.strings)
+        return self.strings[text]
+
+    def record(self, obj) -> int:
+        # Один объект - один узел, даже если на него несколько ссылок
+        key = id(obj)
+        if key not in self.index:
+            name = _class_name(obj)
+            if type(obj).__module__ not in RECORD_MODULES:
+                raise ValueError(f"Объект {name} нельзя сохранить в двоичном AST")
+            self.index[key] = len(self.queue)
+            self.queue.append(obj)
+            if name not in self.classes:
+                self.classes[name] = len(self.classes)
+                self.string(name)
+        return self.index[key]
+
+    def value(self, value) -> Tuple[int, int, int]:
+        if value is None:
+            return K_NONE, 0, 0
+        if isinstance(value, bool):
+            return K_BOOL, int(value), 0
+        if isinstance(value, Enum):
+            return K_ENUM, self.string(_class_name(value)), self.string(value.name)
+        if isinstance(value, int):
+            if -2 ** 31 <= value < 2 ** 31:
+                return K_INT, value, 0
+            return K_BIGINT, self.string(str(value)), 0
+        if isinstance(value, float):
+            self.floats.append(value)
+            return K_FLOAT, len(self.floats) - 1, 0
+        if isinstance(value, str):
+            return K_STR, self.string(value), 0
+        if isinstance(value, (list, tuple)):
+            encoded = [self.value(item) for item in value]
+            start = len(self.items) // ITEM_SIZE
+            for item in encoded:
+                self.items.extend(item)
+            return (K_LIST if isinstance(value, list) else K_TUPLE), start, len(encoded)
+        if isinstance(value, (types.FunctionType, types.BuiltinFunctionType, type)):
+            name = _func_name(value)
+            if function_table().get(name) is not value:
+                raise ValueError(f"Функцию {value!r} нельзя сохранить в двоичном AST")
+            return K_FUNC, self.string(name), 0
+        return (K_NODE if isinstance(value, AstNode) else K_RECORD), self.record(value), 0
+
+    def encode(self, root: AstNode) -> bytes:
+        self.record(root)
+        pos = 0
+        while pos < len(self.queue):
+            obj = self.queue[pos]
+            pos += 1
+            attrs = vars(obj)
+            self.nodes.extend((self.classes[_class_name(obj)], len(self.fields) // FIELD_SIZE, len(attrs)))
+            for name, value in attrs.items():
+                kind, a, b = self.value(value)
+                self.fields.extend((self.string(name) << KIND_BITS | kind, a, b))
+        return self.pack()
+
+    def pack(self) -> bytes:
+        class_ids = array('i', (self.strings[name] for name in self.classes))
+        blobs = [name.encode('utf-8') for name in self.strings]
+        offsets = array('i', [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        sections = [class_ids, self.nodes, self.fields, self.items, offsets, b''.join(blobs), self.floats]
+        payload = []
+        pos = HEADER.size
+        layout = []
+        for data in sections:
+            raw = _to_bytes(data)
+            pos += -pos % 8
+            layout.extend((pos, len(raw)))
+            payload.append(raw)
+            pos += len(raw)
+        out = bytearray(HEADER.pack(MAGIC, VERSION, *layout))
+        for (offset, _), raw in zip(zip(layout[::2], layout[1::2]), payload):
+            out += bytes(offset - len(out))
+            out += raw
+        return bytes(out)
+
+
+def _to_bytes(data) -> bytes:
+    if isinstance(data, array):
+        if sys.byteorder == 'big':
+            data = array(data.typecode, data)
+            data.byteswap()
+        return data.tobytes()
+    return data
+
+
+def dumps(root: AstNode) -> bytes:
+    return _Encoder().encode(root)
+
+
+def dump(root: AstNode, path: str):
+    with open(path, 'wb') as f:
+        f.write(dumps(root))
+
+
+class BinaryAst:
+    """Загруженный двоичный AST. Данные читаются по месту, без копирования."""
+
+    def __init__(self, buffer, owner=None):
+        self._owner = owner
+        view = memoryview(buffer)
+        self._views = [view]
+        magic, version, *layout = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Неизвестный формат двоичного AST")
+        tables = {}
+        for name, offset, size in zip(SECTIONS, layout[::2], layout[1::2]):
+            if offset + size > len(view):
+                raise ValueError("Двоичный AST обрезан")
+            tables[name] = view[offset:offset + size]
+            self._views.append(tables[name])
+        self.string_data = tables.pop('string_data')
+        for name, raw in tables.items():
+            typecode = 'd' if name == 'floats' else 'i'
+            if sys.byteorder == 'big':
+                data = array(typecode, raw.tobytes())
+                data.byteswap()
+            else:
+                data = raw.cast(typecode)
+                self._views.append(data)
+            setattr(self, name, data)
+        self._strings: Dict[int, str] = {}
+        self._classes: Dict[int, type] = {}
+
+    def __len__(self) -> int:
+        return len(self.nodes) // NODE_SIZE
+
+    def close(self):
+        while self._views:
+            self._views.pop().release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def root(self) -> 'NodeView':
+        return NodeView(self, 0)
+
+    def string(self, index: int) -> str:
+        text = self._strings.get(index)
+        if text is None:
+            text = bytes(self.string_data[self.strings[index]:self.strings[index + 1]]).decode('utf-8')
+            self._strings[index] = text
+        return text
+
+    def node_class(self, node: int) -> type:
+        tag = self.nodes[node * NODE_SIZE]
+        cls = self._classes.get(tag)
+        if cls is None:
+            module, _, name = self.string(self.classes[tag]).rpartition('.')
+            if module not in RECORD_MODULES:
+                raise ValueError(f"Класс {module}.{name} не разрешён в двоичном AST")
+            cls = getattr(importlib.import_module(module), name, None)
+            # только классы, объявленные в самом модуле, а не импортированные в него
+            if not isinstance(cls, type) or cls.__module__ != module:
+                raise ValueError(f"Класс {module}.{name} не разрешён в двоичном AST")
+            self._classes[tag] = cls
+        return cls
+
+    def node_fields(self, node: int) -> Iterator[Tuple[str, int, int, int]]:
+        _, first, count = self.nodes[node * NODE_SIZE:node * NODE_SIZE + NODE_SIZE]
+        fields = self.fields
+        for pos in range(first * FIELD_SIZE, (first + count) * FIELD_SIZE, FIELD_SIZE):
+            tag = fields[pos]
+            yield self.string(tag >> KIND_BITS), tag & KIND_MASK, fields[pos + 1], fields[pos + 2]
+
+    def decode(self, kind: int, a: int, b: int, node_value):
+        """Значение поля; узлы и записи передаются в node_value(индекс)."""
+        if kind == K_NONE:
+            return None
+        if kind == K_BOOL:
+            return bool(a)
+        if kind == K_INT:
+            return a
+        if kind == K_BIGINT:
+            return int(self.string(a))
+        if kind == K_FLOAT:
+            return self.floats[a]
+        if kind == K_STR:
+            return self.string(a)
+        if kind in (K_NODE, K_RECORD):
+            return node_value(a)
+        if kind in (K_LIST, K_TUPLE):
+            items = self.items
+            values = [self.decode(items[pos], items[pos + 1], items[pos + 2], node_value)
+                      for pos in range(a * ITEM_SIZE, (a + b) * ITEM_SIZE, ITEM_SIZE)]
+            return values if kind == K_LIST else tuple(values)
+        if kind == K_ENUM:
+            module, _, name = self.string(a).rpartition('.')
+            if module not in RECORD_MODULES:
+                raise ValueError(f"Перечисление {module}.{name} не разрешено в двоичном AST")
+            enum = getattr(importlib.import_module(module), name, None)
+            if not isinstance(enum, type) or not issubclass(enum, Enum) or enum.__module__ != module:
+                raise ValueError(f"Перечисление {module}.{name} не разрешено в двоичном AST")
+            return enum[self.string(b)]
+        if kind == K_FUNC:
+            func = function_table().get(self.string(a))
+            if func is None:
+                raise ValueError(f"Функция {self.string(a)} не разрешена в двоичном AST")
+            return func
+        raise ValueError(f"Неизвестный вид значения {kind}")
+
+    def materialize(self, node: int = 0) -> AstNode:
+        """Создаёт объекты поддерева node (без рекурсии по глубине)."""
+        objects: Dict[int, Any] = {}
+        pending: List[int] = []
+
+        def node_value(index):
+            obj = objects.get(index)
+            if obj is None:
+                cls = self.node_class(index)
+                obj = objects[index] = cls.__new__(cls)
+                pending.append(index)
+            return obj
+
+        root = node_value(node)
+        nodes, fields, string, decode = self.nodes, self.fields, self.string, self.decode
+        names = {}
+        while pending:
+            index = pending.pop()
+            attrs = vars(objects[index])
+            first, count = nodes[index * NODE_SIZE + 1], nodes[index * NODE_SIZE + 2]
+            for pos in range(first * FIELD_SIZE, (first + count) * FIELD_SIZE, FIELD_SIZE):
+                tag = fields[pos]
+                kind = tag & KIND_MASK
+                # частые виды разбираем на месте, остальные - через decode
+                if kind == K_INT:
+                    value = fields[pos + 1]
+                elif kind == K_NODE:
+                    value = node_value(fields[pos + 1])
+                elif kind == K_NONE:
+                    value = None
+                else:
+                    value = decode(kind, fields[pos + 1], fields[pos + 2], node_value)
+                name = names.get(tag)
+                if name is None:
+                    name = names[tag] = string(tag >> KIND_BITS)
+                attrs[name] = value
+        return root
+
+    def statements(self) -> Iterator[AstNode]:
+        """Операторы верхнего уровня, материализуемые по одному."""
+        stack = [iter(self.root.stmts)]
+        while stack:
+            stmt = next(stack[-1], None)
+            if stmt is None:
+                stack.pop()
+            elif isinstance(stmt, (list, tuple)):
+                stack.append(iter(stmt))
+            else:
+                yield stmt.materialize()
+
+
+class NodeView:
+    """Ленивое представление узла: поля декодируются при обращении."""
+    __slots__ = ('ast', 'index')
+
+    def __init__(self, ast: BinaryAst, index: int):
+        self.ast = ast
+        self.index = index
+
+    @property
+    def node_type(self) -> type:
+        return self.ast.node_class(self.index)
+
+    @property
+    def field_names(self) -> Tuple[str, ...]:
+        return tuple(name for name, *_ in self.ast.node_fields(self.index))
+
+    def __getattr__(self, name: str):
+        ast = self.ast
+        for field, kind, a, b in ast.node_fields(self.index):
+            if field == name:
+                return ast.decode(kind, a, b, lambda index: NodeView(ast, index))
+        # свойства и атрибуты класса (children, line по умолчанию и т.п.)
+        # берём у настоящего узла
+        return getattr(self.materialize(), name)
+
+    def materialize(self) -> AstNode:
+        return self.ast.materialize(self.index)
+
+    def __str__(self):
+        return str(self.materialize())
+
+    def __repr__(self):
+        return f'NodeView({self.node_type.__name__}, {self.index})'
+
+
+def loads(data: Union[bytes, bytearray, memoryview]) -> BinaryAst:
+    return BinaryAst(data)
+
+
+def load(path: str) -> BinaryAst:
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return BinaryAst(mapped, owner=mapped)
@@ -0,0 +1,31 @@
+"""Собирает mel_parser_standalone.py - парсер MEL без зависимости от lark.
+
+Запускается после каждого изменения грамматики:
+
+    python build_parser.py
+
+Модуль содержит код среды выполнения lark и готовые таблицы LALR.
+Устаревший модуль (GRAMMAR_HASH не совпадает) mel_parser не использует.
+"""
+import io
+import os
+import sys
+
+from lark import Lark
+from lark.tools.standalone import gen_standalone
+
+import mel_parser
+
+OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mel_parser_standalone.py')
+
+
+def build(path: str = OUTPUT):
+    out = io.StringIO()
+    gen_standalone(Lark(mel_parser.GRAMMAR, **mel_parser.PARSER_OPTIONS), out=out, compress=True)
+    out.write(f"\nGRAMMAR_HASH = '{mel_parser.GRAMMAR_HASH}'\n")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(out.getvalue())
+
+
+if __name__ == "__main__":
+    build(*sys.argv[1:])
@@ -0,0 +1,551 @@
+"""Регистровый байткод MEL и виртуальная машина для него.
+
+Код функции - array('i'): код операции и её операнды подряд. Константы
+лежат в общем пуле модуля. Константы, которые IR загружает во временные
+регистры, заранее записываются в шаблон регистров функции, поэтому в
+цикле не выполняются. Вызовы не используют рекурсию Python: кадры лежат в
+явном стеке VM.
+"""
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import ir
+from cse import TEMP_PREFIX
+from mel_ast import BinOp
+from mel_builtins import OutputBuffer, bind_builtins
+from vectors import VECTOR_FUNCS
+
+# Двуместные операции: коды 0..14 совпадают с индексом в BINARY_FUNCS
+BINARY_NAMES = ('add', 'sub', 'mul', 'div', 'mod', 'gt', 'ge', 'lt', 'le', 'eq', 'ne',
+                'bit_and', 'bin_or', 'and', 'or')
+BINARY_FUNCS = tuple(ir.BINARY_OPS[name] for name in BINARY_NAMES)
+# Поэлементные операции над массивами (VECTOR) с теми же кодами
+VECTOR_BY_CODE = tuple(VECTOR_FUNCS.get(BinOp[name.upper()]) for name in BINARY_NAMES)
+(ADD, SUB, MUL, DIV, MOD, GT, GE, LT, LE, EQ, NE, BIT_AND, BIN_OR, AND, OR) = range(len(BINARY_NAMES))
+(CONST, MOVE, JUMP, BRANCH, CALL, RET, NEG, NOT, FLOAT,
+ ARRAY, ALOAD, ASTORE, NEW, GETFIELD, SETFIELD, NATIVE, VECTOR) = range(len(BINARY_NAMES), len(BINARY_NAMES) + 17)
+UNARY_CODES = {'neg': NEG, 'not': NOT, 'float': FLOAT}
+OPCODE_NAMES = dict(enumerate(BINARY_NAMES))
+OPCODE_NAMES.update({code: name.lower() for name, code in (
+    ('CONST', CONST), ('MOVE', MOVE), ('JUMP', JUMP), ('BRANCH', BRANCH), ('CALL', CALL), ('RET', RET),
+    ('NEG', NEG), ('NOT', NOT), ('FLOAT', FLOAT), ('ARRAY', ARRAY), ('ALOAD', ALOAD), ('ASTORE', ASTORE),
+    ('NEW', NEW), ('GETFIELD', GETFIELD), ('SETFIELD', SETFIELD), ('NATIVE', NATIVE),
+    ('VECTOR', VECTOR))})
+NO_REG = -1
+
+MAGIC = b'MELB'
+VERSION = 3
+
+
+class CodeObject:
+    """Скомпилированная функция."""
+
+    def __init__(self, name: str, params: Tuple[int, ...], nregs: int, code: array,
+                 preload: Tuple[Tuple[int, int], ...], var_regs: Dict[str, int]):
+        self.name = name
+        self.params = params
+        self.nregs = nregs
+        self.code = code
+        # (регистр, индекс константы), заполняемые при создании кадра
+        self.preload = preload
+        self.var_regs = var_regs
+        self.template: Optional[list] = None
+
+
+class BytecodeModule:
+    def __init__(self, constants: List[Any], functions: List[CodeObject],
+                 classes: List[Tuple[str, Tuple[Tuple[str, int], ...]]]):
+        self.constants = constants
+        self.functions = functions
+        self.classes = classes
+        self.function_index = {func.name: i for i, func in enumerate(functions)}
+        self.class_index = {name: i for i, (name, _) in enumerate(classes)}
+        for func in functions:
+            template = [None] * func.nregs
+            for reg, const in func.preload:
+                template[reg] = constants[const]
+            func.template = template
+
+    # --- сериализация ---
+
+    def to_bytes(self) -> bytes:
+        """Детерминированное представление: одинаковый модуль - одинаковые байты."""
+        out = bytearray(MAGIC)
+        _write_uint(out, VERSION)
+        _write_uint(out, len(self.constants))
+        for value in self.constants:
+            _write_constant(out, value)
+        _write_uint(out, len(self.classes))
+        for name, fields in self.classes:
+            _write_str(out, name)
+            _write_uint(out, len(fields))
+            for field, const in fields:
+                _write_str(out, field)
+                _write_uint(out, const)
+        _write_uint(out, len(self.functions))
+        for func in self.functions:
+            _write_str(out, func.name)
+            _write_uint(out, func.nregs)
+            _write_ints(out, func.params)
+            _write_ints(out, [x for pair in func.preload for x in pair])
+            _write_uint(out, len(func.var_regs))
+            for name, reg in func.var_regs.items():
+                _write_str(out, name)
+                _write_uint(out, reg)
+            _write_ints(out, func.code)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BytecodeModule':
+        reader = _Reader(data)
+        if reader.take(4) != MAGIC or reader.read_uint() != VERSION:
+            raise ValueError("Неизвестный формат байткода")
+        constants = [reader.read_constant() for _ in range(reader.read_uint())]
+        classes = []
+        for _ in range(reader.read_uint()):
+            name = reader.read_str()
+            fields = tuple((reader.read_str(), reader.read_uint()) for _ in range(reader.read_uint()))
+            classes.append((name, fields))
+        functions = []
+        for _ in range(reader.read_uint()):
+            name, nregs = reader.read_str(), reader.read_uint()
+            params = tuple(reader.read_ints())
+            flat = reader.read_ints()
+            preload = tuple(zip(flat[::2], flat[1::2]))
+            var_regs = {}
+            for _ in range(reader.read_uint()):
+                var_name = reader.read_str()
+                var_regs[var_name] = reader.read_uint()
+            functions.append(CodeObject(name, params, nregs, reader.read_ints(), preload, var_regs))
+        return cls(constants, functions, classes)
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'BytecodeModule':
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def disassemble(self) -> str:
+        lines = []
+        for func in self.functions:
+            lines.append(f'func {func.name} regs={func.nregs} params={list(func.params)}')
+            for reg, const in func.preload:
+                lines.append(f'    preload %{reg} = {self.constants[const]!r}')
+            code, pc = func.code, 0
+            while pc < len(code):
+                size = instruction_size(code, pc)
+                lines.append(f'    {pc:4} {OPCODE_NAMES[code[pc]]} {" ".join(map(str, code[pc + 1:pc + size]))}')
+                pc += size
+        return '\n'.join(lines)
+
+
+def instruction_size(code, pc: int) -> int:
+    op = code[pc]
+    if op < CONST or op in (ALOAD, ASTORE, GETFIELD, SETFIELD, BRANCH):
+        return 4
+    if op in (CONST, MOVE, NEG, NOT, FLOAT, NEW):
+        return 3
+    if op in (JUMP, RET):
+        return 2
+    if op == ARRAY:
+        return 3 + code[pc + 2]
+    if op == VECTOR:
+        return 5
+    if op == CALL or op == NATIVE:
+        return 4 + code[pc + 3]
+    raise ValueError(f"Неизвестный код операции {op}")
+
+
+# --- компиляция IR -> байткод ---
+
+class _ConstantPool:
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def add(self, value) -> int:
+        # type входит в ключ, чтобы True, 1 и 1.0 не склеились
+        key = (type(value), value)
+        if key not in self.index:
+            self.index[key] = len(self.values)
+            self.values.append(value)
+        return self.index[key]
+
+
+def compile_module(module: ir.Module) -> BytecodeModule:
+    pool = _ConstantPool()
+    function_names = list(module.functions)
+    function_index = {name: i for i, name in enumerate(function_names)}
+    class_names = list(module.classes)
+    class_index = {name: i for i, name in enumerate(class_names)}
+    classes = [(name, tuple((field, pool.add(default)) for field, default in module.classes[name]))
+               for name in class_names]
+    functions = [_compile_function(module.functions[name], pool, function_index, class_index)
+                 for name in function_names]
+    return BytecodeModule(pool.values, functions, classes)
+
+
+def _compile_function(func: ir.Function, pool: _ConstantPool, function_index, class_index) -> CodeObject:
+    var_set = set(func.var_regs.values())
+    code, offsets, fixups, preload = [], {}, [], []
+    for block in func.blocks.values():
+        offsets[block.label] = len(code)
+        for instr in block.instrs:
+            op, dst, args = instr.op, instr.dst, instr.args
+            if op == 'const':
+                if dst in var_set:
+                    code += [CONST, dst, pool.add(args[0])]
+                else:
+                    preload.append((dst, pool.add(args[0])))
+            elif op == 'move':
+                code += [MOVE, dst, args[0]]
+            elif op in ir.BINARY_OPS:
+                code += [BINARY_NAMES.index(op), dst, args[0], args[1]]
+            elif op in UNARY_CODES:
+                code += [UNARY_CODES[op], dst, args[0]]
+            elif op == 'array':
+                code += [ARRAY, dst, len(args), *args]
+            elif op == 'aload':
+                code += [ALOAD, dst, args[0], args[1]]
+            elif op == 'astore':
+                code += [ASTORE, args[0], args[1], args[2]]
+            elif op == 'new':
+                code += [NEW, dst, class_index[args[0]]]
+            elif op == 'getfield':
+                code += [GETFIELD, dst, args[0], pool.add(args[1])]
+            elif op == 'setfield':
+                code += [SETFIELD, args[0], pool.add(args[1]), args[2]]
+            elif op == 'call':
+                code += [CALL, NO_REG if dst is None else dst, function_index[args[0]], len(args) - 1, *args[1:]]
+            elif op == 'vector':
+                code += [VECTOR, dst, BINARY_NAMES.index(args[0]), args[1], args[2]]
+            elif op == 'native':
+                # имя встроенной функции - константа, VM связывает его при загрузке
+                code += [NATIVE, NO_REG if dst is None else dst, pool.add(args[0]), len(args) - 1, *args[1:]]
+            elif op == 'jump':
+                fixups.append((len(code) + 1, args[0]))
+                code += [JUMP, 0]
+            elif op == 'branch':
+                fixups.append((len(code) + 2, args[1]))
+                fixups.append((len(code) + 3, args[2]))
+                code += [BRANCH, args[0], 0, 0]
+            elif op == 'ret':
+                code += [RET, args[0] if args else NO_REG]
+            else:
+                raise ValueError(f"Неизвестная инструкция IR {instr}")
+    for pos, label in fixups:
+        code[pos] = offsets[label]
+    return CodeObject(func.name, func.param_regs, func.nregs, array('i', code), tuple(preload),
+                      dict(func.var_regs))
+
+
+def compile_program(prog) -> BytecodeModule:
+    return compile_module(ir.lower(prog))
+
+
+# Модули, от которых зависит байткод программы: разбор, анализ, проходы
+# оптимизации и генерация кода
+COMPILER_MODULES = ('mel_parser', 'canonicalize', 'mel_ast', 'mel_types', 'mel_builtins', 'semantics',
+                    'specialize', 'inliner', 'dce', 'cse', 'constarrays', 'vectors', 'program', 'ir',
+                    'bytecode')
+_fingerprint = None
+
+
+def compiler_fingerprint() -> bytes:
+    """sha256 исходных текстов COMPILER_MODULES: меняется при любой
+    правке компилятора, даже если формат (VERSION) остался прежним."""
+    global _fingerprint
+    if _fingerprint is None:
+        import importlib
+        digest = hashlib.sha256()
+        for name in COMPILER_MODULES:
+            with open(importlib.import_module(name).__file__, 'rb') as f:
+                digest.update(f.read())
+        _fingerprint = digest.digest()
+    return _fingerprint
+
+
+def load_or_compile(source: str, cache_dir: str) -> BytecodeModule:
+    """Байткод программы из кеша на диске; при промахе - компиляция и запись.
+
+    Ключ кеша - sha256 текста программы, версии формата и
+    compiler_fingerprint().
+    """
+    from program import compile_program as check_program
+
+    key = hashlib.sha256(source.encode('utf-8') + struct.pack('<I', VERSION)
+                         + compiler_fingerprint()).hexdigest()
+    path = os.path.join(cache_dir, key + '.melb')
+    if os.path.exists(path):
+        return BytecodeModule.load(path)
+    module = compile_checked(check_program(source))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    module.save(tmp_path)
+    os.replace(tmp_path, path)
+    return module
+
+
+def compile_checked(prog) -> BytecodeModule:
+    """Байткод проверенной программы (program.Program)."""
+    return compile_module(ir.lower(_program_ast(prog)))
+
+
+def _program_ast(prog):
+    from mel_ast import StmtListNode
+    return StmtListNode(*prog.classes.values(), *prog.functions.values(), *prog.body)
+
+
+# --- VM ---
+
+class Execution:
+    """Состояние выполнения функции на VM, которое можно приостановить.
+
+    steps - число выполненных шагов: переходов (JUMP, BRANCH) и вызовов.
+    Без них код выполняется за конечное число инструкций, поэтому
+    бюджет в шагах ограничивает и циклы, и рекурсию.
+    """
+    __slots__ = ('func', 'code', 'regs', 'pc', 'frames', 'result', 'steps', 'done', 'value')
+
+    def __init__(self, func: CodeObject, regs: list, result: bool):
+        self.func = func
+        self.code = func.code
+        self.regs = regs
+        self.pc = 0
+        self.frames = []
+        self.result = result
+        self.steps = 0
+        self.done = False
+        self.value = None
+
+
+class VM:
+    def __init__(self, module: BytecodeModule, output: Optional[OutputBuffer] = None):
+        self.module = module
+        self.output = OutputBuffer() if output is None else output
+        bound = bind_builtins(self.output)
+        # индекс константы с именем -> функция; неизвестное имя - ошибка при вызове
+        self.natives = {i: bound[value] for i, value in enumerate(module.constants)
+                        if type(value) is str and value in bound}
+
+    def run(self, globals: Optional[Dict[str, Any]] = None) -> dict:
+        execution = self.start_main(globals)
+        try:
+            self.resume(execution)
+        finally:
+            self.output.flush()
+        return execution.value
+
+    def call(self, name: str, *args):
+        try:
+            return self.execute(self.module.functions[self.module.function_index[name]], args, result=True)
+        finally:
+            self.output.flush()
+
+    def start_main(self, globals: Optional[Dict[str, Any]] = None) -> Execution:
+        """Execution программы верхнего уровня; globals - значения
+        переменных, которые задаёт хост. Результат - словарь переменных."""
+        main = self.module.functions[self.module.function_index[ir.MAIN]]
+        execution = self.start(main, ())
+        for name, value in (globals or {}).items():
+            reg = main.var_regs.get(name)
+            if reg is not None:
+                execution.regs[reg] = value
+        return execution
+
+    def start(self, func: CodeObject, args, result: bool = False) -> Execution:
+        regs = func.template[:]
+        for reg, arg in zip(func.params, args):
+            regs[reg] = arg
+        return Execution(func, regs, result)
+
+    def execute(self, func: CodeObject, args, result=False):
+        execution = self.start(func, args, result)
+        self.resume(execution)
+        return execution.value
+
+    def resume(self, execution: Execution, budget: Optional[int] = None) -> bool:
+        """Продолжает выполнение, пока оно не закончится или не будет
+        сделано budget шагов (None - без ограничения). Возвращает
+        execution.done; результат - execution.value."""
+        functions, constants, classes = self.module.functions, self.module.constants, self.module.classes
+        natives = self.natives
+        binary = BINARY_FUNCS
+        func, code, regs, pc, frames = execution.func, execution.code, execution.regs, execution.pc, execution.frames
+        # шаги считаются вниз до нуля только на переходах и вызовах
+        left = sys.maxsize if budget is None else budget
+        try:
+            while True:
+                op = code[pc]
+                if op < CONST:
+                    regs[code[pc + 1]] = binary[op](regs[code[pc + 2]], regs[code[pc + 3]])
+                    pc += 4
+                elif op == BRANCH:
+                    if left <= 0:
+                        return False
+                    left -= 1
+                    pc = code[pc + 2] if regs[code[pc + 1]] else code[pc + 3]
+                elif op == JUMP:
+                    if left <= 0:
+                        return False
+                    left -= 1
+                    pc = code[pc + 1]
+                elif op == MOVE:
+                    regs[code[pc + 1]] = regs[code[pc + 2]]
+                    pc += 3
+                elif op == CONST:
+                    regs[code[pc + 1]] = constants[code[pc + 2]]
+                    pc += 3
+                elif op == CALL:
+                    if left <= 0:
+                        return False
+                    left -= 1
+                    callee = functions[code[pc + 2]]
+                    nargs = code[pc + 3]
+                    new_regs = callee.template[:]
+                    for i, reg in enumerate(callee.params[:nargs]):
+                        new_regs[reg] = regs[code[pc + 4 + i]]
+                    frames.append((func, code, regs, pc + 4 + nargs, code[pc + 1]))
+                    func, code, regs, pc = callee, callee.code, new_regs, 0
+                elif op == RET:
+                    value = regs[code[pc + 1]] if code[pc + 1] != NO_REG else None
+                    if not frames:
+                        if execution.result:
+                            execution.value = value
+                        else:
+                            execution.value = {name: regs[reg] for name, reg in func.var_regs.items()
+                                               if not name.startswith(TEMP_PREFIX)}
+                        execution.done = True
+                        return True
+                    func, code, regs, pc, dst = frames.pop()
+                    if dst != NO_REG:
+                        regs[dst] = value
+                elif op == ALOAD:
+                    regs[code[pc + 1]] = regs[code[pc + 2]][regs[code[pc + 3]]]
+                    pc += 4
+                elif op == ASTORE:
+                    regs[code[pc + 1]][regs[code[pc + 2]]] = regs[code[pc + 3]]
+                    pc += 4
+                elif op == ARRAY:
+                    n = code[pc + 2]
+                    regs[code[pc + 1]] = [regs[r] for r in code[pc + 3:pc + 3 + n]]
+                    pc += 3 + n
+                elif op == NEG:
+                    regs[code[pc + 1]] = -regs[code[pc + 2]]
+                    pc += 3
+                elif op == NOT:
+                    regs[code[pc + 1]] = not regs[code[pc + 2]]
+                    pc += 3
+                elif op == FLOAT:
+                    regs[code[pc + 1]] = float(regs[code[pc + 2]])
+                    pc += 3
+                elif op == NEW:
+                    regs[code[pc + 1]] = {field: constants[const] for field, const in classes[code[pc + 2]][1]}
+                    pc += 3
+                elif op == GETFIELD:
+                    regs[code[pc + 1]] = regs[code[pc + 2]][constants[code[pc + 3]]]
+                    pc += 4
+                elif op == SETFIELD:
+                    regs[code[pc + 1]][constants[code[pc + 2]]] = regs[code[pc + 3]]
+                    pc += 4
+                elif op == VECTOR:
+                    regs[code[pc + 1]] = VECTOR_BY_CODE[code[pc + 2]](regs[code[pc + 3]], regs[code[pc + 4]])
+                    pc += 5
+                elif op == NATIVE:
+                    nargs = code[pc + 3]
+                    value = natives[code[pc + 2]](*[regs[r] for r in code[pc + 4:pc + 4 + nargs]])
+                    if code[pc + 1] != NO_REG:
+                        regs[code[pc + 1]] = value
+                    pc += 4 + nargs
+                else:
+                    raise ValueError(f"Неизвестный код операции {op}")
+        finally:
+            # инструкция на pc ещё не выполнена: с неё выполнение и продолжится
+            execution.func, execution.code, execution.regs, execution.pc = func, code, regs, pc
+            if budget is not None:
+                execution.steps += budget - left
+
+
+# --- двоичный формат ---
+
+def _write_uint(out: bytearray, value: int):
+    out += struct.pack('<I', value)
+
+
+def _write_str(out: bytearray, text: str):
+    data = text.encode('utf-8')
+    _write_uint(out, len(data))
+    out += data
+
+
+def _write_ints(out: bytearray, values):
+    data = array('i', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    _write_uint(out, len(data))
+    out += data.tobytes()
+
+
+def _write_constant(out: bytearray, value):
+    if value is None:
+        out += b'N'
+    elif isinstance(value, bool):
+        out += b'T' if value else b'F'
+    elif isinstance(value, int):
+        out += b'I'
+        _write_str(out, str(value))
+    elif isinstance(value, float):
+        out += b'D' + struct.pack('<d', value)
+    elif isinstance(value, str):
+        out += b'S'
+        _write_str(out, value)
+    else:
+        raise ValueError(f"Константа {value!r} не сериализуется")
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def take(self, n: int) -> bytes:
+        if self.pos + n > len(self.data):
+            raise ValueError("Байткод обрезан")
+        chunk = bytes(self.data[self.pos:self.pos + n])
+        self.pos += n
+        return chunk
+
+    def read_uint(self) -> int:
+        return struct.unpack('<I', self.take(4))[0]
+
+    def read_str(self) -> str:
+        return self.take(self.read_uint()).decode('utf-8')
+
+    def read_ints(self) -> array:
+        n = self.read_uint()
+        values = array('i')
+        values.frombytes(self.take(4 * n))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def read_constant(self):
+        tag = self.take(1)
+        if tag == b'N':
+            return None
+        if tag in (b'T', b'F'):
+            return tag == b'T'
+        if tag == b'I':
+            return int(self.read_str())
+        if tag == b'D':
+            return struct.unpack('<d', self.take(8))[0]
+        if tag == b'S':
+            return self.read_str()
+        raise ValueError(f"Неизвестный тег константы {tag!r}")
@@ -0,0 +1,115 @@
+"""Каноническая форма AST, в которую mel_parser приводит каждую программу.
+
+Построитель AST оставляет вложенные списки (StmtListNode.stmts,
+VarsDeclNode.vars), пустые операторы и два вида циклов. canonicalize
+за один проход по операторам:
+
+- превращает списки операторов и объявленных переменных в плоские кортежи;
+- убирает пустые операторы (EmptyNode и пустые блоки внутри блока);
+- переписывает `for (init; cond; step) body` в
+  `{ init; while (cond) { body; step } }`, пустое условие - в true;
+- разбивает `int a, b = 1;` на объявления по одной переменной.
+
+Дальше интерпретатор, анализатор и генератор IR перебирают операторы
+напрямую, без разворачивания списков при каждом выполнении.
+"""
+from mel_ast import *
+
+
+def _flat(items) -> Iterator[AstNode]:
+    for item in items:
+        if isinstance(item, (list, tuple)):
+            yield from _flat(item)
+        elif item is not None:
+            yield item
+
+
+def _positioned(node: AstNode, origin: AstNode) -> AstNode:
+    node.line, node.column = origin.line, origin.column
+    node.end_line, node.end_column = origin.end_line, origin.end_column
+    return node
+
+
+def _split_decl(decl: VarsDeclNode) -> Tuple[VarsDeclNode, ...]:
+    if len(decl.vars) <= 1:
+        return decl,
+    parts = []
+    for var in decl.vars:
+        part = _positioned(VarsDeclNode(decl.type), decl)
+        part.vars = var,
+        parts.append(part)
+    return tuple(parts)
+
+
+def _statements(items) -> Tuple[AstNode, ...]:
+    return _pruned(_canonical(stmt) for stmt in _flat(items))
+
+
+def _pruned(items) -> Tuple[AstNode, ...]:
+    # items уже канонические: повторный обход вложенных for был бы
+    # экспоненциальным по глубине вложенности
+    stmts = []
+    for stmt in items:
+        cls = type(stmt)
+        if stmt is None or cls is EmptyNode or cls is StmtListNode and not stmt.stmts:
+            continue
+        if cls is VarsDeclNode:
+            stmts.extend(_split_decl(stmt))
+        else:
+            stmts.append(stmt)
+    return tuple(stmts)
+
+
+def _statement(stmt: AstNode) -> AstNode:
+    # Оператор вне блока (ветка if, тело цикла): несколько объявлений
+    # становятся блоком, как если бы их записали в фигурных скобках
+    stmt = _canonical(stmt)
+    if type(stmt) is VarsDeclNode and len(stmt.vars) > 1:
+        return _positioned(StmtListNode(*_split_decl(stmt)), stmt)
+    return stmt
+
+
+def _desugar_for(node: ForNode) -> StmtListNode:
+    cond = node.cond
+    if cond is None or isinstance(cond, EmptyNode):
+        cond = _positioned(LiteralNode('true'), node)
+    body = _canonical(node.body)
+    if type(body) is VarsDeclNode:
+        # объявления тела не должны попасть в одну область видимости с шагом
+        body = _positioned(StmtListNode(*_split_decl(body)), body)
+    loop_body = _positioned(StmtListNode(*_pruned((body, _canonical(node.step)))), node.body)
+    loop = _positioned(WhileNode(cond, loop_body), node)
+    return _positioned(StmtListNode(*_pruned((_canonical(node.init), loop))), node)
+
+
+def _canonical(node: AstNode) -> AstNode:
+    # Операторы не бывают внутри выражений, поэтому обходятся только они
+    cls = type(node)
+    if cls is StmtListNode:
+        node.stmts = _statements(node.stmts)
+    elif cls is VarsDeclNode:
+        node.vars = tuple(_flat(node.vars))
+    elif cls is IfNode:
+        node.then_stmt = _statement(node.then_stmt)
+        if node.else_stmt is not None:
+            node.else_stmt = _statement(node.else_stmt)
+    elif cls is WhileNode:
+        node.body = _statement(node.body)
+    elif cls is ForNode:
+        return _desugar_for(node)
+    elif cls is FuncDeclNode:
+        if node.params is not None:
+            for param in node.params.vars:
+                _canonical(param)
+        if node.body is not None:
+            node.body = _canonical(node.body)
+    elif cls is ClassDeclNode:
+        if node.body is not None:
+            node.body = _canonical(node.body)
+    return node
+
+
+def canonicalize(prog: AstNode) -> AstNode:
+    """Приводит дерево к канонической форме (изменяя его на месте) и
+    возвращает новый корень."""
+    return _canonical(prog)
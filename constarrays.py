@@ -0,0 +1,93 @@
+"""Литералы массивов из констант.
+
+`{1, 2, 3}` из одних литералов вычисляется один раз при компиляции:
+ConstArrayNode хранит шаблон значений, а выполнение копирует его одним
+list.copy вместо вычисления каждого элемента - и в операторах, и в
+инициализаторах полей, которые eval_NewInstanceNode выполняет для
+каждого объекта.
+
+Копия не нужна совсем, если массив локальной переменной функции только
+читается: переменная объявлена этим литералом один раз, нигде больше не
+присваивается, её элементы не меняются, а сама она только индексируется,
+сравнивается, участвует в поэлементных операциях (они дают новый массив)
+и передаётся чистым встроенным функциям. Тогда все вызовы разделяют сам
+шаблон. Массивы верхнего уровня всегда копируются: их получает хост.
+"""
+from collections import Counter
+from typing import AbstractSet, Mapping
+
+from mel_ast import *
+from semantics import walk
+from vectors import VECTOR_OPS
+
+# Операции над массивом, результат которых не ссылается на операнд
+READ_ONLY_OPS = set(VECTOR_OPS) | {BinOp.EQ, BinOp.NE}
+
+
+def _constant(node: ArrayNode) -> bool:
+    return all(type(element) is LiteralNode for element in node.elements)
+
+
+class _ReadOnlyArrays:
+    def __init__(self, signatures: Mapping[str, dict]):
+        # встроенные функции, не перекрытые функциями программы
+        self.builtins = {name for name, info in signatures.items() if 'node' not in info and info.get('pure')}
+
+    def allowed(self, parent: AstNode, attr: str, decl: AssignNode) -> bool:
+        """Можно ли переменной массива стоять в поле attr узла parent."""
+        cls = type(parent)
+        if cls is ArrayIndexNode:
+            return True
+        if isinstance(parent, BinOpNode):
+            return parent.op in READ_ONLY_OPS
+        if cls is FuncCallNode:
+            return attr == 'func' or parent.func.name in self.builtins
+        if cls is MemberAccessNode:
+            return attr == 'member'
+        return parent is decl and attr == 'var'
+
+    def shared(self, body: AstNode) -> AbstractSet[int]:
+        """id литералов, которые в теле функции можно не копировать."""
+        decls = {}
+        definitions = Counter()
+        for sub in walk(body):
+            if type(sub) is AssignNode and type(sub.var) is IdentNode:
+                definitions[sub.var.name] += 1
+                if type(sub.val) is ArrayNode and _constant(sub.val):
+                    decls[sub.var.name] = sub
+            elif type(sub) is VarsDeclNode:
+                definitions.update(var.name for var in sub.vars if type(var) is IdentNode)
+        candidates = {name: decl for name, decl in decls.items() if definitions[name] == 1}
+        if not candidates:
+            return frozenset()
+        for parent in walk(body):
+            for attr, value in vars(parent).items():
+                for child in value if type(value) is tuple or type(value) is list else (value,):
+                    if type(child) is not IdentNode or child.name not in candidates:
+                        continue
+                    if type(parent) is ArrayAssignNode or not self.allowed(parent, attr, candidates[child.name]):
+                        del candidates[child.name]
+                        if not candidates:
+                            return frozenset()
+        return {id(decl.val) for decl in candidates.values()}
+
+
+def fold_constant_arrays(prog: StmtListNode, signatures: Mapping[str, dict]) -> StmtListNode:
+    """Заменяет литералы массивов из констант на ConstArrayNode (после
+    SemanticAnalyzer, signatures - его таблица functions)."""
+    analysis = _ReadOnlyArrays(signatures)
+    shared = set()
+    for stmt in prog.stmts:
+        if type(stmt) is FuncDeclNode and stmt.body is not None:
+            shared |= analysis.shared(stmt.body)
+
+    def fold(node: AstNode) -> AstNode:
+        if type(node) is not ArrayNode or not _constant(node):
+            return node
+        folded = ConstArrayNode([element.value for element in node.elements], id(node) in shared)
+        folded.sem_type = node.sem_type
+        folded.line, folded.column = node.line, node.column
+        folded.end_line, folded.end_column = node.end_line, node.end_column
+        return folded
+
+    return prog.transform(fold)
@@ -0,0 +1,89 @@
+"""Кооперативное выполнение MEL в asyncio.
+
+Interpreter.eval рекурсивен и не может остановиться посреди программы,
+поэтому асинхронный режим выполняет байткод: кадры VM лежат в явном
+стеке, и выполнение приостанавливается между любыми двумя шагами.
+AsyncRunner выполняет программу порциями по slice_steps шагов (переходов
+и вызовов) и между порциями отдаёт управление циклу событий. Так на
+одном цикле событий выполняется много программ, и ни одна не занимает
+его дольше одной порции.
+
+Ограничения выполнения:
+
+- max_steps - бюджет шагов на одно выполнение, при превышении -
+  StepLimitExceeded;
+- timeout - секунды по часам цикла событий, при превышении -
+  DeadlineExceeded. Время проверяется между порциями, поэтому
+  превышение не больше одной порции.
+
+Прерванное выполнение просто отбрасывается: состояние VM у каждого
+выполнения своё. Накопленный вывод print/write сбрасывается и при ошибке.
+"""
+import asyncio
+from typing import Any, Dict, Optional
+
+import bytecode
+from mel_builtins import OutputBuffer
+
+# Шагов в одной порции между переключениями на цикл событий
+STEP_SLICE = 10000
+
+
+class ExecutionLimitExceeded(Exception):
+    def __init__(self, message: str, steps: int):
+        super().__init__(message)
+        self.steps = steps
+
+
+class StepLimitExceeded(ExecutionLimitExceeded):
+    pass
+
+
+class DeadlineExceeded(ExecutionLimitExceeded):
+    pass
+
+
+class AsyncRunner:
+    """Выполняет модуль байткода в asyncio с ограничениями на шаги и время.
+
+    Один объект можно использовать из многих задач одновременно:
+    у каждого вызова run/call своя VM.
+    """
+
+    def __init__(self, module: bytecode.BytecodeModule, slice_steps: int = STEP_SLICE,
+                 max_steps: Optional[int] = None, timeout: Optional[float] = None):
+        if slice_steps <= 0:
+            raise ValueError("slice_steps должен быть положительным")
+        self.module = module
+        self.slice_steps = slice_steps
+        self.max_steps = max_steps
+        self.timeout = timeout
+
+    async def run(self, globals: Optional[Dict[str, Any]] = None,
+                  output: Optional[OutputBuffer] = None) -> dict:
+        """Выполняет программу; результат - переменные верхнего уровня."""
+        vm = bytecode.VM(self.module, output)
+        return await self._drive(vm, vm.start_main(globals))
+
+    async def call(self, name: str, *args, output: Optional[OutputBuffer] = None):
+        vm = bytecode.VM(self.module, output)
+        func = self.module.functions[self.module.function_index[name]]
+        return await self._drive(vm, vm.start(func, args, result=True))
+
+    async def _drive(self, vm: bytecode.VM, execution: bytecode.Execution):
+        loop = asyncio.get_running_loop()
+        deadline = None if self.timeout is None else loop.time() + self.timeout
+        try:
+            while True:
+                budget = self.slice_steps
+                if self.max_steps is not None:
+                    budget = max(0, min(budget, self.max_steps - execution.steps))
+                if vm.resume(execution, budget):
+                    return execution.value
+                if self.max_steps is not None and execution.steps >= self.max_steps:
+                    raise StepLimitExceeded(f"Превышен бюджет в {self.max_steps} шагов", execution.steps)
+                if deadline is not None and loop.time() >= deadline:
+                    raise DeadlineExceeded(f"Превышено время выполнения {self.timeout} с", execution.steps)
+                await asyncio.sleep(0)
+        finally:
+            vm.output.flush()
@@ -0,0 +1,387 @@
+"""Устранение общих подвыражений и вынос инвариантов из циклов.
+
+Проход по канонической программе после анализа (нужны sem_type):
+
+- в блоке операторов выражение, которое вычисляется повторно (`a * b`,
+  `arr[i] + 1`), вычисляется один раз во временную переменную перед
+  оператором с первым вхождением. Значение верно, пока не присвоена ни
+  одна из его переменных; выражения с индексацией и полями - ещё и пока
+  нет записи в элемент массива или поле и вызова нечистой функции (она
+  может изменить переданный массив). Кандидаты - выражения примитивных
+  типов из переменных, литералов, операций, индексации, полей и вызовов
+  чистых функций: копия массива или объекта была бы общей для всех
+  вхождений;
+- в цикле while выражение, переменные которого в цикле не присваиваются,
+  вычисляется один раз перед циклом. Выносятся только операции, которые
+  не могут завершиться ошибкой (без деления, индексации и вызовов): цикл
+  может не выполниться ни разу. По той же причине не выносятся выражения
+  с переменными, объявленными в функции без значения: до присваивания
+  они равны None.
+
+Временные переменные получают имена с TEMP_PREFIX, которых нет в
+исходном тексте; ExecutionContext.run не возвращает их хосту.
+"""
+from collections import defaultdict
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+from mel_ast import *
+from mel_types import INT, FLOAT, BOOL
+from semantics import PURE_TYPES, assigned_names, read_idents, refresh_counted_loop, walk
+
+TEMP_PREFIX = '$'
+# Меньшие выражения дешевле вычислить повторно, чем объявить переменную
+CSE_MIN_SIZE = 3
+
+# Операции, которые не завершаются ошибкой на значениях этих типов
+HOISTABLE_OPS = {BinOp.ADD, BinOp.SUB, BinOp.MUL, BinOp.EQ, BinOp.NE, BinOp.GT, BinOp.GE, BinOp.LT, BinOp.LE,
+                 BinOp.AND, BinOp.OR}
+HOISTABLE_TYPES = (INT, FLOAT, BOOL)
+
+
+class CseReport(NamedTuple):
+    temps: int
+    reused: int
+    hoisted: int
+
+    def __str__(self) -> str:
+        return f'временных: {self.temps}, повторных вычислений убрано: {self.reused}, вынесено из циклов: {self.hoisted}'
+
+
+class _Group:
+    """Вхождения одного выражения между присваиваниями его переменных."""
+    __slots__ = ('key', 'node', 'first', 'last', 'count', 'names', 'memory', 'temp')
+
+    def __init__(self, key, node: ExprNode, index: int):
+        self.key = key
+        self.node = node
+        self.first = self.last = index
+        self.count = 1
+        self.names = {ident.name for ident in read_idents(node)}
+        self.memory = any(type(sub) is ArrayIndexNode or type(sub) is MemberAccessNode for sub in walk(node))
+        self.temp = None
+
+
+def _size(node) -> int:
+    return sum(1 for _ in walk(node))
+
+
+def _operands(node: AstNode) -> Tuple[AstNode, ...]:
+    # Подвыражения, которые вычисляются всегда, когда вычисляется node
+    cls = type(node)
+    if isinstance(node, BinOpNode):
+        return (node.arg1,) if node.op in (BinOp.AND, BinOp.OR) else (node.arg1, node.arg2)
+    if cls is UnaryOpNode or cls is CoerceNode:
+        return node.arg,
+    if cls is FuncCallNode:
+        return node.params
+    if cls is MemberAccessNode:
+        return node.obj,
+    if cls is ArrayIndexNode:
+        return node.array, node.index
+    if cls is ArrayNode:
+        return tuple(node.elements)
+    return ()
+
+
+def _positions(stmt: AstNode) -> Tuple[Tuple[AstNode, str], ...]:
+    """(узел, атрибут) выражений, которые оператор вычисляет ровно один
+    раз; атрибут может быть кортежем выражений (аргументы вызова)."""
+    cls = type(stmt)
+    if cls is AssignNode:
+        return (stmt, 'val'),
+    if cls is VarsDeclNode:
+        return tuple((var, 'val') for var in stmt.vars if type(var) is AssignNode)
+    if cls is ReturnNode:
+        if stmt.result is None:
+            return ()
+        # хвостовой вызов должен остаться вызовом
+        return ((stmt.result, 'params'),) if stmt.tail else ((stmt, 'result'),)
+    if cls is IfNode:
+        return (stmt, 'cond'),
+    if cls is ArrayAssignNode:
+        return (stmt, 'index'), (stmt, 'value')
+    if cls is FuncCallNode:
+        # вызов-оператор: результат не нужен, общими могут быть аргументы
+        return (stmt, 'params'),
+    return ()
+
+
+def _expressions(owner: AstNode, attr: str) -> Tuple[AstNode, ...]:
+    value = getattr(owner, attr)
+    return value if type(value) is tuple else (value,)
+
+
+def _hoistable(node: AstNode, assigned) -> bool:
+    cls = type(node)
+    if cls is LiteralNode:
+        return True
+    if cls is IdentNode:
+        return node.name not in assigned
+    if node.sem_type not in HOISTABLE_TYPES:
+        return False
+    if isinstance(node, BinOpNode):
+        return node.op in HOISTABLE_OPS and _hoistable(node.arg1, assigned) and _hoistable(node.arg2, assigned)
+    if cls is UnaryOpNode or cls is CoerceNode:
+        return _hoistable(node.arg, assigned)
+    return False
+
+
+def _uninitialized(body: AstNode) -> frozenset:
+    return frozenset(var.name for sub in walk(body) if type(sub) is VarsDeclNode
+                     for var in sub.vars if type(var) is IdentNode)
+
+
+class CommonSubexpressions:
+    def __init__(self, signatures: Mapping[str, dict]):
+        self.signatures = signatures
+        self.temps = self.reused = self.hoisted = 0
+        self._keys: Dict[int, object] = {}
+        # переменные текущей функции, объявленные без значения
+        self.uninitialized = frozenset()
+
+    def run(self, prog: StmtListNode) -> Tuple[StmtListNode, CseReport]:
+        for stmt in prog.stmts:
+            if type(stmt) is FuncDeclNode and stmt.body is not None:
+                self.uninitialized = _uninitialized(stmt.body)
+                stmt.body = self.statement(stmt.body)
+        self.uninitialized = _uninitialized(prog)
+        self.block(prog)
+        return prog, CseReport(self.temps, self.reused, self.hoisted)
+
+    def new_temp(self, expr: ExprNode, origin: AstNode) -> Tuple[IdentNode, VarsDeclNode]:
+        name = f'{TEMP_PREFIX}t{self.temps}'
+        self.temps += 1
+        var = IdentNode(name)
+        var.sem_type = expr.sem_type
+        decl = VarsDeclNode(TypeDeclNode(str(expr.sem_type)))
+        decl.vars = AssignNode(var, expr),
+        for node in (var, decl, decl.vars[0]):
+            node.line, node.column = origin.line, origin.column
+        return var, decl
+
+    @staticmethod
+    def use(temp: IdentNode, origin: AstNode) -> IdentNode:
+        var = IdentNode(temp.name)
+        var.sem_type = temp.sem_type
+        var.line, var.column = origin.line, origin.column
+        return var
+
+    # --- обход операторов ---
+
+    def statement(self, stmt: AstNode) -> AstNode:
+        """Обрабатывает оператор-блок или одиночный оператор (ветку if,
+        тело цикла); одиночный становится блоком, если перед ним
+        понадобились временные."""
+        if type(stmt) is StmtListNode:
+            self.block(stmt)
+            return stmt
+        block = StmtListNode(stmt)
+        block.line, block.column = stmt.line, stmt.column
+        self.block(block)
+        return block.stmts[0] if len(block.stmts) == 1 else block
+
+    def block(self, node: StmtListNode):
+        stmts = []
+        for stmt in node.stmts:
+            stmts.extend(self.nested(stmt))
+        node.stmts = self.eliminate(stmts)
+
+    def nested(self, stmt: AstNode) -> List[AstNode]:
+        """Обрабатывает вложенные блоки; возвращает оператор вместе с
+        вынесенными перед ним инвариантами."""
+        cls = type(stmt)
+        if cls is StmtListNode:
+            self.block(stmt)
+        elif cls is IfNode:
+            stmt.then_stmt = self.statement(stmt.then_stmt)
+            if stmt.else_stmt is not None:
+                stmt.else_stmt = self.statement(stmt.else_stmt)
+        elif cls is WhileNode:
+            step = stmt.body.stmts[-1] if type(stmt.body) is StmtListNode and stmt.body.stmts else None
+            stmt.body = self.statement(stmt.body)
+            decls = self.hoist(stmt)
+            refresh_counted_loop(stmt, step)
+            return decls + [stmt]
+        return [stmt]
+
+    # --- вынос инвариантов ---
+
+    def hoist(self, loop: WhileNode) -> List[VarsDeclNode]:
+        self._keys.clear()
+        assigned = assigned_names(loop) | self.uninitialized
+        temps, decls = {}, []
+
+        def replace(node: AstNode) -> Optional[AstNode]:
+            if type(node) is IdentNode or type(node) is LiteralNode or not _hoistable(node, assigned):
+                return None
+            key = self.key(node)
+            if key not in temps:
+                temps[key], decl = self.new_temp(node, node)
+                decls.append(decl)
+            self.hoisted += 1
+            return self.use(temps[key], node)
+
+        self.replace_expressions(loop, replace)
+        # границы вложенных циклов со счётчиком могли стать временными
+        for sub in walk(loop.body):
+            if type(sub) is WhileNode and sub.counted is not None and isinstance(sub.cond, BinOpNode):
+                sub.counted.bound = sub.cond.arg2
+        return decls
+
+    def replace_expressions(self, node: AstNode, replace):
+        for name, value in vars(node).items():
+            if type(value) is tuple or type(value) is list:
+                items = [self.replaced(item, replace) for item in value]
+                setattr(node, name, type(value)(items))
+            elif isinstance(value, AstNode):
+                setattr(node, name, self.replaced(value, replace))
+
+    def replaced(self, node, replace):
+        if not isinstance(node, AstNode) or type(node) is FuncDeclNode:
+            return node
+        result = replace(node) if isinstance(node, (ExprNode, ArrayIndexNode)) else None
+        if result is not None:
+            return result
+        self.replace_expressions(node, replace)
+        return node
+
+    # --- общие подвыражения в блоке ---
+
+    def key(self, node: AstNode):
+        """Структурный ключ выражения или None, если оно не кандидат."""
+        key = self._keys.get(id(node), self)
+        if key is not self:
+            return key
+        cls = type(node)
+        if cls is LiteralNode:
+            key = ('literal', type(node.value), node.value)
+        elif cls is IdentNode:
+            key = ('var', node.name)
+        else:
+            args = (node.arg1, node.arg2) if isinstance(node, BinOpNode) else _operands(node)
+            operands = tuple(self.key(arg) for arg in args)
+            if None in operands:
+                key = None
+            elif isinstance(node, BinOpNode):
+                key = ('binop', node.op) + operands
+            elif cls is UnaryOpNode:
+                key = ('unary', node.op) + operands
+            elif cls is CoerceNode:
+                key = ('coerce', node.type_name) + operands
+            elif cls is MemberAccessNode:
+                key = ('member', node.member.name) + operands
+            elif cls is ArrayIndexNode:
+                key = ('index',) + operands
+            elif cls is FuncCallNode and self.signatures.get(node.func.name, {}).get('pure'):
+                key = ('call', node.func.name) + operands
+            else:
+                key = None
+        self._keys[id(node)] = key
+        return key
+
+    def effects(self, stmt: AstNode) -> Tuple[bool, bool]:
+        """(вызывает нечистые функции, меняет массивы или объекты)."""
+        calls = writes = False
+        for sub in walk(stmt):
+            cls = type(sub)
+            if cls is FuncCallNode and not self.signatures.get(sub.func.name, {}).get('pure'):
+                calls = True
+            elif cls is ArrayAssignNode or cls is AssignNode and type(sub.var) is not IdentNode:
+                writes = True
+        return calls, calls or writes
+
+    def count(self, node: AstNode, index: int, available: dict, groups: list, start: bool):
+        key = self.key(node) if type(node) is not IdentNode and type(node) is not LiteralNode else None
+        if key is not None:
+            group = available.get(key)
+            if group is not None:
+                group.count += 1
+                group.last = index
+                return
+            if start and node.sem_type in PURE_TYPES and _size(node) >= CSE_MIN_SIZE:
+                group = available[key] = _Group(key, node, index)
+                groups.append(group)
+        for arg in _operands(node):
+            self.count(arg, index, available, groups, start)
+
+    def eliminate(self, stmts: List[AstNode]) -> Tuple[AstNode, ...]:
+        # Первый проход: группы вхождений между присваиваниями
+        self._keys.clear()
+        available, groups = {}, []
+        for i, stmt in enumerate(stmts):
+            if type(stmt) is FuncDeclNode or type(stmt) is ClassDeclNode:
+                continue
+            calls, writes = self.effects(stmt)
+            if calls:
+                # нечистая функция может изменить массив до вычисления выражения
+                for key in [key for key, group in available.items() if group.memory]:
+                    del available[key]
+            for owner, attr in _positions(stmt):
+                for expr in _expressions(owner, attr):
+                    self.count(expr, i, available, groups, not calls)
+            killed = assigned_names(stmt)
+            for key in [key for key, group in available.items() if group.names & killed or writes and group.memory]:
+                del available[key]
+        selected = [group for group in groups if group.count > 1]
+        if not selected:
+            return tuple(stmts)
+        # Второй проход: временные перед первым вхождением, замена вхождений
+        starts = defaultdict(list)
+        for group in selected:
+            starts[group.first].append(group)
+        active, result = {}, []
+        for i, stmt in enumerate(stmts):
+            # вложенные выражения объявлены раньше объемлющих
+            for group in reversed(starts.get(i, ())):
+                node = group.node
+                self.substitute_operands(node, active)
+                group.temp, decl = self.new_temp(node, stmt)
+                result.append(decl)
+                active[group.key] = group
+                self.reused += group.count - 1
+            for owner, attr in _positions(stmt):
+                value = getattr(owner, attr)
+                if type(value) is tuple:
+                    setattr(owner, attr, tuple(self.substitute(expr, active) for expr in value))
+                else:
+                    setattr(owner, attr, self.substitute(value, active))
+            result.append(stmt)
+            for key in [key for key, group in active.items() if group.last == i]:
+                del active[key]
+        return tuple(result)
+
+    def substitute(self, node: AstNode, active: dict) -> AstNode:
+        if type(node) is IdentNode or type(node) is LiteralNode:
+            return node
+        key = self._keys.get(id(node))
+        group = active.get(key) if key is not None else None
+        if group is not None:
+            return self.use(group.temp, node)
+        self.substitute_operands(node, active)
+        return node
+
+    def substitute_operands(self, node: AstNode, active: dict):
+        cls = type(node)
+        if isinstance(node, BinOpNode):
+            node.arg1 = self.substitute(node.arg1, active)
+            if node.op not in (BinOp.AND, BinOp.OR):
+                node.arg2 = self.substitute(node.arg2, active)
+        elif cls is UnaryOpNode or cls is CoerceNode:
+            node.arg = self.substitute(node.arg, active)
+        elif cls is FuncCallNode:
+            node.params = tuple(self.substitute(arg, active) for arg in node.params)
+        elif cls is MemberAccessNode:
+            node.obj = self.substitute(node.obj, active)
+        elif cls is ArrayIndexNode:
+            node.array = self.substitute(node.array, active)
+            node.index = self.substitute(node.index, active)
+        elif cls is ArrayNode:
+            node.elements = type(node.elements)(self.substitute(el, active) for el in node.elements)
+
+
+def eliminate_common_subexpressions(prog: StmtListNode,
+                                    signatures: Mapping[str, dict]) -> Tuple[StmtListNode, CseReport]:
+    """Выносит повторные и инвариантные в циклах вычисления во временные
+    переменные (после SemanticAnalyzer, signatures - его таблица
+    functions). Возвращает программу и отчёт."""
+    return CommonSubexpressions(signatures).run(prog)
@@ -0,0 +1,236 @@
+"""Удаление мёртвого кода MEL по результатам анализа.
+
+Два прохода по канонической программе:
+
+- живые переменные: обратный проход по операторам каждой функции и
+  верхнего уровня. Присваивание переменной, которая дальше не читается,
+  удаляется, у объявления убирается инициализатор, а объявление
+  локальной переменной, которая больше нигде не упоминается, - целиком.
+  Так же удаляются операторы-выражения. Всё это - только если правая
+  часть без побочных эффектов: вызывает лишь чистые функции, ничего не
+  присваивает и не создаёт объектов, чьи поля инициализируются с
+  побочными эффектами. Как и для чистых функций, ошибки выполнения
+  (деление на ноль, выход за границы) побочными эффектами не считаются;
+- достижимость: функции и классы, до которых нельзя дойти по вызовам,
+  new и объявленным типам от операторов верхнего уровня и точек входа,
+  удаляются.
+
+У каждой функции своя таблица переменных, поэтому живость считается по
+именам отдельно в каждой функции. На выходе функции живых переменных
+нет, а на верхнем уровне живы все: их возвращает ExecutionContext.run.
+Запись в элемент массива или поле объекта считается чтением переменной.
+"""
+from collections import Counter, defaultdict
+from typing import AbstractSet, Dict, Iterable, Mapping, NamedTuple, Optional
+
+from mel_ast import *
+from semantics import assigned_names, read_idents, refresh_counted_loop, walk
+
+
+class DeadCodeReport(NamedTuple):
+    stores: int
+    declarations: int
+    expressions: int
+    functions: Tuple[str, ...]
+    classes: Tuple[str, ...]
+
+    def __str__(self) -> str:
+        return (f'удалено присваиваний: {self.stores}, объявлений: {self.declarations}, '
+                f'выражений: {self.expressions}, функций: {len(self.functions)}, классов: {len(self.classes)}')
+
+
+def _reads(node) -> set:
+    """Переменные, которые читает оператор или выражение."""
+    cls = type(node)
+    if node is None:
+        return set()
+    if cls is AssignNode and type(node.var) is IdentNode:
+        return _reads(node.val)
+    if cls is VarsDeclNode:
+        return set().union(*(_reads(var.val) for var in node.vars if type(var) is AssignNode))
+    if cls is StmtListNode or cls is IfNode or cls is WhileNode:
+        return set().union(*(_reads(child) for child in node.children))
+    return {ident.name for ident in read_idents(node)}
+
+
+def _type_name(type_decl) -> str:
+    name = str(type_decl)
+    while name.endswith('[]'):
+        name = name[:-2]
+    return name
+
+
+class DeadCodeEliminator:
+    def __init__(self, signatures: Mapping[str, dict], entry_points: Optional[Iterable[str]] = None):
+        self.signatures = signatures
+        self.entry_points = None if entry_points is None else frozenset(entry_points)
+        self.classes: Dict[str, ClassDeclNode] = {}
+        # имя -> сколько раз оно упоминается в текущей функции (None - верхний уровень)
+        self.mentions: Optional[Counter] = None
+        # живые при выходе из программы: return верхнего уровня её завершает
+        self.exit_live: AbstractSet[str] = frozenset()
+        self._pure_classes: Dict[str, bool] = {}
+        self.stores = self.declarations = self.expressions = 0
+
+    def run(self, prog: StmtListNode) -> Tuple[StmtListNode, DeadCodeReport]:
+        self.classes = {stmt.name.name: stmt for stmt in prog.stmts if type(stmt) is ClassDeclNode}
+        for stmt in prog.stmts:
+            if type(stmt) is FuncDeclNode and stmt.body is not None:
+                self.mentions = Counter(sub.name for sub in walk(stmt.body) if type(sub) is IdentNode)
+                stmt.body = self.statement(stmt.body, set())[0] or StmtListNode()
+        self.mentions = None
+        self.exit_live = assigned_names(prog)
+        self.statement(prog, self.exit_live)
+        functions, classes = self.unreachable(prog)
+        prog.stmts = tuple(stmt for stmt in prog.stmts
+                           if not (type(stmt) is FuncDeclNode and stmt.name.name in functions
+                                   or type(stmt) is ClassDeclNode and stmt.name.name in classes))
+        return prog, DeadCodeReport(self.stores, self.declarations, self.expressions,
+                                    tuple(sorted(functions)), tuple(sorted(classes)))
+
+    # --- побочные эффекты ---
+
+    def removable(self, node: AstNode) -> bool:
+        for sub in walk(node):
+            cls = type(sub)
+            if cls is AssignNode or cls is ArrayAssignNode:
+                return False
+            if cls is FuncCallNode:
+                info = self.signatures.get(sub.func.name)
+                if info is None or not info.get('pure'):
+                    return False
+            elif cls is NewInstanceNode and not self.pure_class(sub.class_name.name):
+                return False
+        return True
+
+    def pure_class(self, name: str) -> bool:
+        # new вычисляет только инициализаторы полей
+        if name not in self._pure_classes:
+            self._pure_classes[name] = False
+            decl = self.classes.get(name)
+            self._pure_classes[name] = decl is not None and all(
+                type(var) is not AssignNode or self.removable(var.val)
+                for stmt in decl.body.stmts if type(stmt) is VarsDeclNode for var in stmt.vars)
+        return self._pure_classes[name]
+
+    # --- живые переменные ---
+
+    def statement(self, stmt: AstNode, live: AbstractSet[str]) -> Tuple[Optional[AstNode], AbstractSet[str]]:
+        """Оператор без мёртвых присваиваний (None - удалён целиком) и
+        переменные, живые перед ним; live - живые после него."""
+        cls = type(stmt)
+        if cls is StmtListNode:
+            stmts = []
+            for sub in reversed(stmt.stmts):
+                sub, live = self.statement(sub, live)
+                if sub is not None:
+                    stmts.append(sub)
+            stmt.stmts = tuple(reversed(stmts))
+            return stmt, live
+        if cls is AssignNode and type(stmt.var) is IdentNode:
+            name = stmt.var.name
+            if name not in live and self.removable(stmt.val):
+                self.stores += 1
+                return None, live
+            return stmt, (live - {name}) | _reads(stmt.val)
+        if cls is VarsDeclNode and len(stmt.vars) == 1:
+            return self.declaration(stmt, live)
+        if cls is IfNode:
+            then_stmt, then_live = self.statement(stmt.then_stmt, live)
+            stmt.then_stmt = then_stmt or StmtListNode()
+            else_live = live
+            if stmt.else_stmt is not None:
+                else_stmt, else_live = self.statement(stmt.else_stmt, live)
+                stmt.else_stmt = else_stmt or StmtListNode()
+            return stmt, _reads(stmt.cond) | then_live | else_live
+        if cls is WhileNode:
+            return self.loop(stmt, live)
+        if cls is ReturnNode:
+            if self.mentions is None:
+                return stmt, _reads(stmt.result) | self.exit_live
+            return stmt, _reads(stmt.result)
+        if cls is FuncDeclNode or cls is ClassDeclNode:
+            return stmt, live
+        if isinstance(stmt, ExprNode) and self.removable(stmt):
+            self.expressions += 1
+            return None, live
+        # прочие операторы ничего не убивают
+        return stmt, live | _reads(stmt)
+
+    def declaration(self, decl: VarsDeclNode, live: AbstractSet[str]):
+        var = decl.vars[0]
+        if type(var) is AssignNode:
+            name, value = var.var.name, var.val
+        else:
+            name, value = var.name, None
+        if name in live:
+            return decl, (live - {name}) | _reads(value)
+        if value is not None and not self.removable(value):
+            return decl, live | _reads(value)
+        if self.mentions is not None and self.mentions[name] == 1:
+            self.declarations += 1
+            return None, live
+        if value is not None:
+            # объявление нужно анализатору и следующим присваиваниям
+            decl.vars = var.var,
+            self.stores += 1
+        return decl, live - {name}
+
+    def loop(self, node: WhileNode, live: AbstractSet[str]):
+        # Всё, что читается в цикле, живо на каждой его итерации: это
+        # неподвижная точка без повторных проходов по вложенным циклам
+        loop_live = live | _reads(node.cond) | _reads(node.body)
+        step = node.body.stmts[-1] if type(node.body) is StmtListNode and node.body.stmts else None
+        body, _ = self.statement(node.body, loop_live)
+        node.body = body or StmtListNode()
+        refresh_counted_loop(node, step)
+        return node, loop_live
+
+    # --- достижимость ---
+
+    def unreachable(self, prog: StmtListNode) -> Tuple[set, set]:
+        functions = defaultdict(list)
+        for stmt in prog.stmts:
+            if type(stmt) is FuncDeclNode:
+                functions[stmt.name.name].append(stmt)
+        reached_functions, reached_classes = set(), set()
+        pending = []
+
+        def mark(node):
+            for sub in walk(node):
+                cls = type(sub)
+                if cls is FuncCallNode:
+                    name = sub.func.name
+                    if name in functions and name not in reached_functions:
+                        reached_functions.add(name)
+                        pending.extend(functions[name])
+                elif cls is NewInstanceNode or cls is TypeDeclNode:
+                    name = sub.class_name.name if cls is NewInstanceNode else _type_name(sub)
+                    if name in self.classes and name not in reached_classes:
+                        reached_classes.add(name)
+                        pending.append(self.classes[name].body)
+
+        for stmt in prog.stmts:
+            if type(stmt) is not FuncDeclNode and type(stmt) is not ClassDeclNode:
+                mark(stmt)
+        # хост может вызвать любую функцию, если точки входа не заданы
+        entries = functions.keys() if self.entry_points is None else self.entry_points & functions.keys()
+        for name in entries:
+            if name not in reached_functions:
+                reached_functions.add(name)
+                pending.extend(functions[name])
+        while pending:
+            node = pending.pop()
+            if type(node) is FuncDeclNode:
+                mark((node.return_type, node.params, node.body))
+            else:
+                mark(node)
+        return set(functions) - reached_functions, set(self.classes) - reached_classes
+
+
+def eliminate_dead_code(prog: StmtListNode, signatures: Mapping[str, dict],
+                        entry_points: Optional[Iterable[str]] = None) -> Tuple[StmtListNode, DeadCodeReport]:
+    """Удаляет мёртвый код (после SemanticAnalyzer, signatures - его таблица
+    functions). entry_points - функции, которые вызывает хост; None - все
+    функции программы. Возвращает программу и отчёт."""
+    return DeadCodeEliminator(signatures, entry_points).run(prog)
@@ -0,0 +1,45 @@
+from typing import Optional
+
+
+class Diagnostic:
+    """Сообщение об ошибке с позицией в исходном тексте.
+
+    Позиции берутся из метаданных Lark (propagate_positions): строки и
+    столбцы нумеруются с 1, end_column указывает на символ после конца.
+    str() возвращает только текст сообщения.
+    """
+
+    def __init__(self, message: str, line: Optional[int] = None, column: Optional[int] = None,
+                 end_line: Optional[int] = None, end_column: Optional[int] = None, kind: str = 'semantic'):
+        self.message = message
+        self.line = line
+        self.column = column
+        self.end_line = end_line
+        self.end_column = end_column
+        self.kind = kind
+
+    @classmethod
+    def at(cls, message: str, node, kind: str = 'semantic') -> 'Diagnostic':
+        if node is None:
+            return cls(message, kind=kind)
+        return cls(message, getattr(node, 'line', None), getattr(node, 'column', None),
+                   getattr(node, 'end_line', None), getattr(node, 'end_column', None), kind)
+
+    @property
+    def span(self):
+        return self.line, self.column, self.end_line, self.end_column
+
+    def format(self, filename: str = '<input>') -> str:
+        if self.line is None:
+            return f'{filename}: {self.kind} error: {self.message}'
+        return f'{filename}:{self.line}:{self.column}: {self.kind} error: {self.message}'
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return f'Diagnostic({self.message!r}, line={self.line}, column={self.column})'
+
+
+class TooManyErrors(Exception):
+    """Достигнут предел max_errors - анализ прерывается."""
@@ -0,0 +1,232 @@
+"""Подстановка коротких функций MEL в места вызова.
+
+Подставляются функции-формулы: тело - один `return выражение`, в
+выражении нет вызовов самой функции, а из переменных - только
+параметры. Последнее исключает захват: после подстановки выражение не
+ссылается ни на одно имя вызывающей функции, кроме переданных ей
+аргументов. Функции с локальными переменными не подставляются - у
+интерпретатора одна таблица переменных на вызов, и переименованные
+временные переменные попали бы в неё (а на верхнем уровне - в результат
+ExecutionContext.run).
+
+Вызов заменяется копией выражения, в которой параметры заменены
+аргументами, если:
+
+- типы аргументов, выведенные анализатором, совпадают с типами параметров;
+- аргументы без побочных эффектов (нет вызовов нечистых функций и new);
+- аргумент, который используется не ровно один раз, - переменная или
+  литерал, так что подстановка не повторяет и не теряет вычислений.
+
+Вызов-оператор (результат не используется) не подставляется. Рост
+программы ограничен бюджетом в узлах AST.
+"""
+import copy
+from collections import Counter
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+from mel_ast import *
+from semantics import read_idents
+
+# Наибольший размер подставляемого выражения (узлов AST)
+INLINE_MAX_SIZE = 16
+# Сколько узлов подстановка может добавить в программу
+INLINE_BUDGET = 2000
+
+# Поля, в которых лежат операторы, а не выражения
+_STATEMENT_FIELDS = {(StmtListNode, 'stmts'), (IfNode, 'then_stmt'), (IfNode, 'else_stmt'),
+                     (WhileNode, 'body')}
+
+
+class InlinedCall(NamedTuple):
+    caller: Optional[str]
+    callee: str
+    line: Optional[int]
+
+
+class InlineReport:
+    """Что подставлено (inlined), какие функции отклонены и почему
+    (rejected) и сколько узлов добавлено (growth)."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.inlined: List[InlinedCall] = []
+        self.rejected: Dict[str, str] = {}
+        self.growth = 0
+
+    def counts(self) -> Counter:
+        return Counter(call.callee for call in self.inlined)
+
+    def __str__(self) -> str:
+        lines = [f'подставлено вызовов: {len(self.inlined)}, рост: {self.growth} из {self.budget} узлов']
+        for callee, count in self.counts().items():
+            lines.append(f'  {callee}: {count}')
+        for callee, reason in self.rejected.items():
+            lines.append(f'  {callee} не подставляется: {reason}')
+        return '\n'.join(lines)
+
+
+def _size(node) -> int:
+    if isinstance(node, (list, tuple)):
+        return sum(_size(item) for item in node)
+    if not isinstance(node, AstNode):
+        return 0
+    return 1 + sum(_size(child) for child in node.children)
+
+
+def _substitute(node: AstNode, args: Mapping[str, AstNode], used: Counter) -> AstNode:
+    cls = type(node)
+    if cls is IdentNode:
+        if node.name not in args:
+            return node
+        # аргумент, использованный повторно, копируется
+        used[node.name] += 1
+        return args[node.name] if used[node.name] == 1 else copy.deepcopy(args[node.name])
+    if cls is FuncCallNode:
+        node.params = tuple(_substitute(arg, args, used) for arg in node.params)
+    elif cls is MemberAccessNode:
+        node.obj = _substitute(node.obj, args, used)
+    elif cls is not NewInstanceNode:
+        for name, value in vars(node).items():
+            if isinstance(value, AstNode):
+                setattr(node, name, _substitute(value, args, used))
+            elif isinstance(value, tuple) and value and isinstance(value[0], AstNode):
+                setattr(node, name, tuple(_substitute(item, args, used) for item in value))
+    return node
+
+
+class _Candidate(NamedTuple):
+    params: Tuple[str, ...]
+    param_types: Tuple[Any, ...]
+    expr: ExprNode
+    uses: Counter
+    size: int
+
+
+class Inliner:
+    def __init__(self, signatures: Mapping[str, dict], max_size: int = INLINE_MAX_SIZE,
+                 budget: int = INLINE_BUDGET):
+        self.signatures = signatures
+        self.max_size = max_size
+        self.report = InlineReport(budget)
+        self.candidates: Dict[str, _Candidate] = {}
+        self.declared = Counter()
+
+    def run(self, prog: AstNode) -> AstNode:
+        self.count_declarations(prog)
+        return self.rewrite(prog, None)
+
+    def count_declarations(self, node):
+        if isinstance(node, (list, tuple)):
+            for item in node:
+                self.count_declarations(item)
+        elif isinstance(node, AstNode):
+            if type(node) is FuncDeclNode:
+                self.declared[node.name.name] += 1
+            for child in node.children:
+                self.count_declarations(child)
+
+    # --- обход ---
+
+    def rewrite(self, node: AstNode, caller: Optional[str], statement: bool = False) -> AstNode:
+        cls = type(node)
+        inner = node.name.name if cls is FuncDeclNode else caller
+        for name, value in vars(node).items():
+            is_statement = (cls, name) in _STATEMENT_FIELDS
+            if isinstance(value, AstNode):
+                setattr(node, name, self.rewrite(value, inner, is_statement))
+            elif isinstance(value, tuple):
+                setattr(node, name, tuple(self.rewrite(item, inner, is_statement)
+                                          if isinstance(item, AstNode) else item for item in value))
+        if cls is FuncDeclNode:
+            self.consider(node)
+        elif cls is FuncCallNode and not statement:
+            return self.inline(node, caller)
+        return node
+
+    # --- кандидаты ---
+
+    def consider(self, func: FuncDeclNode):
+        name = func.name.name
+        reason = self.rejection(func)
+        if reason is None:
+            expr = func.body.stmts[0].result
+            params = tuple(param.vars[0].name for param in func.params.vars)
+            uses = Counter(ident.name for ident in read_idents(expr))
+            self.candidates[name] = _Candidate(params, tuple(self.signatures[name]['param_types']), expr, uses,
+                                               _size(expr))
+        else:
+            self.candidates.pop(name, None)
+            self.report.rejected[name] = reason
+
+    def rejection(self, func: FuncDeclNode) -> Optional[str]:
+        name = func.name.name
+        if self.declared[name] > 1:
+            return 'объявлена несколько раз'
+        if name not in self.signatures:
+            return 'нет сигнатуры'
+        body = func.body
+        if body is None or len(body.stmts) != 1 or type(body.stmts[0]) is not ReturnNode:
+            return 'тело - не один return'
+        if any(len(param.vars) != 1 or type(param.vars[0]) is not IdentNode for param in func.params.vars):
+            return 'сложные параметры'
+        expr = body.stmts[0].result
+        size = _size(expr)
+        if size > self.max_size:
+            return f'размер {size} больше {self.max_size}'
+        params = {param.vars[0].name for param in func.params.vars}
+        if any(ident.name not in params for ident in read_idents(expr)):
+            return 'использует переменные, кроме параметров'
+        if any(type(sub) is FuncCallNode and sub.func.name == name for sub in _walk_expr(expr)):
+            return 'рекурсивная'
+        return None
+
+    # --- места вызова ---
+
+    def side_effect_free(self, node: AstNode) -> bool:
+        for sub in _walk_expr(node):
+            cls = type(sub)
+            if cls is NewInstanceNode:
+                return False
+            if cls is FuncCallNode:
+                info = self.signatures.get(sub.func.name)
+                if info is None or not info.get('pure'):
+                    return False
+        return True
+
+    def inline(self, call: FuncCallNode, caller: Optional[str]) -> AstNode:
+        callee = call.func.name
+        candidate = self.candidates.get(callee)
+        if candidate is None or len(call.params) != len(candidate.params):
+            return call
+        for param, param_type, arg in zip(candidate.params, candidate.param_types, call.params):
+            if arg.sem_type is None or arg.sem_type != param_type or not self.side_effect_free(arg):
+                return call
+            if candidate.uses[param] != 1 and type(arg) is not IdentNode and type(arg) is not LiteralNode:
+                return call
+        if self.report.growth + candidate.size > self.report.budget:
+            return call
+        expr = _substitute(copy.deepcopy(candidate.expr), dict(zip(candidate.params, call.params)), Counter())
+        expr.line, expr.column = call.line, call.column
+        expr.end_line, expr.end_column = call.end_line, call.end_column
+        self.report.growth += candidate.size
+        self.report.inlined.append(InlinedCall(caller, callee, call.line))
+        return expr
+
+
+def _walk_expr(node: AstNode) -> Iterator[AstNode]:
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, AstNode):
+            yield node
+            stack.extend(node.children)
+        elif isinstance(node, (list, tuple)):
+            stack.extend(node)
+
+
+def inline_functions(prog: AstNode, signatures: Mapping[str, dict], max_size: int = INLINE_MAX_SIZE,
+                     budget: int = INLINE_BUDGET) -> Tuple[AstNode, InlineReport]:
+    """Подставляет функции-формулы в места вызова (после SemanticAnalyzer,
+    signatures - его таблица functions). Возвращает программу и отчёт."""
+    inliner = Inliner(signatures, max_size, budget)
+    return inliner.run(prog), inliner.report
@@ -1,16 +1,50 @@
 from mel_ast import *
+from mel_builtins import OutputBuffer, bind_builtins
+from rope import Rope, concat
+from vectors import VECTOR_OPS, vector_binop
 from itertools import chain
 
 
+def param_names(func: FuncDeclNode) -> Tuple[str, ...]:
+    names = []
+    for decl in chain.from_iterable(
+            [decl.vars if isinstance(decl, VarsDeclNode) else [decl] for decl in func.params.vars]):
+        if isinstance(decl, AssignNode):
+            names.append(decl.var.name)
+        elif isinstance(decl, IdentNode):
+            names.append(decl.name)
+    return tuple(names)
+
+
+FIELD_DEFAULTS = {'int': 0, 'float': 0.0, 'bool': False, 'string': ''}
+
+
 class Interpreter:
-    def __init__(self):
-        self.variables = {}
-        self.functions = {}
-        self.classes = {}
+    def __init__(self, functions=None, classes=None, variables=None, memo=None, output=None):
+        self.variables = {} if variables is None else variables
+        self.functions = {} if functions is None else functions
+        self.classes = {} if classes is None else classes
+        # Буфер print/write; сбрасывается вызовом output.flush()
+        self.output = OutputBuffer() if output is None else output
+        # Встроенные функции: вызываются напрямую, функции программы их перекрывают
+        self.natives = bind_builtins(self.output)
+        # MemoCache для функций с FuncDeclNode.pure; None - без кеширования
+        self.memo = memo
+        # Выставляется return и сбрасывается при выходе из функции
+        self.returning = False
+        # (функция, аргументы) хвостового вызова, ожидающего execute_function
+        self.tail_call = None
+        self._dispatch = {}
+        # FuncDeclNode -> имена параметров
+        self._params = {}
+        # ClassDeclNode -> шаблон объекта (см. class_template)
+        self._templates = {}
 
     def eval(self, node: AstNode):
-        method_name = f'eval_{type(node).__name__}'
-        method = getattr(self, method_name, self.generic_eval)
+        method = self._dispatch.get(type(node))
+        if method is None:
+            method = getattr(self, f'eval_{type(node).__name__}', self.generic_eval)
+            self._dispatch[type(node)] = method
         return method(node)
 
     def generic_eval(self, node: AstNode):
@@ -48,6 +82,9 @@ class Interpreter:
     def eval_ArrayNode(self, node: ArrayNode):
         return [self.eval(el) for el in node.elements]
 
+    def eval_ConstArrayNode(self, node: ConstArrayNode):
+        return node.items if node.shared else node.items.copy()
+
     def eval_ArrayAssignNode(self, node: ArrayAssignNode):
         array = self.variables.get(node.ident.name)
         if array is None or not isinstance(array, list):
@@ -58,6 +95,9 @@ class Interpreter:
         array[index] = value
         return value
 
+    def eval_ArrayIndexNode(self, node: ArrayIndexNode):
+        return self.eval(node.array)[self.eval(node.index)]
+
     def visit_ArrayAccessNode(self, node):
         array = self.visit(node.array)
         index = self.visit(node.index)
@@ -82,36 +122,48 @@ class Interpreter:
         if not class_node:
             raise Exception(f"Класс '{class_name}' не определён")
 
-        # Создаём новый объект как словарь
-        obj = {}
-        # Инициализируем поля класса значениями по умолчанию или заданными значениями
-        for stmt in class_node.body.stmts:
-            if isinstance(stmt, VarsDeclNode):
-                for var in stmt.vars:
-                    if isinstance(var, IdentNode):
-                        # Значение по умолчанию для примитивных типов
-                        type_name = stmt.type.typename
-                        if type_name == "int":
-                            obj[var.name] = 0
-                        elif type_name == "float":
-                            obj[var.name] = 0.0
-                        elif type_name == "bool":
-                            obj[var.name] = False
-                        elif type_name == "string":
-                            obj[var.name] = ""
-                        else:
-                            obj[var.name] = None  # Для классов или массивов
-                    elif isinstance(var, AssignNode):
-                        # Если поле инициализировано значением
-                        obj[var.var.name] = self.eval(var.val)
+        # Объект - словарь: копия шаблона полей, затем вычисляемые поля
+        template, initializers = self.class_template(class_node)
+        obj = template.copy()
+        for name, value in initializers:
+            obj[name] = self.eval(value)
         return obj
 
+    def class_template(self, class_node: ClassDeclNode):
+        """Поля класса по порядку объявления со значениями по умолчанию и
+        литералами и список (поле, выражение) для остальных полей."""
+        cached = self._templates.get(class_node)
+        if cached is not None:
+            return cached
+        template, initializers = {}, []
+        for stmt in class_node.body.stmts:
+            if not isinstance(stmt, VarsDeclNode):
+                continue
+            for var in stmt.vars:
+                if isinstance(var, IdentNode):
+                    # Значение по умолчанию для примитивных типов; для классов и массивов - None
+                    template[var.name] = FIELD_DEFAULTS.get(stmt.type.typename)
+                elif isinstance(var, AssignNode):
+                    if type(var.val) is LiteralNode:
+                        template[var.var.name] = var.val.value
+                    else:
+                        # место в шаблоне сохраняет порядок полей
+                        template[var.var.name] = None
+                        initializers.append((var.var.name, var.val))
+        cached = self._templates[class_node] = template, tuple(initializers)
+        return cached
+
     def eval_BinOpNode(self, node: BinOpNode):
         left = self.eval(node.arg1)
         right = self.eval(node.arg2)
         op = node.op
 
-        if op == BinOp.ADD: return left + right
+        if (type(left) is list or type(right) is list) and op in VECTOR_OPS:
+            return vector_binop(op, left, right)
+        if op == BinOp.ADD:
+            if type(left) is str or type(left) is Rope:
+                return concat(left, right)
+            return left + right
         if op == BinOp.SUB: return left - right
         if op == BinOp.MUL: return left * right
         if op == BinOp.DIV: return left / right
@@ -127,6 +179,12 @@ class Interpreter:
 
         raise Exception(f'Unsupported operator {op}')
 
+    def eval_TypedBinOpNode(self, node: TypedBinOpNode):
+        return node.func(self.eval(node.arg1), self.eval(node.arg2))
+
+    def eval_CoerceNode(self, node: CoerceNode):
+        return node.func(self.eval(node.arg))
+
     def eval_UnaryOpNode(self, node: UnaryOpNode):
         val = self.eval(node.arg)
         if node.op == UnaryOp.NEG:
@@ -137,16 +195,9 @@ class Interpreter:
             raise Exception(f"Unknown unary operator {node.op}")
 
     def eval_StmtListNode(self, node):
-        def flatten(stmts):
-            for stmt in stmts:
-                if isinstance(stmt, list):
-                    yield from flatten(stmt)
-                else:
-                    yield stmt
-
-        for stmt in flatten(node.stmts):
+        for stmt in node.stmts:
             result = self.eval(stmt)
-            if isinstance(stmt, ReturnNode):
+            if self.returning:
                 return result
         return None
 
@@ -158,44 +209,59 @@ class Interpreter:
             return self.eval(node.else_stmt)
 
     def eval_WhileNode(self, node: WhileNode):
+        if node.counted is not None:
+            done, result = self.eval_counted_loop(node.counted)
+            if done:
+                return result
         while self.eval(node.cond):
-            self.eval(node.body)
+            result = self.eval(node.body)
+            if self.returning:
+                return result
+
+    def eval_counted_loop(self, loop: CountedLoop):
+        # Условие и шаг не вычисляются через eval: счётчик берётся из range.
+        # Если значения оказались не целыми, возвращаемся к общему пути.
+        variables = self.variables
+        start = variables.get(loop.var)
+        bound = self.eval(loop.bound)
+        if type(start) is not int or type(bound) is not int:
+            return False, None
+        if loop.op == BinOp.LE:
+            bound += 1
+        elif loop.op == BinOp.GE:
+            bound -= 1
+        var, body, evaluate = loop.var, loop.body, self.eval
+        counter = range(start, bound, loop.step)
+        for i in counter:
+            variables[var] = i
+            result = evaluate(body)
+            if self.returning:
+                return True, result
+        variables[var] = start + len(counter) * loop.step
+        return True, None
 
     def eval_ReturnNode(self, node):
-        return self.eval(node.result)
+        if node.tail:
+            call = node.result
+            self.tail_call = (self.functions.get(call.func.name), [self.eval(arg) for arg in call.params])
+            self.returning = True
+            return None
+        result = self.eval(node.result)
+        self.returning = True
+        return result
 
     def eval_ClassDeclNode(self, node: ClassDeclNode):
         self.classes[node.name.name] = node
         return None
 
     def eval_VarsDeclNode(self, node: VarsDeclNode):
-        def flatten(stmts):
-            for stmt in stmts:
-                if isinstance(stmt, list):
-                    yield from flatten(stmt)
-                else:
-                    yield stmt
-
-        type_name = node.type.typename  # Имя типа (например, "Point", "int", "int[]")
-        is_class_type = type_name in self.classes  # Проверяем, является ли тип классом
-
-        for decl in flatten(node.vars):
-            if isinstance(decl, IdentNode):
-                var_name = decl.name
-                if is_class_type:
-                    # Для классов переменная изначально None, если не инициализирована
-                    self.variables[var_name] = None
-                else:
-                    # Для примитивных типов просто объявляем переменную
-                    self.variables[var_name] = None
-            elif isinstance(decl, AssignNode):
-                var_name = decl.var.name
-                value = self.eval(decl.val)
-                if is_class_type and isinstance(decl.val, NewInstanceNode):
-                    # Если это new Point(), то value уже является объектом
-                    self.variables[var_name] = value
-                else:
-                    self.variables[var_name] = value
+        # Переменные классов, массивов и примитивов без значения начинаются с None
+        variables = self.variables
+        for decl in node.vars:
+            if type(decl) is AssignNode:
+                variables[decl.var.name] = self.eval(decl.val)
+            elif type(decl) is IdentNode:
+                variables[decl.name] = None
             else:
                 print(f"[WARN] Неизвестный элемент в VarsDeclNode: {decl}")
 
@@ -206,25 +272,42 @@ class Interpreter:
     def eval_FuncCallNode(self, node: FuncCallNode):
         func = self.functions.get(node.func.name)
         if not func:
-            raise Exception(f"Function {node.func.name} not found")
-
-        old_variables = self.variables.copy()
-
-        self.variables = {}
-
-        params = [self.eval(arg) for arg in node.params]
-
-        param_decls = list(chain.from_iterable(
-            [decl.vars if isinstance(decl, VarsDeclNode) else [decl] for decl in func.params.vars]
-        ))
-
-        for decl, arg in zip(param_decls, params):
-            if isinstance(decl, AssignNode):
-                self.variables[decl.var.name] = arg
-            elif isinstance(decl, IdentNode):
-                self.variables[decl.name] = arg
-
-        result = self.eval(func.body)
-
-        self.variables = old_variables
-        return result
+            native = self.natives.get(node.func.name)
+            if native is None:
+                raise Exception(f"Function {node.func.name} not found")
+            return native(*[self.eval(arg) for arg in node.params])
+        args = [self.eval(arg) for arg in node.params]
+        return self.call_function(func, args)
+
+    def call_function(self, func: FuncDeclNode, args):
+        if func.pure and self.memo is not None:
+            return self.memo.call(func.name.name, args, self.execute_function, func, args)
+        return self.execute_function(func, args)
+
+    def param_names(self, func: FuncDeclNode) -> Tuple[str, ...]:
+        names = self._params.get(func)
+        if names is None:
+            names = self._params[func] = param_names(func)
+        return names
+
+    def execute_function(self, func: FuncDeclNode, args):
+        old_variables = self.variables
+        names = self.param_names(func)
+        variables = self.variables = dict(zip(names, args))
+        try:
+            while True:
+                result = self.eval(func.body)
+                if self.tail_call is None:
+                    return result
+                # хвостовой вызов: параметры перепривязываются на месте, без нового кадра
+                callee, args = self.tail_call
+                self.tail_call = None
+                self.returning = False
+                if callee is not func:
+                    # имя функции переопределено - обычный вызов
+                    return self.call_function(callee, args)
+                variables.clear()
+                variables.update(zip(names, args))
+        finally:
+            self.variables = old_variables
+            self.returning = False
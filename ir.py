@@ -0,0 +1,449 @@
+"""Трёхадресное промежуточное представление MEL.
+
+Каждая функция - список базовых блоков с явными переходами (CFG). Значения
+хранятся в виртуальных регистрах функции; каждой переменной функции
+соответствует свой регистр, как и одна запись в Interpreter.variables.
+Операторы верхнего уровня собираются в функцию MAIN.
+"""
+import operator
+from typing import Dict, List, Optional, Tuple
+
+from cse import TEMP_PREFIX
+from mel_ast import *
+from mel_builtins import BUILTINS, OutputBuffer, bind_builtins
+from mel_types import ArrayType
+from vectors import vector_binop
+from semantics import flatten
+
+MAIN = '__main__'
+
+BINARY_OPS = {
+    'add': operator.add,
+    'sub': operator.sub,
+    'mul': operator.mul,
+    'div': operator.truediv,
+    'mod': operator.mod,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'lt': operator.lt,
+    'le': operator.le,
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'bit_and': operator.and_,
+    'bin_or': operator.or_,
+    'and': lambda a, b: a and b,
+    'or': lambda a, b: a or b,
+}
+UNARY_OPS = {
+    'neg': operator.neg,
+    'not': operator.not_,
+    'float': float,
+}
+TERMINATORS = {'jump', 'branch', 'ret'}
+DEFAULT_VALUES = {'int': 0, 'float': 0.0, 'bool': False, 'string': ''}
+
+
+class Instr:
+    """Инструкция: op, регистр результата dst (или None) и аргументы.
+
+    Аргументы - номера регистров, кроме: const (значение), call и native
+    (имя функции программы или встроенной и регистры), new (имя класса), getfield/setfield (имя поля),
+    jump/branch (метки блоков).
+    """
+    __slots__ = ('op', 'dst', 'args')
+
+    def __init__(self, op: str, dst: Optional[int], *args):
+        self.op = op
+        self.dst = dst
+        self.args = args
+
+    def __str__(self):
+        op, args = self.op, self.args
+        if op == 'const':
+            text = f'const {args[0]!r}'
+        elif op == 'call' or op == 'native':
+            text = f'{op} {args[0]}(' + ', '.join(f'%{r}' for r in args[1:]) + ')'
+        elif op == 'new':
+            text = f'new {args[0]}'
+        elif op == 'vector':
+            text = f'vector {args[0]} %{args[1]}, %{args[2]}'
+        elif op == 'getfield':
+            text = f'getfield %{args[0]}.{args[1]}'
+        elif op == 'setfield':
+            text = f'setfield %{args[0]}.{args[1]}, %{args[2]}'
+        elif op == 'jump':
+            text = f'jump {args[0]}'
+        elif op == 'branch':
+            text = f'branch %{args[0]}, {args[1]}, {args[2]}'
+        else:
+            text = op + (' ' + ', '.join(f'%{r}' for r in args) if args else '')
+        return text if self.dst is None else f'%{self.dst} = {text}'
+
+
+class BasicBlock:
+    def __init__(self, label: str):
+        self.label = label
+        self.instrs: List[Instr] = []
+
+    @property
+    def terminator(self) -> Optional[Instr]:
+        if self.instrs and self.instrs[-1].op in TERMINATORS:
+            return self.instrs[-1]
+        return None
+
+    @property
+    def successors(self) -> Tuple[str, ...]:
+        term = self.terminator
+        if term is None or term.op == 'ret':
+            return ()
+        if term.op == 'jump':
+            return term.args[0],
+        return term.args[1], term.args[2]
+
+
+class Function:
+    def __init__(self, name: str, params: Tuple[str, ...]):
+        self.name = name
+        self.params = params
+        self.blocks: Dict[str, BasicBlock] = {}
+        self.var_regs: Dict[str, int] = {}
+        self.nregs = 0
+
+    @property
+    def entry(self) -> BasicBlock:
+        return next(iter(self.blocks.values()))
+
+    @property
+    def param_regs(self) -> Tuple[int, ...]:
+        return tuple(self.var_regs[name] for name in self.params)
+
+    def cfg(self) -> Dict[str, Tuple[str, ...]]:
+        return {label: block.successors for label, block in self.blocks.items()}
+
+    def predecessors(self) -> Dict[str, List[str]]:
+        preds = {label: [] for label in self.blocks}
+        for label, block in self.blocks.items():
+            for succ in block.successors:
+                preds[succ].append(label)
+        return preds
+
+    def dump(self) -> str:
+        params = ', '.join(f'%{self.var_regs[p]} {p}' for p in self.params)
+        lines = [f'func {self.name}({params}) regs={self.nregs} {{']
+        for block in self.blocks.values():
+            lines.append(f'{block.label}:')
+            lines.extend(f'    {instr}' for instr in block.instrs)
+        lines.append('}')
+        return '\n'.join(lines)
+
+
+class Module:
+    def __init__(self):
+        self.functions: Dict[str, Function] = {}
+        # имя класса -> поля [(имя, значение по умолчанию)]; инициализаторы
+        # полей собраны в функцию класса init_function(name)
+        self.classes: Dict[str, List[Tuple[str, Any]]] = {}
+
+    def dump(self) -> str:
+        parts = [f'class {name} {{{", ".join(field for field, _ in fields)}}}'
+                 for name, fields in self.classes.items()]
+        parts.extend(func.dump() for func in self.functions.values())
+        return '\n\n'.join(parts)
+
+
+def init_function(class_name: str) -> str:
+    return f'{class_name}.__init__'
+
+
+class IRBuilder:
+    """Понижение проверенного AST в Module."""
+
+    def __init__(self):
+        self.module = Module()
+        self.func: Optional[Function] = None
+        self.block: Optional[BasicBlock] = None
+        self.var_set = set()
+        self.labels = 0
+
+    def lower(self, prog: StmtListNode) -> Module:
+        self.lower_function(MAIN, (), prog)
+        return self.module
+
+    # --- инфраструктура ---
+
+    def new_reg(self) -> int:
+        self.func.nregs += 1
+        return self.func.nregs - 1
+
+    def var_reg(self, name: str) -> int:
+        reg = self.func.var_regs.get(name)
+        if reg is None:
+            reg = self.func.var_regs[name] = self.new_reg()
+            self.var_set.add(reg)
+        return reg
+
+    def new_block(self, hint: str = 'L') -> BasicBlock:
+        self.labels += 1
+        block = BasicBlock(f'{hint}{self.labels}')
+        self.func.blocks[block.label] = block
+        return block
+
+    def emit(self, op: str, dst: Optional[int], *args) -> Optional[int]:
+        if self.block.terminator is not None:
+            # Код после return недостижим, но всё равно понижается
+            self.block = self.new_block('dead')
+        instrs = self.block.instrs
+        if op == 'move' and instrs and instrs[-1].dst == args[0] and args[0] not in self.var_set:
+            # Временный регистр только что вычислен - пишем результат сразу в переменную
+            instrs[-1].dst = dst
+            return dst
+        instrs.append(Instr(op, dst, *args))
+        return dst
+
+    def jump(self, target: BasicBlock):
+        if self.block.terminator is None:
+            self.emit('jump', None, target.label)
+
+    def lower_function(self, name: str, params: Tuple[str, ...], body):
+        saved = self.func, self.block, self.var_set
+        self.func = Function(name, params)
+        self.var_set = set()
+        self.module.functions[name] = self.func
+        self.block = BasicBlock('entry')
+        self.func.blocks['entry'] = self.block
+        for param in params:
+            self.var_reg(param)
+        self.stmt(body)
+        if self.block.terminator is None:
+            self.emit('ret', None)
+        self.func, self.block, self.var_set = saved
+
+    # --- операторы ---
+
+    def stmt(self, node):
+        if isinstance(node, list):
+            for item in flatten(node):
+                self.stmt(item)
+            return
+        method = getattr(self, f'stmt_{type(node).__name__}', None)
+        if method is None:
+            self.expr(node)
+        else:
+            method(node)
+
+    def stmt_StmtListNode(self, node):
+        for stmt in node.stmts:
+            self.stmt(stmt)
+
+    def stmt_EmptyNode(self, node):
+        pass
+
+    def stmt_VarsDeclNode(self, node):
+        for var in node.vars:
+            if isinstance(var, IdentNode):
+                self.emit('const', self.var_reg(var.name), None)
+            else:
+                self.emit('move', self.var_reg(var.var.name), self.expr(var.val))
+
+    def stmt_AssignNode(self, node):
+        value = self.expr(node.val)
+        if isinstance(node.var, MemberAccessNode):
+            self.emit('setfield', None, self.expr(node.var.obj), node.var.member.name, value)
+        else:
+            self.emit('move', self.var_reg(node.var.name), value)
+
+    def stmt_ArrayAssignNode(self, node):
+        array = self.var_reg(node.ident.name)
+        index = self.expr(node.index)
+        self.emit('astore', None, array, index, self.expr(node.value))
+
+    def stmt_IfNode(self, node):
+        then_block, join = self.new_block('then'), self.new_block('endif')
+        else_block = self.new_block('else') if node.else_stmt else join
+        self.emit('branch', None, self.expr(node.cond), then_block.label, else_block.label)
+        for block, stmt in ((then_block, node.then_stmt), (else_block, node.else_stmt)):
+            if stmt is None:
+                continue
+            self.block = block
+            self.stmt(stmt)
+            self.jump(join)
+        self.block = join
+
+    def lower_loop(self, cond, body):
+        header, body_block, exit_block = self.new_block('loop'), self.new_block('body'), self.new_block('endloop')
+        self.jump(header)
+        self.block = header
+        self.emit('branch', None, self.expr(cond), body_block.label, exit_block.label)
+        self.block = body_block
+        self.stmt(body)
+        self.jump(header)
+        self.block = exit_block
+
+    def stmt_WhileNode(self, node):
+        self.lower_loop(node.cond, node.body)
+
+    def stmt_ReturnNode(self, node):
+        if node.tail:
+            # хвостовой вызов - новые значения параметров и переход в начало функции
+            args = [self.expr(arg) for arg in node.result.params]
+            args = [self.emit('move', self.new_reg(), reg) if reg in self.var_set else reg for reg in args]
+            for param, reg in zip(self.func.param_regs, args):
+                self.emit('move', param, reg)
+            self.jump(self.func.entry)
+            return
+        self.emit('ret', None, self.expr(node.result))
+
+    def stmt_FuncDeclNode(self, node):
+        params = tuple(var.name if isinstance(var, IdentNode) else var.var.name
+                       for param in node.params.vars for var in param.vars)
+        self.lower_function(node.name.name, params, node.body)
+
+    def stmt_ClassDeclNode(self, node):
+        fields, inits = [], []
+        for stmt in node.body.stmts:
+            if not isinstance(stmt, VarsDeclNode):
+                continue
+            default = DEFAULT_VALUES.get(stmt.type.typename)
+            for var in stmt.vars:
+                if isinstance(var, IdentNode):
+                    fields.append((var.name, default))
+                else:
+                    fields.append((var.var.name, default))
+                    inits.append(var)
+        self.module.classes[node.name.name] = fields
+        init = StmtListNode(*(AssignNode(MemberAccessNode(IdentNode('this'), var.var), var.val) for var in inits))
+        self.lower_function(init_function(node.name.name), ('this',), init)
+
+    # --- выражения ---
+
+    def expr(self, node) -> int:
+        return getattr(self, f'expr_{type(node).__name__}')(node)
+
+    def expr_LiteralNode(self, node):
+        return self.emit('const', self.new_reg(), node.value)
+
+    def expr_EmptyNode(self, node):
+        return self.emit('const', self.new_reg(), None)
+
+    def expr_IdentNode(self, node):
+        return self.var_reg(node.name)
+
+    def expr_BinOpNode(self, node):
+        left, right = self.expr(node.arg1), self.expr(node.arg2)
+        if isinstance(node.sem_type, ArrayType):
+            return self.emit('vector', self.new_reg(), node.op.name.lower(), left, right)
+        return self.emit(node.op.name.lower(), self.new_reg(), left, right)
+
+    expr_TypedBinOpNode = expr_BinOpNode
+    expr_BoolOpNode = expr_BinOpNode
+
+    def expr_UnaryOpNode(self, node):
+        return self.emit(node.op.name.lower(), self.new_reg(), self.expr(node.arg))
+
+    def expr_CoerceNode(self, node):
+        return self.emit(node.type_name, self.new_reg(), self.expr(node.arg))
+
+    def expr_ArrayNode(self, node):
+        elements = [self.expr(el) for el in node.elements]
+        return self.emit('array', self.new_reg(), *elements)
+
+    def expr_ConstArrayNode(self, node):
+        # регистры IR не разделяют значения между вызовами: массив всегда новый
+        elements = [self.emit('const', self.new_reg(), value) for value in node.items]
+        return self.emit('array', self.new_reg(), *elements)
+
+    def expr_ArrayIndexNode(self, node):
+        array, index = self.expr(node.array), self.expr(node.index)
+        return self.emit('aload', self.new_reg(), array, index)
+
+    def expr_NewInstanceNode(self, node):
+        class_name = node.class_name.name
+        obj = self.emit('new', self.new_reg(), class_name)
+        self.emit('call', None, init_function(class_name), obj)
+        return obj
+
+    def expr_FuncCallNode(self, node):
+        args = [self.expr(arg) for arg in node.params]
+        name = node.func.name
+        # Функции объявляются до вызова, так что отсутствующее имя - встроенная функция
+        op = 'native' if name not in self.module.functions and name in BUILTINS else 'call'
+        return self.emit(op, self.new_reg(), name, *args)
+
+
+def lower(prog: StmtListNode) -> Module:
+    return IRBuilder().lower(prog)
+
+
+class IRInterpreter:
+    """Эталонный интерпретатор IR: простой, а не быстрый."""
+
+    def __init__(self, module: Module, output: Optional[OutputBuffer] = None):
+        self.module = module
+        self.output = OutputBuffer() if output is None else output
+        self.natives = bind_builtins(self.output)
+
+    def run(self) -> dict:
+        main = self.module.functions[MAIN]
+        try:
+            regs = self.execute(main, ())
+        finally:
+            self.output.flush()
+        # временные переменные оптимизатора хосту не видны
+        return {name: regs[reg] for name, reg in main.var_regs.items() if not name.startswith(TEMP_PREFIX)}
+
+    def call(self, name: str, *args):
+        try:
+            return self.execute(self.module.functions[name], args, result=True)
+        finally:
+            self.output.flush()
+
+    def execute(self, func: Function, args, result=False):
+        regs = [None] * func.nregs
+        for reg, arg in zip(func.param_regs, args):
+            regs[reg] = arg
+        block = func.entry
+        while True:
+            for instr in block.instrs:
+                op, dst, a = instr.op, instr.dst, instr.args
+                if op == 'const':
+                    regs[dst] = a[0]
+                elif op == 'move':
+                    regs[dst] = regs[a[0]]
+                elif op in BINARY_OPS:
+                    regs[dst] = BINARY_OPS[op](regs[a[0]], regs[a[1]])
+                elif op in UNARY_OPS:
+                    regs[dst] = UNARY_OPS[op](regs[a[0]])
+                elif op == 'array':
+                    regs[dst] = [regs[r] for r in a]
+                elif op == 'aload':
+                    regs[dst] = regs[a[0]][regs[a[1]]]
+                elif op == 'astore':
+                    regs[a[0]][regs[a[1]]] = regs[a[2]]
+                elif op == 'new':
+                    regs[dst] = dict(self.module.classes[a[0]])
+                elif op == 'getfield':
+                    regs[dst] = regs[a[0]][a[1]]
+                elif op == 'setfield':
+                    regs[a[0]][a[1]] = regs[a[2]]
+                elif op == 'call':
+                    value = self.execute(self.module.functions[a[0]], [regs[r] for r in a[1:]], result=True)
+                    if dst is not None:
+                        regs[dst] = value
+                elif op == 'vector':
+                    regs[dst] = vector_binop(BinOp[a[0].upper()], regs[a[1]], regs[a[2]])
+                elif op == 'native':
+                    value = self.natives[a[0]](*[regs[r] for r in a[1:]])
+                    if dst is not None:
+                        regs[dst] = value
+                elif op == 'jump':
+                    block = func.blocks[a[0]]
+                    break
+                elif op == 'branch':
+                    block = func.blocks[a[1] if regs[a[0]] else a[2]]
+                    break
+                elif op == 'ret':
+                    if result:
+                        return regs[a[0]] if a else None
+                    return regs
+                else:
+                    raise Exception(f'Unknown IR instruction {instr}')
@@ -1,4 +1,4 @@
-import os
+import sys
 import mel_parser
 from interpreter import Interpreter
 from scope import Scope
@@ -141,10 +141,11 @@ def main():
     else:
         print("Семантический анализ прошёл успешно")
 
-    print(*prog.tree, sep=os.linesep)
+    prog.write_tree(sys.stdout)
 
     interpreter = Interpreter()
     result = interpreter.eval(prog)
+    interpreter.output.flush()
 
     print("Глобальные переменные после выполнения:")
     print(interpreter.variables)
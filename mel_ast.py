@@ -1,10 +1,54 @@
+import io
 from abc import ABC, abstractmethod
 from contextlib import suppress
-from typing import Callable, Tuple, Any, Optional, Union, List
+from typing import Callable, Tuple, Any, Optional, Union, List, TextIO, Iterator
 from enum import Enum
 
 
+def _flat_children(node) -> Iterator['AstNode']:
+    def flatten(items):
+        for item in items:
+            if isinstance(item, list):
+                yield from flatten(item)
+            elif item is not None:
+                yield item
+
+    return flatten(node.children)
+
+
+def _transform_items(items, func):
+    result = [item.transform(func) if isinstance(item, AstNode)
+              else _transform_items(item, func) if isinstance(item, (list, tuple))
+              else item
+              for item in items]
+    if isinstance(items, list):
+        items[:] = result
+        return items
+    return tuple(result)
+
+
+_END = object()
+
+
+def _with_last(items: Iterator) -> Iterator[Tuple[Any, bool]]:
+    prev = next(items, _END)
+    if prev is _END:
+        return
+    for item in items:
+        yield prev, False
+        prev = item
+    yield prev, True
+
+
 class AstNode(ABC):
+    # Позиция в исходном тексте (заполняется парсером, если известна)
+    line: Optional[int] = None
+    column: Optional[int] = None
+    end_line: Optional[int] = None
+    end_column: Optional[int] = None
+    # Тип выражения, выведенный семантическим анализатором
+    sem_type = None
+
     @property
     def children(self) -> Tuple['AstNode', ...]:
         return ()
@@ -15,19 +59,45 @@ class AstNode(ABC):
 
     @property
     def tree(self) -> Tuple[str, ...]:
-        res = [str(self)]
-        children = self.children
-        for i, child in enumerate(children):
-            ch0, ch = '├', '│'
-            if i == len(children) - 1:
-                ch0, ch = '└', ' '
-
-            if isinstance(child, list):
-                for k, sub in enumerate(child):
-                    res.extend(((ch0 if k == 0 else ch) + ' ' + s for j, s in enumerate(sub.tree)))
-            else:
-                res.extend(((ch0 if j == 0 else ch) + ' ' + s for j, s in enumerate(child.tree)))
-        return tuple(res)
+        buf = io.StringIO()
+        self.write_tree(buf)
+        return tuple(buf.getvalue().splitlines())
+
+    def write_tree(self, stream: TextIO, max_depth: Optional[int] = None,
+                   max_nodes: Optional[int] = None) -> int:
+        """Потоково выводит дерево в stream за один проход.
+
+        Дополнительная память - O(глубины): стек итераторов по детям и
+        префиксы предков. Узлы глубже max_depth и всё после max_nodes узлов
+        заменяются строкой '…'. Возвращает число выведенных узлов.
+        """
+        write = stream.write
+        write(str(self) + '\n')
+        count = 1
+        prefix = []
+        stack = [_with_last(_flat_children(self))]
+        while stack:
+            try:
+                node, last = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                if prefix:
+                    prefix.pop()
+                continue
+            indent = ''.join(prefix)
+            if max_nodes is not None and count >= max_nodes:
+                write(indent + '└ …\n')
+                break
+            write(indent + ('└ ' if last else '├ ') + str(node) + '\n')
+            count += 1
+            children = _flat_children(node)
+            if max_depth is not None and len(stack) >= max_depth:
+                if next(children, None) is not None:
+                    write(indent + ('  ' if last else '│ ') + '└ …\n')
+                continue
+            prefix.append('  ' if last else '│ ')
+            stack.append(_with_last(children))
+        return count
 
     def visit(self, func: Callable[['AstNode'], None]) -> None:
         func(self)
@@ -37,6 +107,19 @@ class AstNode(ABC):
     def get_type(self):
         return None
 
+    def transform(self, func: Callable[['AstNode'], 'AstNode']) -> 'AstNode':
+        """Заменяет узлы поддерева снизу вверх.
+
+        func получает узел (с уже преобразованными детьми) и возвращает
+        замену или сам узел. Атрибуты узлов и списки обновляются на месте.
+        """
+        for name, value in vars(self).items():
+            if isinstance(value, AstNode):
+                setattr(self, name, value.transform(func))
+            elif isinstance(value, (list, tuple)):
+                setattr(self, name, _transform_items(value, func))
+        return func(self)
+
     def __getitem__(self, index):
         return self.children[index] if index < len(self.children) else None
 
@@ -166,6 +249,27 @@ class ArrayNode(ExprNode):
         return 'array'
 
 
+class ConstArrayNode(ExprNode):
+    """Литерал массива из констант, вычисленный при компиляции.
+
+    items - шаблон значений, который никогда не меняется. При shared
+    массив только читается, и вычисление отдаёт сам шаблон, иначе - его
+    копию.
+    """
+
+    def __init__(self, items, shared: bool = False):
+        super().__init__()
+        self.items = list(items)
+        self.shared = shared
+
+    @property
+    def children(self) -> Tuple[ExprNode, ...]:
+        return ()
+
+    def __str__(self) -> str:
+        return f'array {{{", ".join(map(str, self.items))}}}'
+
+
 class ClassDeclNode(StmtNode):
     def __init__(self, name: IdentNode, body: StmtNode):
         super().__init__()
@@ -209,6 +313,35 @@ class BinOpNode(ExprNode):
         return str(self.op.value)
 
 
+class TypedBinOpNode(BinOpNode):
+    """BinOpNode с известным типом операндов и прямой реализацией func."""
+
+    def __init__(self, op: BinOp, arg1: ExprNode, arg2: ExprNode, func: Callable[[Any, Any], Any], type_name: str):
+        super().__init__(op, arg1, arg2)
+        self.func = func
+        self.type_name = type_name
+
+    def __str__(self) -> str:
+        return f'{self.op.value} ({self.type_name})'
+
+
+class CoerceNode(ExprNode):
+    """Явное приведение значения arg к типу type_name."""
+
+    def __init__(self, arg: ExprNode, type_name: str, func: Callable[[Any], Any]):
+        super().__init__()
+        self.arg = arg
+        self.type_name = type_name
+        self.func = func
+
+    @property
+    def children(self) -> Tuple[ExprNode]:
+        return (self.arg,)
+
+    def __str__(self) -> str:
+        return f'({self.type_name})'
+
+
 class FuncCallNode(ExprNode):
     def __init__(self, func: IdentNode, *params: ExprNode):
         super().__init__()
@@ -238,6 +371,8 @@ class AssignNode(StmtNode):
 
 
 class WhileNode(StmtNode):
+    counted: Optional['CountedLoop'] = None
+
     def __init__(self, cond: ExprNode, body: StmtNode):
         super().__init__()
         self.cond = cond
@@ -266,7 +401,27 @@ class IfNode(StmtNode):
         return 'if'
 
 
+class CountedLoop:
+    """Описание цикла со счётчиком, найденного семантическим анализатором.
+
+    var пробегает значения range(<текущее значение>, bound, step) при
+    сравнении op (LT, LE, GT или GE), body - тело без шага.
+    """
+
+    def __init__(self, var: str, op: 'BinOp', bound: ExprNode, step: int, body: StmtNode):
+        self.var = var
+        self.op = op
+        self.bound = bound
+        self.step = step
+        self.body = body
+
+    def __repr__(self):
+        return f"CountedLoop({self.var} {self.op.value} {self.bound}, step={self.step})"
+
+
 class ForNode(StmtNode):
+    """Только результат разбора: canonicalize заменяет for на while."""
+
     def __init__(self, init: StmtNode, cond: ExprNode, step: StmtNode, body: StmtNode):
         super().__init__()
         self.init = init
@@ -315,7 +470,7 @@ class ArrayAssignNode(StmtNode):
 
     @property
     def children(self) -> Tuple[AstNode, ...]:
-        return (self.ident, self.value)
+        return (self.ident, self.index, self.value)
 
     def __str__(self):
         return '='
@@ -464,19 +619,14 @@ class ParamDeclListNode(AstNode):
     def children(self) -> Tuple[AstNode, ...]:
         return tuple(self._vars)
 
-    @property
-    def tree(self):
-        res = [f"ParamDeclList:"]
-        for param in self._vars:
-            for line in param.tree:
-                res.append("  " + line)
-        return res
-
     def __str__(self):
         return f"param_decl_list ({len(self._vars)} param(s))"
 
 
 class FuncDeclNode(StmtNode):
+    # True, если SemanticAnalyzer доказал, что функция чистая
+    pure = False
+
     def __init__(self, return_type: 'TypeDeclNode', name: IdentNode, params: 'ParamDeclListNode', body: 'StmtListNode'):
         super().__init__()
         self.return_type = return_type
@@ -506,6 +656,9 @@ class NewInstanceNode(ExprNode):
 
 
 class ReturnNode(StmtNode):
+    # True, если result - вызов той же функции (SemanticAnalyzer.mark_tail_calls)
+    tail = False
+
     def __init__(self, result: ExprNode):
         super().__init__()
         self.result = result
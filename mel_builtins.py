@@ -0,0 +1,218 @@
+"""Встроенные функции MEL, реализованные на Python.
+
+Сигнатуры объявляются анализатору (builtin_signatures), а вызов
+выполняется прямым обращением к функции Python: без кадра, копии
+переменных и привязки параметров, как у функций на MEL. Функция
+программы с тем же именем перекрывает встроенную.
+
+Тип параметра None принимает значение любого типа, ArrayType(None) -
+массив с любыми элементами.
+"""
+import math
+import sys
+from functools import partial
+from typing import Callable, Dict, NamedTuple, Optional, TextIO, Tuple
+
+from mel_types import Type, ArrayType, INT, FLOAT, STRING, BOOL, VOID
+from rope import Rope
+
+# Столько символов print копит, прежде чем записать в поток
+BUFFER_LIMIT = 8192
+
+
+class Builtin(NamedTuple):
+    name: str
+    func: Callable
+    param_types: Tuple[Optional[Type], ...]
+    return_type: Optional[Type]
+    pure: bool = True
+    # Первым аргументом func получает OutputBuffer контекста выполнения
+    uses_output: bool = False
+    # Типы аргументов -> тип результата, если он зависит от аргументов
+    infer: Optional[Callable] = None
+
+
+BUILTINS: Dict[str, Builtin] = {}
+
+
+def builtin(name: str, param_types, return_type, pure: bool = True, uses_output: bool = False,
+            infer: Optional[Callable] = None):
+    def register(func):
+        BUILTINS[name] = Builtin(name, func, tuple(param_types), return_type, pure, uses_output, infer)
+        return func
+
+    return register
+
+
+class OutputBuffer:
+    """Буферизованный вывод print/write.
+
+    Текст копится в списке и уходит в поток одной записью при flush() или
+    когда накопится limit символов. stream=None - текущий sys.stdout.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, limit: int = BUFFER_LIMIT):
+        self.stream = stream
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+
+    def write(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+        stream = sys.stdout if self.stream is None else self.stream
+        stream.write(''.join(self.parts))
+        self.parts.clear()
+        self.size = 0
+
+
+def format_value(value) -> str:
+    """Запись значения MEL так, как её выводит print."""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (str, Rope)):
+        return str(value)
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{key}: {format_value(item)}' for key, item in value.items()) + '}'
+    if isinstance(value, (list, tuple)):
+        return '{' + ', '.join(format_value(item) for item in value) + '}'
+    return str(value)
+
+
+def builtin_signatures() -> Dict[str, dict]:
+    """Записи для SemanticAnalyzer.functions (без 'node')."""
+    return {name: {'return_type': b.return_type, 'param_types': list(b.param_types), 'pure': b.pure,
+                   'infer': b.infer}
+            for name, b in BUILTINS.items()}
+
+
+def bind_builtins(output: OutputBuffer) -> Dict[str, Callable]:
+    """Имя -> функция Python для вызова из интерпретатора или VM."""
+    return {name: partial(b.func, output) if b.uses_output else b.func for name, b in BUILTINS.items()}
+
+
+# --- математика ---
+
+def _numeric_type(arg_types):
+    return arg_types[0] if arg_types[0] in (INT, FLOAT) else None
+
+
+# abs(int) - int, abs(float) - float
+builtin('abs', (None,), None, infer=_numeric_type)(abs)
+builtin('sqrt', (FLOAT,), FLOAT)(math.sqrt)
+builtin('exp', (FLOAT,), FLOAT)(math.exp)
+builtin('log', (FLOAT,), FLOAT)(math.log)
+builtin('sin', (FLOAT,), FLOAT)(math.sin)
+builtin('cos', (FLOAT,), FLOAT)(math.cos)
+builtin('pow', (FLOAT, FLOAT), FLOAT)(math.pow)
+builtin('floor', (FLOAT,), INT)(math.floor)
+builtin('ceil', (FLOAT,), INT)(math.ceil)
+builtin('tofloat', (INT,), FLOAT)(float)
+
+
+@builtin('round', (FLOAT,), INT)
+def mel_round(x):
+    return int(round(x))
+
+
+@builtin('toint', (FLOAT,), INT)
+def mel_toint(x):
+    return int(x)
+
+
+# --- строки (значения могут быть Rope) ---
+
+@builtin('strlen', (STRING,), INT)
+def mel_strlen(s):
+    return len(s)
+
+
+@builtin('substr', (STRING, INT, INT), STRING)
+def mel_substr(s, start, count):
+    return str(s)[start:start + count]
+
+
+@builtin('find', (STRING, STRING), INT)
+def mel_find(s, sub):
+    return str(s).find(str(sub))
+
+
+@builtin('upper', (STRING,), STRING)
+def mel_upper(s):
+    return str(s).upper()
+
+
+@builtin('lower', (STRING,), STRING)
+def mel_lower(s):
+    return str(s).lower()
+
+
+@builtin('itos', (INT,), STRING)
+def mel_itos(x):
+    return str(x)
+
+
+@builtin('ftos', (FLOAT,), STRING)
+def mel_ftos(x):
+    return repr(x)
+
+
+@builtin('stoi', (STRING,), INT)
+def mel_stoi(s):
+    return int(str(s))
+
+
+@builtin('stof', (STRING,), FLOAT)
+def mel_stof(s):
+    return float(str(s))
+
+
+# --- массивы ---
+
+def _item_type(arg_types):
+    array = arg_types[0]
+    if isinstance(array, ArrayType) and array.base_type in (INT, FLOAT):
+        return array.base_type
+    return None
+
+
+@builtin('len', (ArrayType(None),), INT)
+def mel_len(array):
+    return len(array)
+
+
+@builtin('zeros', (INT,), ArrayType(FLOAT))
+def mel_zeros(n):
+    return [0.0] * n
+
+
+@builtin('range', (INT,), ArrayType(INT))
+def mel_range(n):
+    return list(range(n))
+
+
+# Свёртки числовых массивов: результат - тип элемента. Встроенные sum/min/max
+# Python обходят список в C; перевод списка в NumPy обошёлся бы дороже
+builtin('sum', (ArrayType(None),), None, infer=_item_type)(sum)
+builtin('min', (ArrayType(None),), None, infer=_item_type)(min)
+builtin('max', (ArrayType(None),), None, infer=_item_type)(max)
+
+
+# --- вывод ---
+
+@builtin('print', (None,), VOID, pure=False, uses_output=True)
+def mel_print(output, value):
+    output.write(format_value(value) + '\n')
+
+
+@builtin('write', (None,), VOID, pure=False, uses_output=True)
+def mel_write(output, value):
+    output.write(format_value(value))
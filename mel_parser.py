@@ -1,7 +1,17 @@
-from lark import Lark, Transformer, Token
+"""Разбор программ MEL.
+
+Парсер LALR строится лениво, при первом вызове parse(). Если рядом лежит
+mel_parser_standalone.py, собранный из текущей грамматики командой
+python build_parser.py, lark не импортируется и грамматика не
+компилируется: таблицы разбора уже записаны в этом модуле.
+"""
+import hashlib
+
 from mel_ast import *
+from canonicalize import canonicalize
+from diagnostics import Diagnostic
 
-parser = Lark('''
+GRAMMAR = r'''
     %import common.NUMBER
     %import common.CNAME
     %import common.NEWLINE
@@ -11,13 +21,13 @@ parser = Lark('''
     %import common.ESCAPED_STRING
 
     %ignore WS
-    %ignore DOT
     COMMENT: CPP_COMMENT | C_COMMENT
     %ignore COMMENT
 
-    BOOL: "true" | "false"
+    TRUE: "true"
+    FALSE: "false"
     DOT: "."
-    literal: NUMBER | ESCAPED_STRING | BOOL
+    literal: NUMBER | ESCAPED_STRING | TRUE | FALSE
     array_type: CNAME "[" "]"    -> array_type
     type_decl: CNAME | array_type
     type: CNAME | CNAME "[" "]"  -> array_type
@@ -110,14 +120,63 @@ parser = Lark('''
 
     stmt_list: (stmt ";"*)*
 
-    ?prog: (class_decl | stmt)*
+    prog: (class_decl | stmt)*
 
     ?start: prog
 
-''', start="start")
-
+'''
+PARSER_OPTIONS = {'parser': 'lalr', 'start': 'start', 'propagate_positions': True}
+GRAMMAR_HASH = hashlib.sha256((GRAMMAR + repr(sorted(PARSER_OPTIONS.items()))).encode('utf-8')).hexdigest()
+
+# Классы среды выполнения разбора (из mel_parser_standalone или lark);
+# заполняются при первом вызове get_parser()
+Token = UnexpectedInput = UnexpectedCharacters = UnexpectedToken = UnexpectedEOF = None
+_parser = None
+_builder_class = None
+
+
+def _load_runtime():
+    global Token, UnexpectedInput, UnexpectedCharacters, UnexpectedToken, UnexpectedEOF, _builder_class
+    try:
+        import mel_parser_standalone as runtime
+        if runtime.GRAMMAR_HASH != GRAMMAR_HASH:
+            # модуль собран из старой грамматики - пользуемся lark
+            runtime = None
+    except ImportError:
+        runtime = None
+    if runtime is None:
+        import lark
+        import lark.exceptions
+        runtime = lark.exceptions
+        Transformer, Token = lark.Transformer, lark.Token
+        parser = lark.Lark(GRAMMAR, **PARSER_OPTIONS)
+    else:
+        Transformer, Token = runtime.Transformer, runtime.Token
+        parser = runtime.Lark_StandAlone()
+    UnexpectedInput, UnexpectedCharacters = runtime.UnexpectedInput, runtime.UnexpectedCharacters
+    UnexpectedToken, UnexpectedEOF = runtime.UnexpectedToken, runtime.UnexpectedEOF
+    _builder_class = type('MelASTBuilder', (MelASTBuilder, Transformer), {})
+    return parser
+
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        _parser = _load_runtime()
+    return _parser
+
+
+def _build_ast(tree) -> StmtListNode:
+    return canonicalize(_builder_class().transform(tree))
+
+
+class MelASTBuilder:
+    """Построение AST из дерева разбора.
+
+    Примесь к Transformer среды выполнения: рабочий класс собирается в
+    _load_runtime(), чтобы импорт модуля не тянул за собой парсер.
+    """
 
-class MelASTBuilder(Transformer):
     def _call_userfunc(self, tree, new_children=None):
         children = new_children if new_children is not None else tree.children
         try:
@@ -127,7 +186,15 @@ class MelASTBuilder(Transformer):
         else:
             if tree.data == 'array_assign' and isinstance(children[0], ArrayAssignNode):
                 return children[0]
-            return f(*children)
+            return self._with_position(f(*children), tree.meta)
+
+    @staticmethod
+    def _with_position(node, meta):
+        # Узлы, пришедшие из дочернего правила без изменений, сохраняют свою позицию
+        if isinstance(node, AstNode) and node.line is None and getattr(meta, 'line', None) is not None:
+            node.line, node.column = meta.line, meta.column
+            node.end_line, node.end_column = meta.end_line, meta.end_column
+        return node
 
     def __getattr__(self, item):
         try:
@@ -138,7 +205,7 @@ class MelASTBuilder(Transformer):
             return lambda x: x
         if item == 'true':
             return lambda *args: LiteralNode('true')
-        if item in ('mul', 'div', 'add', 'sub', 'gt', 'ge', 'lt', 'le', 'eq', 'ne', 'and', 'or'):
+        if item in ('mul', 'div', 'mod', 'add', 'sub', 'gt', 'ge', 'lt', 'le', 'eq', 'ne', 'and', 'or'):
             def get_bin_op_node(arg1, arg2):
                 op = BinOp[item.upper()]
                 return BinOpNode(op, arg1, arg2)
@@ -209,20 +276,22 @@ class MelASTBuilder(Transformer):
         return VarsDeclNode(typ, [name])
 
     def typed_decl(self, typ, decl):
-        print(f"typed_decl: typ={typ}, decl={decl}")
         if isinstance(decl, Token):
             decl = IdentNode(str(decl))
         return VarsDeclNode(typ, [decl] if not isinstance(decl, list) else decl)
 
     def func_decl(self, ret_type, name, params=None, body=None):
+        if body is None and isinstance(params, StmtListNode):
+            # Функция без параметров: единственный необязательный узел - тело
+            params, body = None, params
         if params is None:
             params = ParamDeclListNode([])
         elif isinstance(params, tuple):
             params = ParamDeclListNode(list(params))
         return FuncDeclNode(ret_type, name, params, body)
 
-    def CNAME(self, token: Token):
-        return IdentNode(str(token))
+    def CNAME(self, token: 'Token'):
+        return self._with_position(IdentNode(str(token)), token)
 
     def var_declaration(self, args):
         var_type, name, value = args
@@ -251,7 +320,176 @@ class MelASTBuilder(Transformer):
 
 
 def parse(prog: str) -> StmtListNode:
-    prog = parser.parse(str(prog))
-    prog = MelASTBuilder().transform(prog)
-    print(f"DEBUG: Parsed AST: {prog.tree}")
+    prog = get_parser().parse(str(prog))
+    prog = _build_ast(prog)
     return prog
+
+
+# Токены синхронизации и изменение глубины блоков
+_SYNC_TOKENS = {'SEMICOLON': 0, 'LBRACE': 1, 'RBRACE': -1}
+
+
+def _syntax_error(e: 'UnexpectedInput') -> Diagnostic:
+    if isinstance(e, UnexpectedCharacters):
+        message = f"Неожиданный символ '{e.char}'"
+    elif isinstance(e, UnexpectedToken) and not _at_eof(e):
+        message = f"Неожиданный токен '{e.token}'"
+    else:
+        message = "Неожиданный конец программы"
+    if e.line is None or e.line < 0:
+        return Diagnostic(message, kind='syntax')
+    return Diagnostic(message, e.line, e.column, e.line, e.column + 1, kind='syntax')
+
+
+def _at_eof(e: 'UnexpectedInput') -> bool:
+    # LALR сообщает о конце текста как о неожиданном токене $END
+    if isinstance(e, UnexpectedEOF):
+        return True
+    return isinstance(e, UnexpectedToken) and e.token.type == '$END'
+
+
+def parse_with_recovery(prog: str) -> Tuple[StmtListNode, List[Diagnostic]]:
+    """Разбор с восстановлением после синтаксических ошибок за один проход.
+
+    Токены подаются парсеру LALR по одному (interactive parser lark). После
+    ';', '{' и '}', за которыми может начаться оператор, состояние разбора
+    запоминается. При ошибке разбор возвращается к этой точке, а токены
+    пропускаются до ближайшей точки синхронизации (';' включительно, '}'
+    не включительно, для заголовка блока - вместе с блоком), так что
+    оператор с ошибкой выпадает целиком. Незакрытые в конце программы
+    блоки закрываются. Возвращает частичную программу и список ошибок.
+    """
+    return _Recovery(get_parser().parse_interactive(str(prog))).run()
+
+
+class _Recovery:
+    def __init__(self, interactive):
+        self.interactive = interactive
+        self.lexer = interactive.lexer_thread
+        # пропуск токенов не зависит от состояния разбора
+        self.raw_lexer = getattr(self.lexer.lexer, 'root_lexer', self.lexer.lexer)
+        self.errors = []
+        # число '{', поданных парсеру и ещё не закрытых
+        self.depth = 0
+        self.checkpoint = self.save()
+        # после checkpoint парсеру не подано ни одного токена
+        self.fresh = True
+        self.last = None
+
+    def save(self):
+        # Копирование значений целиком сделало бы проход квадратичным. Но
+        # lark дописывает детей левой рекурсии прямо в список поддерева со
+        # стека, поэтому запоминаются и длины этих списков.
+        state = self.interactive.parser_state
+        lengths = [(value, len(value.children)) for value in state.value_stack if hasattr(value, 'children')]
+        return state.copy(deepcopy_values=False), lengths, self.depth
+
+    def restore(self, checkpoint):
+        state, lengths, self.depth = checkpoint
+        for value, length in lengths:
+            del value.children[length:]
+        self.interactive.parser_state = state.copy(deepcopy_values=False)
+
+    def run(self) -> Tuple[StmtListNode, List[Diagnostic]]:
+        interactive = self.interactive
+        tokens = self.lexer.lex(interactive.parser_state)
+        pending = None
+        while True:
+            if pending is not None:
+                token, pending = pending, None
+            else:
+                try:
+                    token = next(tokens)
+                except StopIteration:
+                    break
+                except UnexpectedInput as e:
+                    self.errors.append(_syntax_error(e))
+                    if isinstance(e, UnexpectedCharacters):
+                        self.skip_char()
+                    pending = self.recover(getattr(e, 'token', None))
+                    tokens = self.lexer.lex(interactive.parser_state)
+                    continue
+            self.last = token
+            try:
+                interactive.feed_token(token)
+            except UnexpectedInput as e:
+                self.errors.append(_syntax_error(e))
+                pending = self.recover(token)
+                tokens = self.lexer.lex(interactive.parser_state)
+                continue
+            self.fresh = False
+            if token.type in _SYNC_TOKENS:
+                self.depth += _SYNC_TOKENS[token.type]
+                if 'WHILE' in interactive.choices():
+                    self.checkpoint = self.save()
+                    self.fresh = True
+        return self.finish()
+
+    def finish(self) -> Tuple[StmtListNode, List[Diagnostic]]:
+        interactive = self.interactive
+        try:
+            return _build_ast(interactive.feed_eof(self.last)), self.errors
+        except UnexpectedInput as e:
+            self.errors.append(_syntax_error(e))
+        # закрываем блоки: сначала как есть, затем без недописанного оператора
+        for checkpoint in (None, self.checkpoint):
+            if checkpoint is not None:
+                self.restore(checkpoint)
+            try:
+                for _ in range(self.depth):
+                    interactive.feed_token(Token.new_borrow_pos('RBRACE', '}', self.last))
+                return _build_ast(interactive.feed_eof(self.last)), self.errors
+            except UnexpectedInput:
+                pass
+        return StmtListNode(), self.errors
+
+    def recover(self, token):
+        """Возврат к checkpoint и пропуск токенов от ошибочного token до
+        точки синхронизации. Возвращает '}', который ещё нужно подать."""
+        # '{', открытые после checkpoint (заголовок блока, литерал массива)
+        nested = self.depth - self.checkpoint[2]
+        self.restore(self.checkpoint)
+        fresh, self.fresh = self.fresh, True
+        first = token
+        while True:
+            if token is None:
+                token = self.next_raw()
+                if token is None:
+                    return None
+            if token.type == 'SEMICOLON':
+                return None
+            if token.type == 'RBRACE':
+                if nested > 0:
+                    nested -= 1
+                elif fresh and token is first:
+                    # '}' сразу после checkpoint ничего не закрывает - он лишний
+                    return None
+                else:
+                    return token
+            elif token.type == 'LBRACE':
+                if nested > 0:
+                    nested += 1
+                else:
+                    # блок с ошибкой в заголовке пропускается целиком
+                    nested = 1
+                    while nested:
+                        token = self.next_raw()
+                        if token is None:
+                            return None
+                        nested += _SYNC_TOKENS.get(token.type, 0)
+                    return None
+            token = None
+
+    def next_raw(self):
+        while True:
+            try:
+                return self.raw_lexer.next_token(self.lexer.state, self.interactive.parser_state)
+            except EOFError:
+                return None
+            except UnexpectedCharacters:
+                self.skip_char()
+
+    def skip_char(self):
+        state = self.lexer.state
+        pos = state.line_ctr.char_pos
+        state.line_ctr.feed(state.text.text[pos:pos + 1])
@@ -36,9 +36,12 @@ class ArrayType(Type):
     def __eq__(self, other):
         return isinstance(other, ArrayType) and self.base_type == other.base_type
 
-    def __repr__(self):
+    def __str__(self):
         return f"{self.base_type}[]"
 
+    def __repr__(self):
+        return str(self)
+
 
 class ClassType(Type):
     def __init__(self, name: str):
@@ -47,6 +50,9 @@ class ClassType(Type):
     def __eq__(self, other):
         return isinstance(other, ClassType) and self.name == other.name
 
+    def __str__(self):
+        return self.name
+
     def __repr__(self):
         return f"class {self.name}"
 
@@ -54,8 +60,12 @@ class ClassType(Type):
 # Примитивные типы
 INT = PrimitiveType("int")
 FLOAT = PrimitiveType("float")
+# Во время выполнения значения STRING - str или rope.Rope (результат конкатенации)
 STRING = PrimitiveType("string")
 BOOL = PrimitiveType("bool")
+# Результат функций без значения (print, write): его нельзя присвоить или
+# использовать в выражении
+VOID = PrimitiveType("void")
 
 
 def get_type_from_typename(typename: str) -> Type:
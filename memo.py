@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, NamedTuple
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+
+
+class MemoCache:
+    """Ограниченный LRU-кеш результатов чистых функций.
+
+    Для каждой функции своя таблица аргументы -> результат размером не
+    больше maxsize. Функции из disabled (и отключённые через disable)
+    всегда выполняются заново.
+    """
+
+    def __init__(self, maxsize: int = 1024, disabled: Iterable[str] = ()):
+        self.maxsize = maxsize
+        self.disabled = set(disabled)
+        self.tables: Dict[str, OrderedDict] = {}
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def disable(self, name: str):
+        self.disabled.add(name)
+        self.tables.pop(name, None)
+
+    def enable(self, name: str):
+        self.disabled.discard(name)
+
+    def call(self, name: str, args, compute: Callable, *compute_args):
+        """Результат compute(*compute_args) из кеша по ключу (name, args)."""
+        if name in self.disabled:
+            return compute(*compute_args)
+        table = self.tables.get(name)
+        if table is None:
+            table = self.tables[name] = OrderedDict()
+        key = tuple(args)
+        if key in table:
+            table.move_to_end(key)
+            self.hits[name] = self.hits.get(name, 0) + 1
+            return table[key]
+        self.misses[name] = self.misses.get(name, 0) + 1
+        value = compute(*compute_args)
+        table[key] = value
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict[str, CacheStats]:
+        names = sorted(set(self.hits) | set(self.misses))
+        return {name: CacheStats(self.hits.get(name, 0), self.misses.get(name, 0), len(self.tables.get(name, ())))
+                for name in names}
+
+    def clear(self):
+        self.tables.clear()
+        self.hits.clear()
+        self.misses.clear()
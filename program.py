@@ -0,0 +1,219 @@
+from types import MappingProxyType
+from typing import Any, Iterable, Iterator, Mapping, Optional, Sequence, Union
+
+import mel_parser
+from batch import VectorKernel, column_length, vector_kernel
+from constarrays import fold_constant_arrays
+from cse import TEMP_PREFIX, CseReport, eliminate_common_subexpressions
+from dce import DeadCodeReport, eliminate_dead_code
+from inliner import InlineReport, inline_functions
+from interpreter import Interpreter, param_names
+from mel_builtins import OutputBuffer
+from memo import MemoCache
+from rope import to_host
+from mel_ast import StmtListNode, FuncDeclNode, ClassDeclNode
+from mel_types import get_type_from_typename
+from semantics import SemanticAnalyzer
+from specialize import specialize
+
+
+class CompileError(Exception):
+    def __init__(self, errors):
+        super().__init__('\n'.join(err.format() if hasattr(err, 'format') else str(err) for err in errors))
+        self.errors = errors
+
+
+class Program:
+    """Скомпилированная программа: разобрана и проверена один раз.
+
+    Функции и классы верхнего уровня вынесены в неизменяемые таблицы,
+    остальные операторы - в кортеж body. Объект не меняется при выполнении,
+    поэтому его можно разделять между любым числом контекстов.
+
+    memo - общий для контекстов кеш результатов чистых функций (или None).
+    Кеш не влияет на результаты, поэтому разделять его безопасно.
+
+    kernels - функции, которые call_columns вычисляет над целыми столбцами
+    (см. batch.vector_kernel).
+
+    inlining, dead_code и cse - отчёты подстановки функций, удаления
+    мёртвого кода и общих подвыражений (или None, если проход не
+    выполнялся).
+    """
+    __slots__ = ('functions', 'classes', 'body', 'signatures', 'memo', 'kernels', 'inlining', 'dead_code', 'cse')
+
+    def __init__(self, prog: StmtListNode, signatures: Optional[Mapping[str, dict]] = None,
+                 memo: Optional[MemoCache] = None, inlining: Optional[InlineReport] = None,
+                 dead_code: Optional[DeadCodeReport] = None, cse: Optional[CseReport] = None):
+        functions, classes, body = {}, {}, []
+        for stmt in prog.stmts:
+            if isinstance(stmt, FuncDeclNode):
+                functions[stmt.name.name] = stmt
+            elif isinstance(stmt, ClassDeclNode):
+                classes[stmt.name.name] = stmt
+            else:
+                body.append(stmt)
+        self.functions = MappingProxyType(functions)
+        self.classes = MappingProxyType(classes)
+        self.body = tuple(body)
+        self.signatures = MappingProxyType(dict(signatures or {}))
+        self.memo = memo
+        self.inlining = inlining
+        self.dead_code = dead_code
+        self.cse = cse
+        kernels = {}
+        for name, func in functions.items():
+            kernel = vector_kernel(func, self.signatures.get(name), param_names(func), functions.keys())
+            if kernel is not None:
+                kernels[name] = kernel
+        self.kernels: Mapping[str, VectorKernel] = MappingProxyType(kernels)
+
+    def new_context(self, globals: Optional[Mapping[str, Any]] = None,
+                    output: Optional[OutputBuffer] = None) -> 'ExecutionContext':
+        return ExecutionContext(self, globals, output)
+
+    def run(self, globals: Optional[Mapping[str, Any]] = None) -> dict:
+        return self.new_context(globals).run()
+
+    def call(self, name: str, *args):
+        return self.new_context().call(name, *args)
+
+    def call_batch(self, name: str, rows: Iterable[Sequence]) -> Iterator:
+        return self.new_context().call_batch(name, rows)
+
+    def call_columns(self, name: str, columns: Sequence[Sequence], vectorize: bool = True) -> list:
+        return self.new_context().call_columns(name, columns, vectorize)
+
+
+class ExecutionContext:
+    """Изолированное окружение выполнения программы.
+
+    Глобальные переменные контекста задаются хостом и видны операторам
+    верхнего уровня; функции и классы берутся из программы без повторной
+    регистрации. Строки, построенные конкатенацией (Rope), хост получает
+    как str. Вывод print копится в output (по умолчанию - sys.stdout) и
+    сбрасывается в конце run() и call().
+    """
+
+    def __init__(self, program: Program, globals: Optional[Mapping[str, Any]] = None,
+                 output: Optional[OutputBuffer] = None):
+        self.program = program
+        self.interpreter = Interpreter(dict(program.functions), dict(program.classes), dict(globals or {}),
+                                       memo=program.memo, output=output)
+
+    @property
+    def variables(self) -> dict:
+        return self.interpreter.variables
+
+    def run(self) -> dict:
+        interpreter = self.interpreter
+        try:
+            for stmt in self.program.body:
+                interpreter.eval(stmt)
+                if interpreter.returning:
+                    interpreter.returning = False
+                    break
+        finally:
+            interpreter.output.flush()
+        # временные переменные оптимизатора хосту не видны
+        return to_host({name: value for name, value in interpreter.variables.items()
+                        if not name.startswith(TEMP_PREFIX)})
+
+    def function(self, name: str) -> FuncDeclNode:
+        func = self.interpreter.functions.get(name)
+        if func is None:
+            raise KeyError(f"Function {name} not found")
+        return func
+
+    def call(self, name: str, *args):
+        func = self.function(name)
+        arity = len(self.interpreter.param_names(func))
+        if len(args) != arity:
+            raise TypeError(f"Функция {name} ожидает {arity} аргументов, получено {len(args)}")
+        try:
+            return to_host(self.interpreter.call_function(func, args))
+        finally:
+            self.interpreter.output.flush()
+
+    def call_batch(self, name: str, rows: Iterable[Sequence]) -> Iterator:
+        """Вызывает функцию name для каждой строки аргументов из rows.
+
+        Функция и имена её параметров находятся один раз; результаты
+        отдаются по мере вычисления, поэтому rows может быть потоком.
+        """
+        func = self.function(name)
+        interpreter = self.interpreter
+        arity = len(interpreter.param_names(func))
+        call = interpreter.call_function
+        try:
+            for args in rows:
+                if len(args) != arity:
+                    raise TypeError(f"Функция {name} ожидает {arity} аргументов, получено {len(args)}")
+                yield to_host(call(func, args))
+        finally:
+            interpreter.output.flush()
+
+    def call_columns(self, name: str, columns: Sequence[Sequence], vectorize: bool = True) -> list:
+        """Результаты name для столбцов аргументов (по столбцу на параметр).
+
+        Функции из Program.kernels при vectorize=True вычисляются над
+        столбцами целиком, остальные - построчно через call_batch.
+        """
+        kernel = self.program.kernels.get(name) if vectorize else None
+        if kernel is not None:
+            return kernel(columns)
+        column_length(columns)
+        return list(self.call_batch(name, zip(*columns)))
+
+
+def compile_program(source: Union[str, StmtListNode], externs: Optional[Mapping[str, str]] = None,
+                    check: bool = True, optimize: bool = True, memoize: bool = True,
+                    memo_size: int = 1024, memo_exclude: Iterable[str] = (),
+                    workers: Optional[int] = None, inline: bool = True, eliminate: bool = True,
+                    entry_points: Optional[Iterable[str]] = None, cse: bool = True) -> Program:
+    """Разбирает и проверяет программу.
+
+    externs - имена и типы глобальных переменных, которые будет передавать
+    хост (например, {'limit': 'int'}). При check=True ошибки семантического
+    анализа приводят к CompileError. optimize включает оптимизирующие
+    проходы по результатам анализа, в том числе замену литералов массивов
+    из констант готовыми шаблонами (см. constarrays).
+
+    memoize включает LRU-кеш (memo_size записей на функцию) для функций,
+    которые анализатор признал чистыми; функции из memo_exclude не
+    кешируются. Кеш и статистика доступны как Program.memo.
+
+    workers - число процессов для проверки тел функций (см.
+    SemanticAnalyzer); None - однопроходный анализ.
+
+    inline (вместе с optimize) подставляет короткие функции-формулы в места
+    вызова (см. inliner); отчёт доступен как Program.inlining.
+
+    eliminate (вместе с optimize) удаляет мёртвые присваивания и
+    недостижимые функции и классы (см. dce); отчёт - Program.dead_code.
+    entry_points - функции, которые будет вызывать хост; None - все, и тогда
+    функции не удаляются.
+
+    cse (вместе с optimize) вычисляет повторные подвыражения и инварианты
+    циклов один раз во временные переменные (см. cse); отчёт - Program.cse.
+    """
+    prog = mel_parser.parse(source) if isinstance(source, str) else source
+    analyzer = SemanticAnalyzer(workers=workers)
+    for name, typename in (externs or {}).items():
+        analyzer.global_scope.declare(name, get_type_from_typename(typename))
+    errors = analyzer.analyze(prog)
+    if check and errors:
+        raise CompileError(errors)
+    inlining = dead_code = subexpressions = None
+    if optimize and not errors:
+        if inline:
+            prog, inlining = inline_functions(prog, analyzer.functions)
+        if eliminate:
+            prog, dead_code = eliminate_dead_code(prog, analyzer.functions, entry_points)
+        if cse:
+            prog, subexpressions = eliminate_common_subexpressions(prog, analyzer.functions)
+        prog = fold_constant_arrays(prog, analyzer.functions)
+    if optimize:
+        prog = specialize(prog)
+    memo = MemoCache(memo_size, memo_exclude) if memoize else None
+    return Program(prog, analyzer.functions, memo, inlining, dead_code, subexpressions)
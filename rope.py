@@ -0,0 +1,122 @@
+"""Строки MEL с отложенной конкатенацией.
+
+Rope хранит куски строки в общем буфере: `s + piece` дописывает кусок в
+буфер s, если s - последняя строка, построенная на этом буфере, и создаёт
+новый Rope за O(len(piece)). Сборка в str происходит один раз, при
+сравнении, индексации или передаче значения хосту. Поэтому цикл
+`s = s + piece` линеен, а не квадратичен.
+
+Для семантики MEL Rope и str неразличимы: оба имеют тип STRING, равны
+при равном содержимом и одинаково хешируются.
+"""
+from typing import Any, List
+
+# Короче этого результат склеивается сразу: копия дешевле объекта Rope
+MIN_ROPE_LENGTH = 64
+
+
+class Rope:
+    __slots__ = ('_parts', '_count', '_length', '_flat')
+
+    def __init__(self, parts: List[str], count: int, length: int):
+        # Строка - первые count кусков parts; следующие принадлежат
+        # строкам, построенным из этой дописыванием
+        self._parts = parts
+        self._count = count
+        self._length = length
+        self._flat = None
+
+    def __str__(self) -> str:
+        flat = self._flat
+        if flat is None:
+            parts = self._parts
+            flat = ''.join(parts if len(parts) == self._count else parts[:self._count])
+            self._flat = flat
+            # дальше дописываем в новый буфер из одного куска
+            self._parts, self._count = [flat], 1
+        return flat
+
+    def __add__(self, other):
+        if type(other) is str:
+            pieces, length = (other,), len(other)
+        elif type(other) is Rope:
+            pieces = other._parts[:other._count]
+            length = other._length
+        else:
+            return NotImplemented
+        parts = self._parts
+        if len(parts) != self._count:
+            # в буфер уже дописала другая строка - ответвляемся
+            parts = parts[:self._count]
+        parts.extend(pieces)
+        return Rope(parts, len(parts), self._length + length)
+
+    def __radd__(self, other):
+        if type(other) is not str:
+            return NotImplemented
+        parts = [other]
+        parts.extend(self._parts[:self._count])
+        return Rope(parts, len(parts), len(other) + self._length)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __getitem__(self, index):
+        return str(self)[index]
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+    def __eq__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return len(other) == self._length and str(self) == str(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __lt__(self, other):
+        return str(self) < str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __le__(self, other):
+        return str(self) <= str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __gt__(self, other):
+        return str(self) > str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __ge__(self, other):
+        return str(self) >= str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __repr__(self):
+        return repr(str(self))
+
+
+def concat(left, right):
+    """Сложение строк MEL: короткие склеиваются сразу, длинные - через Rope."""
+    if type(left) is Rope:
+        return left + right
+    if type(right) is Rope:
+        return right.__radd__(left)
+    if len(left) + len(right) < MIN_ROPE_LENGTH:
+        return left + right
+    return Rope([left, right], 2, len(left) + len(right))
+
+
+def to_host(value: Any) -> Any:
+    """Значение для хоста: Rope собираются в str, в том числе внутри
+    массивов и объектов (их содержимое заменяется на месте)."""
+    if type(value) is Rope:
+        return str(value)
+    if type(value) is list:
+        for i, item in enumerate(value):
+            if type(item) in (Rope, list, dict):
+                value[i] = to_host(item)
+    elif type(value) is dict:
+        for key, item in value.items():
+            if type(item) in (Rope, list, dict):
+                value[key] = to_host(item)
+    return value
@@ -4,15 +4,15 @@ class Scope:
         self.parent = parent
 
     def declare(self, name, var_type):
-        print(f"Добавление {name}: {var_type} в область {id(self)}")  # Отладка
         if name in self.symbols:
             raise Exception(f"Переменная '{name}' уже объявлена")
         self.symbols[name] = var_type
 
     def lookup(self, name):
-        print(f"Поиск {name} в области {id(self)}: {self.symbols.get(name)}")  # Отладка
-        if name in self.symbols:
-            return self.symbols[name]
-        if self.parent:
-            return self.parent.lookup(name)
-        return None
\ No newline at end of file
+        scope = self
+        while scope is not None:
+            var_type = scope.symbols.get(name)
+            if var_type is not None:
+                return var_type
+            scope = scope.parent
+        return None
@@ -1,328 +1,726 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
 from mel_ast import *
 from scope import Scope
-from mel_types import PrimitiveType, ArrayType, ClassType, Type, equals_simple_type, get_type_from_typename, INT
+from mel_types import PrimitiveType, ArrayType, ClassType, Type, equals_simple_type, get_type_from_typename, \
+    INT, FLOAT, STRING, BOOL, VOID
+from diagnostics import Diagnostic, TooManyErrors
+from mel_builtins import builtin_signatures
+
+
+ARITHMETIC_OPS = {BinOp.ADD, BinOp.SUB, BinOp.MUL, BinOp.DIV, BinOp.MOD}
+ORDER_OPS = {BinOp.GT, BinOp.GE, BinOp.LT, BinOp.LE}
+EQUALITY_OPS = {BinOp.EQ, BinOp.NE}
+LOGIC_OPS = {BinOp.AND, BinOp.OR}
+BIT_OPS = {BinOp.BIT_AND, BinOp.BIN_OR}
+NUMERIC_TYPES = (INT, FLOAT)
+# Типы параметров и результата, при которых функция может быть чистой
+PURE_TYPES = (INT, FLOAT, STRING, BOOL)
+# Узлы, которые делают функцию нечистой
+IMPURE_NODES = {ArrayAssignNode, NewInstanceNode, FuncDeclNode, ClassDeclNode}
+
+
+COUNTED_OPS = {BinOp.LT: 1, BinOp.LE: 1, BinOp.GT: -1, BinOp.GE: -1}
+
+# Меньше тел функций проверяем в текущем процессе: пул не окупится
+PARALLEL_MIN_BODIES = 64
+
+
+def flatten(items):
+    for item in items:
+        if isinstance(item, list):
+            yield from flatten(item)
+        else:
+            yield item
+
+
+# type -> является ли он узлом AST; isinstance для ABC-классов узлов дорогой
+_node_classes = {}
+
+
+def walk(node):
+    """Обходит все узлы поддерева, не заходя в объявления функций."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        cls = type(node)
+        if cls is list or cls is tuple:
+            stack.extend(node)
+            continue
+        is_node = _node_classes.get(cls)
+        if is_node is None:
+            is_node = _node_classes[cls] = issubclass(cls, AstNode)
+        if is_node:
+            yield node
+            if cls is not FuncDeclNode:
+                stack.extend(node.children)
+
+
+def assigned_names(node) -> set:
+    """Имена переменных, которые присваиваются или объявляются в поддереве."""
+    names = set()
+    for sub in walk(node):
+        if isinstance(sub, AssignNode) and isinstance(sub.var, IdentNode):
+            names.add(sub.var.name)
+        elif isinstance(sub, VarsDeclNode):
+            for var in sub.vars:
+                names.add(var.name if isinstance(var, IdentNode) else var.var.name)
+    return names
+
+
+def read_idents(node) -> Iterator[IdentNode]:
+    """IdentNode поддерева, обозначающие переменные (а не функции, поля и
+    классы). Цель присваивания внутри выражения тоже попадает сюда."""
+    cls = type(node)
+    if cls is IdentNode:
+        yield node
+    elif cls is FuncCallNode:
+        for arg in node.params:
+            yield from read_idents(arg)
+    elif cls is MemberAccessNode:
+        yield from read_idents(node.obj)
+    elif cls is not NewInstanceNode and cls is not FuncDeclNode:
+        for child in node.children:
+            if isinstance(child, AstNode):
+                yield from read_idents(child)
+
+
+def counted_body(stmts) -> StmtListNode:
+    """Тело цикла while со счётчиком - операторы без последнего (шага).
+    Для бывшего for это исходный блок тела, без лишней обёртки."""
+    if len(stmts) == 2 and type(stmts[0]) is StmtListNode:
+        return stmts[0]
+    return StmtListNode(*stmts[:-1])
+
+
+def refresh_counted_loop(node: WhileNode, step):
+    """Приводит node.counted в соответствие с переписанным циклом: тело
+    без шага и граница из условия. step - исходный оператор шага; если
+    его больше нет в конце тела, цикл перестаёт быть циклом со счётчиком."""
+    counted = node.counted
+    if counted is None:
+        return
+    stmts = node.body.stmts if type(node.body) is StmtListNode else ()
+    if stmts and stmts[-1] is step and isinstance(node.cond, BinOpNode):
+        node.counted = CountedLoop(counted.var, counted.op, node.cond.arg2, counted.step, counted_body(stmts))
+    else:
+        node.counted = None
+
+
+def check_body_job(job, collect: bool = True):
+    """Проверяет тело функции из SemanticAnalyzer.body_job.
+
+    Возвращает ошибки, выведенные типы узлов тела и найденные циклы со
+    счётчиком (узлы нумеруются в порядке walk(тело)). При collect=False
+    разметка остаётся только на узлах, а вместо списков - None.
+    """
+    node, _, symbols, functions, classes = job
+    analyzer = SemanticAnalyzer()
+    analyzer.current_scope.symbols.update(symbols)
+    analyzer.functions, analyzer.classes = functions, classes
+    analyzer.check_function_body(node, functions[node.name.name]['param_types'])
+    if not collect:
+        return analyzer.errors, None, None
+    types, counted = [], []
+    for i, sub in enumerate(walk(node.body)):
+        if sub.sem_type is not None:
+            types.append((i, sub.sem_type))
+        if type(sub) is WhileNode and sub.counted is not None:
+            counted.append((i, sub.counted.var, sub.counted.step))
+    return analyzer.errors, types, counted
+
+
+def apply_body_annotations(node, types, counted):
+    """Переносит результаты check_body_job из другого процесса на узлы тела."""
+    nodes = list(walk(node.body))
+    for i, sem_type in types:
+        nodes[i].sem_type = sem_type
+    loops = {i: (var, step) for i, var, step in counted}
+    for i, sub in enumerate(nodes):
+        if type(sub) is not WhileNode:
+            continue
+        if i not in loops:
+            sub.counted = None
+            continue
+        var, step = loops[i]
+        sub.counted = CountedLoop(var, sub.cond.op, sub.cond.arg2, step, counted_body(sub.body.stmts))
+
+
+_body_jobs = None
+
+
+def _init_body_worker(jobs):
+    global _body_jobs
+    _body_jobs = jobs
+
+
+def _check_body_chunk(indices):
+    return [check_body_job(_body_jobs[i]) for i in indices]
 
 
 class SemanticAnalyzer:
-    def __init__(self):
+    """Однопроходный семантический анализатор.
+
+    Каждый узел посещается ровно один раз: visit_* для выражений возвращает
+    тип узла (или None, если тип вывести нельзя - ошибка об этом уже
+    записана), операторы возвращают None.
+
+    Ошибки собираются в errors как Diagnostic с позициями узлов. Если задан
+    max_errors, анализ останавливается после max_errors ошибок, а truncated
+    становится True.
+
+    При заданном workers анализ двухфазный: первая фаза проходит программу
+    и откладывает тела функций, вторая проверяет их в пуле из workers
+    процессов. Каждое тело видит состояние таблиц на момент объявления
+    функции, а ошибки вставляются на место тела, поэтому результат тот же,
+    что и у однопроходного анализа.
+    """
+
+    def __init__(self, max_errors: Optional[int] = None, workers: Optional[int] = None):
         self.errors = []
+        self.max_errors = max_errors
+        self.workers = workers
+        # Отложенные тела функций (см. body_job); None - тела проверяются сразу
+        self.deferred = None
+        self.truncated = False
         self.current_scope = Scope()
         self.global_scope = self.current_scope
         self.classes = {}
-        self.functions = {}
-        self._visited_nodes = set()
-
-    def get_type_from_node(self, node):
-        if isinstance(node, LiteralNode):
-            value = node.value
-            if isinstance(value, bool):
-                return PrimitiveType("bool")
-            elif isinstance(value, int):
-                return PrimitiveType("int")
-            elif isinstance(value, float):
-                return PrimitiveType("float")
-            elif isinstance(value, str):
-                return PrimitiveType("string")
-        elif isinstance(node, IdentNode):
-            if node.name in ['int', 'float', 'string', 'bool']:
-                return get_type_from_typename(node.name)
-            current_scope = self.current_scope
-            while current_scope:
-                var_type = current_scope.lookup(node.name)
-                if var_type:
-                    return var_type
-                current_scope = current_scope.parent
-            return PrimitiveType("int")
-        elif isinstance(node, ArrayNode):
-            if node.elements:
-                element_type = self.get_type_from_node(node.elements[0])
-                return ArrayType(element_type)
-            return ArrayType(PrimitiveType("int"))
-        elif isinstance(node, VarsDeclNode):
-            return get_type_from_typename(node.type.typename)
-        elif isinstance(node, AssignNode):
-            return self.get_type_from_node(node.val)
-        elif isinstance(node, TypeDeclNode):
-            return get_type_from_typename(node.typename)
-        elif isinstance(node, ArrayTypeNode):
-            return ArrayType(get_type_from_typename(node.name))
-        elif isinstance(node, FuncCallNode):
-            func_info = self.functions.get(node.func.name)
-            return func_info['return_type'] if func_info else PrimitiveType("int")
-        elif isinstance(node, NewInstanceNode):
-            return self.visit_NewInstanceNode(node)
-        elif isinstance(node, MemberAccessNode):
-            obj_type = self.get_type_from_node(node.obj)
-            print(f"DEBUG: MemberAccessNode: obj={node.obj}, obj_type={obj_type}, member={node.member.name}")
-            if isinstance(obj_type, ClassType):
-                class_info = self.classes.get(obj_type.name)
-                print(f"DEBUG: class_info for {obj_type.name} = {class_info}")
-                if class_info:
-                    field_type = class_info['fields'].get(node.member.name)
-                    print(f"DEBUG: field_type for {node.member.name} = {field_type}")
-                    if field_type:
-                        return field_type
-                    self.errors.append(f"Field '{node.member.name}' not found in class '{obj_type.name}'")
+        # Встроенные функции (mel_builtins) - записи без 'node'
+        self.functions = builtin_signatures()
+        self.current_function = None
+
+    def analyze(self, node):
+        if self.workers is not None:
+            return self.analyze_two_phase(node)
+        try:
+            if isinstance(node, StmtListNode):
+                self.visit_block(node.stmts)
+            else:
+                self.visit(node)
+        except TooManyErrors:
+            self.truncated = True
+        self.mark_pure_functions()
+        return self.errors
+
+    def analyze_two_phase(self, node):
+        max_errors, self.max_errors = self.max_errors, None
+        self.deferred = []
+        if isinstance(node, StmtListNode):
+            self.visit_block(node.stmts)
+        else:
+            self.visit(node)
+        jobs, self.deferred = self.deferred, None
+        errors, pos = [], 0
+        for job, (body_errors, types, counted) in zip(jobs, self.check_bodies(jobs)):
+            errors += self.errors[pos:job[1]]
+            errors += body_errors
+            pos = job[1]
+            if types is not None:
+                apply_body_annotations(job[0], types, counted)
+        errors += self.errors[pos:]
+        self.max_errors = max_errors
+        if max_errors is not None and len(errors) > max_errors:
+            errors, self.truncated = errors[:max_errors], True
+        self.errors = errors
+        self.mark_pure_functions()
+        return self.errors
+
+    def body_job(self, node) -> Optional[tuple]:
+        """Задание на проверку тела функции во второй фазе.
+
+        Снимки таблиц ограничены именами, которые встречаются в теле, так что
+        размер задания пропорционален телу. Тела с вложенными объявлениями
+        функций и классов меняют общие таблицы - их проверяем сразу (None).
+        """
+        names = {node.name.name}
+        for sub in walk(node.body):
+            cls = type(sub)
+            if cls is FuncDeclNode or cls is ClassDeclNode:
+                return None
+            if cls is IdentNode:
+                names.add(sub.name)
+        symbols = {}
+        for name in names:
+            var_type = self.current_scope.lookup(name)
+            if var_type is not None:
+                symbols[name] = var_type
+        functions = {name: {key: value for key, value in self.functions[name].items() if key != 'node'}
+                     for name in names if name in self.functions}
+        return node, len(self.errors), symbols, functions, dict(self.classes)
+
+    def check_bodies(self, jobs):
+        """Результаты check_body_job для заданий в их порядке.
+
+        В текущем процессе узлы размечаются на месте, и типы не собираются.
+        """
+        if self.workers <= 1 or len(jobs) < PARALLEL_MIN_BODIES:
+            return [check_body_job(job, collect=False) for job in jobs]
+        methods = multiprocessing.get_all_start_methods()
+        # fork передаёт задания процессам без сериализации
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        size = max(1, len(jobs) // (self.workers * 4))
+        chunks = [range(i, min(i + size, len(jobs))) for i in range(0, len(jobs), size)]
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_body_worker,
+                                 initargs=(jobs,)) as pool:
+            return list(chain.from_iterable(pool.map(_check_body_chunk, chunks)))
+
+    def error(self, message: str, node: AstNode = None):
+        self.errors.append(Diagnostic.at(message, node))
+        if self.max_errors is not None and len(self.errors) >= self.max_errors:
+            raise TooManyErrors()
+
+    def visit(self, node):
+        if isinstance(node, list):
+            for item in node:
+                self.visit(item)
             return None
+        method = getattr(self, f'visit_{type(node).__name__}', self.generic_visit)
+        result = method(node)
+        if result is not None:
+            node.sem_type = result
+        return result
+
+    def value(self, node):
+        """Тип выражения, значение которого используется."""
+        result = self.visit(node)
+        if result == VOID:
+            self.error(f"Функция {node.func.name} не возвращает значения", node)
+            return None
+        return result
+
+    def generic_visit(self, node):
+        for child in flatten(node.children):
+            if child is not None:
+                self.visit(child)
+        return None
+
+    # --- области видимости ---
+
+    def in_global_scope(self) -> bool:
+        return self.current_scope is self.global_scope
+
+    def declare(self, node: IdentNode, var_type: Type):
+        try:
+            self.current_scope.declare(node.name, var_type)
+        except Exception as e:
+            self.error(str(e), node)
+
+    def visit_block(self, stmts):
+        for stmt in stmts:
+            self.visit(stmt)
+
+    def visit_scoped(self, stmt):
+        old_scope = self.current_scope
+        self.current_scope = Scope(parent=old_scope)
+        if isinstance(stmt, StmtListNode):
+            self.visit_block(stmt.stmts)
+        else:
+            self.visit(stmt)
+        self.current_scope = old_scope
+
+    def visit_StmtListNode(self, node):
+        self.visit_scoped(node)
+
+    # --- типы ---
+
+    def type_of_decl(self, type_node) -> Type:
+        var_type = get_type_from_typename(type_node.typename)
+        base_type = var_type
+        while isinstance(base_type, ArrayType):
+            base_type = base_type.base_type
+        if isinstance(base_type, ClassType) and base_type.name not in self.classes:
+            self.error(f"Класс {base_type.name} не определён", type_node)
+        return var_type
+
+    @staticmethod
+    def assignable(target: Type, value: Type) -> bool:
+        if target is None or value is None:
+            return True
+        if isinstance(target, ArrayType) and isinstance(value, ArrayType) \
+                and (value.base_type is None or target.base_type is None):
+            return True
+        return equals_simple_type(target, value)
+
+    def check_assign(self, target: Type, value: Type, node: AstNode):
+        if not self.assignable(target, value):
+            suffix = "" if self.in_global_scope() else " внутри блока"
+            self.error(f"Присвоение {value} в переменную типа {target}{suffix}", node)
+
+    def check_condition(self, cond):
+        cond_type = self.value(cond)
+        if cond_type is not None and cond_type != BOOL:
+            self.error(f"Условие должно быть типа bool, получено {cond_type}", cond)
+
+    # --- выражения ---
+
+    def visit_LiteralNode(self, node):
+        value = node.value
+        if isinstance(value, bool):
+            return BOOL
+        if isinstance(value, int):
+            return INT
+        if isinstance(value, float):
+            return FLOAT
+        if isinstance(value, str):
+            return STRING
+        return None
+
+    def visit_IdentNode(self, node):
+        var_type = self.current_scope.lookup(node.name)
+        if var_type is None:
+            self.report_undeclared(node)
+        return var_type
+
+    def report_undeclared(self, node: IdentNode):
+        where = "глобальной" if self.in_global_scope() else "текущей"
+        self.error(f"Переменная {node.name} не объявлена в {where} области видимости", node)
+
+    def visit_EmptyNode(self, node):
         return None
 
+    def visit_BinOpNode(self, node):
+        left = self.value(node.arg1)
+        right = self.value(node.arg2)
+        result = self.binop_type(node.op, left, right)
+        if result is None and left is not None and right is not None:
+            self.error(f"Операция {node.op.value} неприменима к типам {left} и {right}", node)
+        return result
+
+    visit_BoolOpNode = visit_BinOpNode
+    visit_TypedBinOpNode = visit_BinOpNode
+
+    def visit_CoerceNode(self, node):
+        self.value(node.arg)
+        return get_type_from_typename(node.type_name)
+
+    @staticmethod
+    def binop_type(op: BinOp, left: Type, right: Type):
+        if left is None or right is None:
+            return None
+        if op not in EQUALITY_OPS and (isinstance(left, ArrayType) or isinstance(right, ArrayType)):
+            return SemanticAnalyzer.vector_type(op, left, right)
+        numeric = left in NUMERIC_TYPES and right in NUMERIC_TYPES
+        if op in ARITHMETIC_OPS:
+            if numeric:
+                # деление во всех исполнителях точное: int / int даёт float
+                return INT if left == INT and right == INT and op != BinOp.DIV else FLOAT
+            if op == BinOp.ADD and left == STRING and right == STRING:
+                return STRING
+            return None
+        if op in ORDER_OPS:
+            return BOOL if numeric else None
+        if op in EQUALITY_OPS:
+            return BOOL if numeric or left == right else None
+        if op in LOGIC_OPS:
+            return BOOL if left == BOOL and right == BOOL else None
+        if op in BIT_OPS:
+            return INT if left == INT and right == INT else None
+        return None
+
+    @staticmethod
+    def vector_type(op: BinOp, left: Type, right: Type):
+        """Тип поэлементной операции над числовыми массивами (см. vectors)."""
+        if op not in ARITHMETIC_OPS and op not in ORDER_OPS:
+            return None
+        left_item = left.base_type if isinstance(left, ArrayType) else left
+        right_item = right.base_type if isinstance(right, ArrayType) else right
+        if left_item not in NUMERIC_TYPES or right_item not in NUMERIC_TYPES:
+            return None
+        return ArrayType(SemanticAnalyzer.binop_type(op, left_item, right_item))
+
+    def visit_UnaryOpNode(self, node):
+        arg_type = self.value(node.arg)
+        if arg_type is None:
+            return None
+        if node.op == UnaryOp.NEG and arg_type in NUMERIC_TYPES:
+            return arg_type
+        if node.op == UnaryOp.NOT and arg_type == BOOL:
+            return BOOL
+        self.error(f"Операция {node.op.value} неприменима к типу {arg_type}", node)
+        return None
+
+    def visit_ArrayNode(self, node):
+        element_type = None
+        for element in node.elements:
+            el_type = self.value(element)
+            if element_type is None:
+                element_type = el_type
+            elif el_type is not None and el_type != element_type:
+                self.error(f"Элементы массива разных типов: {element_type} и {el_type}", element)
+        return ArrayType(element_type)
+
+    def visit_ArrayIndexNode(self, node):
+        array_type = self.visit(node.array)
+        self.check_index(node.index)
+        if array_type is None:
+            return None
+        if not isinstance(array_type, ArrayType):
+            self.error(f"Переменная {node.array} не является массивом", node.array)
+            return None
+        return array_type.base_type
+
+    def check_index(self, index):
+        index_type = self.value(index)
+        if index_type is not None and index_type != INT:
+            self.error(f"Индекс массива должен быть типа int, получено {index_type}", index)
+
+    def visit_MemberAccessNode(self, node):
+        obj_type = self.value(node.obj)
+        if obj_type is None:
+            return None
+        if not isinstance(obj_type, ClassType):
+            self.error(f"Переменная {node.obj} не является объектом", node.obj)
+            return None
+        class_info = self.classes.get(obj_type.name)
+        if class_info is None:
+            return None
+        field_type = class_info['fields'].get(node.member.name)
+        if field_type is None:
+            self.error(f"Поле {node.member.name} не найдено в классе {obj_type.name}", node.member)
+        return field_type
+
     def visit_NewInstanceNode(self, node):
-        print(f"Обрабатываем NewInstanceNode: {node}")
         class_name = node.class_name.name
         if class_name not in self.classes:
-            self.errors.append(f"Ошибка: класс '{class_name}' не определён")
+            self.error(f"Класс {class_name} не определён", node.class_name)
             return None
-        # Здесь можно добавить проверку, что конструктор без параметров существует,
-        # но в вашем языке конструкторы не определены явно, поэтому просто возвращаем тип класса
         return ClassType(class_name)
 
-    def visit_VarsDeclNode(self, node):
-        print(f"Обрабатываем VarsDeclNode: {node}")
-        var_type = get_type_from_typename(node.type.typename)
-        print(f"Тип: {var_type}, переменные: {node.vars}")
-        vars_flat = []
-        for var in node.vars:
-            if isinstance(var, list):
-                vars_flat.extend(var)
-            else:
-                vars_flat.append(var)
-        for var in vars_flat:
-            print(f"Обрабатываем var: {var}")
-            if isinstance(var, IdentNode):
-                var_name = var.name
-                print(f"Объявление переменной: {var_name} типа {var_type} в области {id(self.current_scope)}")
-                try:
-                    self.current_scope.declare(var_name, var_type)
-                    print(f"После объявления: {self.current_scope.symbols}")
-                except Exception as e:
-                    self.errors.append(str(e))
-            elif isinstance(var, AssignNode):
-                if isinstance(var.var, MemberAccessNode):
-                    value_type = self.get_type_from_node(var.val)
-                    member_type = self.get_type_from_node(var.var)
-                    print(f"Присваивание полю {var.var}: ожидается {member_type}, получено {value_type}")
-                    if member_type and value_type and not equals_simple_type(member_type, value_type):
-                        self.errors.append("Ошибка: присвоение string в поле типа int внутри класса")
-                else:
-                    var_name = var.var.name
-                    if id(var.val) not in self._visited_nodes:
-                        self._visited_nodes.add(id(var.val))
-                        self.visit(var.val)
-                    value_type = self.get_type_from_node(var.val)
-                    print(
-                        f"Объявление переменной: {var_name} типа {var_type} с присваиванием {value_type} в области {id(self.current_scope)}")
-                    if not equals_simple_type(var_type, value_type):
-                        self.errors.append(f"Type mismatch: cannot assign {value_type} to {var_type}")
-                    try:
-                        self.current_scope.declare(var_name, var_type)
-                        print(f"После объявления: {self.current_scope.symbols}")
-                    except Exception as e:
-                        self.errors.append(str(e))
-            else:
-                print(f"Неизвестный тип var: {type(var)}")
-
     def visit_FuncCallNode(self, node):
-        print(f"Обрабатываем FuncCallNode: {node}")
         func_name = node.func.name
+        arg_types = [self.value(arg) for arg in node.params]
         func_info = self.functions.get(func_name)
         if not func_info:
-            self.errors.append(f"Undefined function '{func_name}'")
+            self.error(f"Функция {func_name} не определена", node.func)
             return None
         expected_param_types = func_info['param_types']
-        actual_args = node.params
-        if len(actual_args) != len(expected_param_types):
-            self.errors.append(
-                f"Expected {len(expected_param_types)} arguments for '{func_name}', got {len(actual_args)}")
-            return None
-        for i, (arg, expected_type) in enumerate(zip(actual_args, expected_param_types)):
-            arg_type = self.get_type_from_node(arg)
-            print(f"Аргумент {i + 1}: ожидается {expected_type}, получено {arg_type}")
-            if not equals_simple_type(arg_type, expected_type):
-                self.errors.append("Ошибка: передан аргумент string вместо int")
+        if len(arg_types) != len(expected_param_types):
+            self.error(
+                f"Ожидалось {len(expected_param_types)} аргументов для функции {func_name}, получено {len(arg_types)}",
+                node)
+            return func_info['return_type']
+        for arg, arg_type, expected_type in zip(node.params, arg_types, expected_param_types):
+            if not self.assignable(expected_type, arg_type):
+                self.error(f"Передан аргумент {arg_type} вместо {expected_type} в функцию {func_name}", arg)
+        infer = func_info.get('infer')
+        if infer is not None:
+            # встроенная функция, тип результата которой зависит от аргументов
+            return infer(arg_types)
         return func_info['return_type']
 
-    def visit_AssignNode(self, node):
-        if isinstance(node.var, MemberAccessNode):
-            member_type = self.get_type_from_node(node.var)
-            value_type = self.get_type_from_node(node.val)
-            print(f"Присваивание полю {node.var}: ожидается {member_type}, получено {value_type}")
-            if member_type and value_type and not self.equals_simple(node.var, node.val):
-                self.errors.append(f"Ошибка: присвоение {value_type} полю {node.var} типа {member_type}")
-            if id(node.val) not in self._visited_nodes:
-                self._visited_nodes.add(id(node.val))
-                self.visit(node.val)
-        else:
-            var_name = node.var.name
-            print(f"Поиск переменной '{var_name}' в области {id(self.current_scope)}")
-            var_type = None
-            current_scope = self.current_scope
-            while current_scope:
-                var_type = current_scope.lookup(var_name)
-                print(f"Проверяем область {id(current_scope)}: {var_type}")
-                if var_type:
-                    break
-                current_scope = current_scope.parent
-            if not var_type:
-                self.errors.append(f"Ошибка: переменная '{var_name}' не объявлена")
-                return
-            if id(node.val) not in self._visited_nodes:
-                self._visited_nodes.add(id(node.val))
-                self.visit(node.val)
-            value_type = self.get_type_from_node(node.val)
-            if not self.equals_simple(node.var, node.val):
-                self.errors.append(f"Ошибка: присвоение {value_type} переменной '{var_name}' типа {var_type}")
+    # --- операторы ---
 
-    def analyze(self, node):
-        print(f"Анализируем узел: {node}")
-        self._visited_nodes.clear()
-        self.visit(node)
-        return self.errors
+    def visit_VarsDeclNode(self, node):
+        var_type = self.type_of_decl(node.type)
+        for var in node.vars:
+            if isinstance(var, IdentNode):
+                self.declare(var, var_type)
+            elif isinstance(var, AssignNode):
+                value_type = self.value(var.val)
+                self.check_assign(var_type, value_type, var)
+                self.declare(var.var, var_type)
 
-    def visit(self, node):
-        if isinstance(node, list):
-            for item in node:
-                self.visit(item)
+    def visit_AssignNode(self, node):
+        if isinstance(node.var, MemberAccessNode):
+            member_type = self.visit(node.var)
+            value_type = self.value(node.val)
+            if not self.assignable(member_type, value_type):
+                self.error(f"Присвоение {value_type} в поле типа {member_type} внутри класса", node)
             return
-        method_name = f'visit_{type(node).__name__}'
-        method = getattr(self, method_name, self.generic_visit)
-        print(f"Вызываем метод: {method_name} для {node}")
-        return method(node)
+        var_type = self.current_scope.lookup(node.var.name)
+        value_type = self.value(node.val)
+        if var_type is None:
+            self.report_undeclared(node.var)
+            return
+        self.check_assign(var_type, value_type, node)
 
-    def visit_StmtListNode(self, node):
-        print(f"StmtListNode: {len(node.stmts)} операторов, область {id(self.current_scope)}, stmts: {node.stmts}")
-        if self.current_scope is self.global_scope:
-            for stmt in node.stmts:
-                self.visit(stmt)
-        else:
-            old_scope = self.current_scope
-            self.current_scope = Scope(parent=old_scope)
-            print(f"Создана новая область: {id(self.current_scope)}, родитель: {id(old_scope)}")
-            for stmt in node.stmts:
-                self.visit(stmt)
-            self.current_scope = old_scope
+    def visit_ArrayAssignNode(self, node):
+        array_type = self.visit(node.ident)
+        self.check_index(node.index)
+        value_type = self.value(node.value)
+        if array_type is None:
+            return
+        if not isinstance(array_type, ArrayType):
+            self.error(f"Переменная {node.ident.name} не является массивом", node.ident)
+            return
+        if not self.assignable(array_type.base_type, value_type):
+            self.error(f"Присвоение {value_type} в элемент массива типа {array_type.base_type}", node)
 
     def visit_IfNode(self, node):
-        if id(node.cond) not in self._visited_nodes:
-            self._visited_nodes.add(id(node.cond))
-            self.visit(node.cond)
-        self.check_boolean_condition(node.cond)
-        old_scope = self.current_scope
-        self.current_scope = Scope(parent=old_scope)
-        print(f"Создана область для if: {id(self.current_scope)}, родитель: {id(old_scope)}")
-        self.visit(node.then_stmt)
-        self.current_scope = old_scope
+        self.check_condition(node.cond)
+        self.visit_scoped(node.then_stmt)
         if node.else_stmt:
-            self.current_scope = Scope(parent=old_scope)
-            self.visit(node.else_stmt)
-            self.current_scope = old_scope
+            self.visit_scoped(node.else_stmt)
+
+    def visit_WhileNode(self, node):
+        self.check_condition(node.cond)
+        self.visit_scoped(node.body)
+        # while (i < n) { ...; i = i + 1; } - тот же цикл со счётчиком
+        if isinstance(node.body, StmtListNode):
+            stmts = node.body.stmts
+            if stmts:
+                node.counted = self.match_counted_loop(node.cond, stmts[-1], counted_body(stmts))
+
+    def match_counted_loop(self, cond, step, body) -> Optional[CountedLoop]:
+        """Распознаёт цикл вида `i < n; i = i + c` с целым счётчиком i,
+        постоянным шагом c и границей n, которая не меняется в теле."""
+        if not isinstance(cond, BinOpNode) or cond.op not in COUNTED_OPS or not isinstance(cond.arg1, IdentNode):
+            return None
+        var = cond.arg1.name
+        if self.current_scope.lookup(var) != INT:
+            return None
+        if not isinstance(step, AssignNode) or not isinstance(step.var, IdentNode) or step.var.name != var:
+            return None
+        delta = self.constant_step(var, step.val)
+        if delta is None or delta * COUNTED_OPS[cond.op] <= 0:
+            return None
+        assigned = assigned_names(body)
+        if var in assigned or not self.is_invariant_int(cond.arg2, assigned | {var}):
+            return None
+        return CountedLoop(var, cond.op, cond.arg2, delta, body)
+
+    @staticmethod
+    def constant_step(var: str, expr) -> Optional[int]:
+        if not isinstance(expr, BinOpNode) or expr.op not in (BinOp.ADD, BinOp.SUB):
+            return None
+        left, right = expr.arg1, expr.arg2
+        if expr.op == BinOp.ADD and isinstance(left, LiteralNode):
+            left, right = right, left
+        if not (isinstance(left, IdentNode) and left.name == var):
+            return None
+        if not isinstance(right, LiteralNode) or type(right.value) is not int:
+            return None
+        return right.value if expr.op == BinOp.ADD else -right.value
 
-    def check_boolean_condition(self, cond_node):
-        const_type = self.get_type_from_node(cond_node)
-        if not isinstance(const_type, PrimitiveType) or const_type.name != "bool":
-            self.errors.append(f"Condition must be boolean, got {const_type}")
+    def is_invariant_int(self, expr, assigned: set) -> bool:
+        if isinstance(expr, LiteralNode):
+            return type(expr.value) is int
+        if isinstance(expr, IdentNode):
+            return expr.name not in assigned and self.current_scope.lookup(expr.name) == INT
+        if isinstance(expr, BinOpNode) and expr.op in (BinOp.ADD, BinOp.SUB, BinOp.MUL):
+            return self.is_invariant_int(expr.arg1, assigned) and self.is_invariant_int(expr.arg2, assigned)
+        return False
+
+    def visit_ReturnNode(self, node):
+        result_type = self.value(node.result)
+        if self.current_function is None:
+            return
+        expected = self.functions[self.current_function]['return_type']
+        if not self.assignable(expected, result_type):
+            self.error(f"Возврат {result_type} из функции {self.current_function} с типом {expected}", node)
 
     def visit_FuncDeclNode(self, node):
-        print(f"Обрабатываем FuncDeclNode: {node}")
         func_name = node.name.name
-        return_type = get_type_from_typename(node.return_type.typename)
-        param_types = []
-        for param in node.params.vars:
-            param_type = get_type_from_typename(param.type.typename)
-            param_types.append(param_type)
+        return_type = self.type_of_decl(node.return_type)
+        param_types = [self.type_of_decl(param.type) for param in node.params.vars]
         self.functions[func_name] = {
             'return_type': return_type,
             'param_types': param_types,
             'node': node
         }
-        print(f"Функция {func_name} сохранена с возвращаемым типом {return_type} и параметрами {param_types}")
-        old_scope = self.current_scope
+        if node.body is not None:
+            self.mark_tail_calls(node)
+        if self.deferred is not None and node.body is not None:
+            job = self.body_job(node)
+            if job is not None:
+                self.deferred.append(job)
+                return
+        self.check_function_body(node, param_types)
+
+    @staticmethod
+    def mark_tail_calls(node):
+        """Отмечает `return f(...)` в теле f: такой вызов выполняется заменой
+        аргументов и переходом к началу f, а не вложенным вызовом."""
+        name, arity = node.name.name, len(node.params.vars)
+        for sub in walk(node.body):
+            if type(sub) is ReturnNode:
+                result = sub.result
+                sub.tail = type(result) is FuncCallNode and result.func.name == name \
+                    and len(result.params) == arity
+
+    def check_function_body(self, node, param_types):
+        func_name = node.name.name
+        old_scope, old_function = self.current_scope, self.current_function
         self.current_scope = Scope(parent=old_scope)
-        print(f"Создана область для функции: {id(self.current_scope)}, родитель: {id(old_scope)}")
+        self.current_function = func_name
         for param, param_type in zip(node.params.vars, param_types):
             for var in param.vars:
                 if isinstance(var, IdentNode):
-                    self.current_scope.declare(var.name, param_type)
-        self.visit(node.body)
-        self.current_scope = old_scope
+                    self.declare(var, param_type)
+        if node.body is not None:
+            self.visit_block(node.body.stmts)
+        self.current_scope, self.current_function = old_scope, old_function
 
-    def visit_ArrayAssignNode(self, node):
-        print(f"Обрабатываем ArrayAssignNode: {node}")
-        # Получаем тип массива
-        array_type = self.get_type_from_node(node.ident)
-        if not isinstance(array_type, ArrayType):
-            self.errors.append(f"Переменная '{node.ident.name}' не является массивом")
-            return
-        # Получаем тип элемента массива
-        element_type = array_type.base_type
-        # Получаем тип присваиваемого значения
-        value_type = self.get_type_from_node(node.value)
-        print(f"Присваивание элементу массива: ожидается {element_type}, получено {value_type}")
-        # Проверяем совместимость типов
-        if not equals_simple_type(element_type, value_type):
-            self.errors.append(f"Ошибка: присвоение {value_type} в элемент массива типа {element_type}")
-        # Проверяем тип индекса
-        index_type = self.get_type_from_node(node.index)
-        if not equals_simple_type(index_type, INT):
-            self.errors.append(f"Ошибка: индекс массива должен быть типа int, получено {index_type}")
-        # Обходим дочерние узлы, чтобы избежать повторного посещения
-        if id(node.index) not in self._visited_nodes:
-            self._visited_nodes.add(id(node.index))
-            self.visit(node.index)
-        if id(node.value) not in self._visited_nodes:
-            self._visited_nodes.add(id(node.value))
-            self.visit(node.value)
+    def mark_pure_functions(self):
+        """Отмечает чистые функции (info['pure'] и FuncDeclNode.pure).
+
+        Чистая функция принимает и возвращает примитивы, присваивает только
+        своим параметрам и локальным переменным, не меняет массивы и объекты,
+        не создаёт экземпляров классов и вызывает только чистые функции.
+        Последнее условие проверяется до неподвижной точки, поэтому
+        рекурсивные функции тоже могут быть чистыми.
+        """
+        pure_builtins = {name for name, info in self.functions.items() if 'node' not in info and info['pure']}
+        calls = {}
+        for name, info in self.functions.items():
+            if 'node' not in info:
+                continue
+            callees = self.pure_candidate_calls(info)
+            if callees is not None:
+                calls[name] = callees - pure_builtins
+        changed = True
+        while changed:
+            changed = False
+            for name in list(calls):
+                if not calls[name] <= calls.keys():
+                    del calls[name]
+                    changed = True
+        for name, info in self.functions.items():
+            if 'node' in info:
+                info['pure'] = info['node'].pure = name in calls
+
+    @staticmethod
+    def pure_candidate_calls(info) -> Optional[set]:
+        """Имена вызываемых функций или None, если функция точно не чистая."""
+        node = info['node']
+        if node.body is None or info['return_type'] not in PURE_TYPES \
+                or any(t not in PURE_TYPES for t in info['param_types']):
+            return None
+        local_names = {var.name for param in node.params.vars for var in param.vars
+                       if isinstance(var, IdentNode)}
+        callees, targets = set(), []
+        for sub in walk(node.body):
+            cls = type(sub)
+            if cls in IMPURE_NODES:
+                return None
+            if cls is VarsDeclNode:
+                local_names.update(var.name if isinstance(var, IdentNode) else var.var.name
+                                   for var in sub.vars)
+            elif cls is AssignNode:
+                targets.append(sub.var)
+            elif cls is FuncCallNode:
+                callees.add(sub.func.name)
+        # объявления собраны целиком, только теперь можно проверить цели присваиваний
+        if not all(isinstance(var, IdentNode) and var.name in local_names for var in targets):
+            return None
+        return callees
 
     def visit_ClassDeclNode(self, node):
-        print(f"Обрабатываем ClassDeclNode: {node}")
         class_name = node.name.name
-        self.classes[class_name] = {'fields': {}}
-        old_scope = self.current_scope
-        self.current_scope = Scope(parent=old_scope)
-        print(f"Создана область для класса {class_name}: {id(self.current_scope)}")
+        fields = {}
+        self.classes[class_name] = {'fields': fields}
         for stmt in node.body.stmts:
-            if isinstance(stmt, VarsDeclNode):
-                var_type = get_type_from_typename(stmt.type.typename)
-                vars_flat = []
-                for var in stmt.vars:
-                    if isinstance(var, list):
-                        vars_flat.extend(var)
-                    else:
-                        vars_flat.append(var)
-                for var in vars_flat:
-                    if isinstance(var, IdentNode):
-                        var_name = var.name
-                        self.classes[class_name]['fields'][var_name] = var_type
-                        print(f"Добавлено поле {var_name}: {var_type} в класс {class_name}")
-                    elif isinstance(var, AssignNode):
-                        var_name = var.var.name
-                        value_type = self.get_type_from_node(var.val)
-                        if not self.equals_simple(var.var, var.val):
-                            self.errors.append(
-                                f"Type mismatch in field {var_name}: cannot assign {value_type} to {var_type}")
-                        self.classes[class_name]['fields'][var_name] = var_type
-                        print(f"Добавлено поле {var_name}: {var_type} в класс {class_name}")
-                    else:
-                        print(f"DEBUG: Неожиданный тип var: {type(var)} в stmt.vars")
-        print(f"DEBUG: После обработки класса {class_name}: {self.classes}")
-        self.current_scope = old_scope
-
-    def generic_visit(self, node):
-        if hasattr(node, 'children'):
-            for child in node.children:
-                if child is not None and id(child) not in self._visited_nodes:
-                    self._visited_nodes.add(id(child))
-                    self.visit(child)
-
-    def equals_simple(self, node1: AstNode, node2: AstNode) -> bool:
-        type1 = self.get_type_from_node(node1)
-        type2 = self.get_type_from_node(node2)
-        print(type1, type2)
-        if isinstance(type1, PrimitiveType) and isinstance(type2, PrimitiveType):
-            print(type1.name, type2.name)
-            return type1.name == type2.name
-        if isinstance(type1, ArrayType) and isinstance(type2, ArrayType):
-            print(type1.base_type, type2.base_type)
-            return equals_simple_type(type1.base_type, type2.base_type)
-        if isinstance(type1, ClassType) and isinstance(type2, ClassType):
-            return type1.name == type2.name
-        return type1 == type2
+            if not isinstance(stmt, VarsDeclNode):
+                continue
+            var_type = self.type_of_decl(stmt.type)
+            for var in stmt.vars:
+                if isinstance(var, IdentNode):
+                    fields[var.name] = var_type
+                elif isinstance(var, AssignNode):
+                    value_type = self.value(var.val)
+                    if not self.assignable(var_type, value_type):
+                        self.error(f"Присвоение {value_type} в поле типа {var_type} внутри класса", var)
+                    fields[var.var.name] = var_type
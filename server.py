@@ -0,0 +1,396 @@
+"""Сервер выполнения программ MEL на пуле прогретых процессов.
+
+Запуск процесса, импорт lark и сборка грамматики в mel_parser стоят
+дороже выполнения короткой программы. Сервер держит пул рабочих
+процессов, в которых всё это уже сделано, и кеш скомпилированных
+программ (Program) в каждом процессе: повторный запрос того же текста
+не разбирается и не проверяется заново.
+
+Запросы и ответы - JSON в кадрах: 4 байта длины (big-endian) и текст в
+UTF-8. Транспорт - stdin/stdout или Unix-сокет (--socket). Запрос:
+
+    {"id": 1, "source": "...", "externs": {"n": "int"}, "globals": {"n": 10},
+     "call": "f", "args": [1, 2], "timeout": 5}
+
+call и args необязательны: без них выполняется вся программа и
+результат - её переменные. Ответ:
+
+    {"id": 1, "ok": true, "result": ..., "output": "...", "cached": true,
+     "latency": 0.0012}
+
+или {"id": 1, "ok": false, "error": "..."}. Запрос {"op": "stats"}
+возвращает перцентили задержки.
+
+Процесс, который не ответил за timeout секунд, упал или занял больше
+max_memory байт сверх памяти после прогрева, завершается и заменяется
+новым. Предел действует и во время выполнения: в Linux адресное
+пространство процесса ограничено (RLIMIT_AS), и запрос, которому не
+хватило памяти, получает ответ с MemoryError.
+
+Вывод программ возвращается в ответе, а stdout рабочего процесса
+перенаправлен в stderr: в режиме stdin/stdout он общий с кадрами ответов.
+"""
+import argparse
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import socketserver
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, Optional
+
+FRAME_HEADER = struct.Struct('>I')
+# Наибольший размер кадра
+MAX_FRAME = 64 * 1024 * 1024
+# Программ в кеше каждого процесса
+CACHE_SIZE = 256
+# Секунд на запрос по умолчанию
+DEFAULT_TIMEOUT = 10.0
+# Сколько последних задержек хранит LatencyStats
+LATENCY_WINDOW = 10000
+
+
+# --- кадры ---
+
+def write_frame(stream: BinaryIO, message: dict):
+    data = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    stream.write(FRAME_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def read_frame(stream: BinaryIO) -> Optional[dict]:
+    """Следующее сообщение; None - поток закрыт."""
+    header = stream.read(FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise ValueError("Оборванный заголовок кадра")
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise ValueError(f"Кадр {size} байт больше {MAX_FRAME}")
+    data = stream.read(size)
+    if len(data) < size:
+        raise ValueError("Оборванный кадр")
+    return json.loads(data.decode('utf-8'))
+
+
+# --- рабочий процесс ---
+
+def _peak_memory() -> int:
+    # ru_maxrss - килобайты в Linux и байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _address_space() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _limit_memory(max_memory: int):
+    """Ограничивает адресное пространство текущим плюс max_memory байт."""
+    current = _address_space()
+    if current is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current + max_memory
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker_main(conn, cache_size: int, max_memory: Optional[int] = None):
+    # stdout сервера может быть каналом кадров: предупреждения интерпретатора
+    # и любой другой вывод процесса уходят в stderr
+    sys.stdout.flush()
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    import mel_parser
+    from mel_builtins import OutputBuffer
+    from program import CompileError, compile_program
+
+    # прогрев: грамматика собирается при первом разборе
+    mel_parser.parse('int x = 0;')
+    baseline = _peak_memory()
+    if max_memory is not None:
+        _limit_memory(max_memory)
+    cache = OrderedDict()
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if job is None:
+            return
+        externs = job.get('externs') or {}
+        key = hashlib.sha256(json.dumps([job['source'], externs], sort_keys=True).encode('utf-8')).digest()
+        reply = {'cached': key in cache}
+        stream = io.StringIO()
+        try:
+            program = cache.get(key)
+            if program is None:
+                program = cache[key] = compile_program(job['source'], externs)
+                if len(cache) > cache_size:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(key)
+            context = program.new_context(job.get('globals'), OutputBuffer(stream))
+            if job.get('call') is not None:
+                reply['result'] = context.call(job['call'], *(job.get('args') or ()))
+            else:
+                reply['result'] = context.run()
+            reply['ok'] = True
+        except CompileError as e:
+            reply.update(ok=False, error=f'Ошибки компиляции:\n{e}')
+        except MemoryError:
+            # после нехватки памяти процесс заменяется
+            cache.clear()
+            reply.update(ok=False, error='MemoryError: недостаточно памяти', exhausted=True)
+        except Exception as e:
+            reply.update(ok=False, error=f'{type(e).__name__}: {e}')
+        reply['output'] = stream.getvalue()
+        reply['memory'] = _peak_memory() - baseline
+        conn.send(reply)
+
+
+class Worker:
+    """Рабочий процесс и канал к нему."""
+
+    def __init__(self, context, cache_size: int, max_memory: Optional[int] = None):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, cache_size, max_memory), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+# --- пул ---
+
+class LatencyStats:
+    """Задержки последних window запросов в секундах."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def percentiles(self) -> Dict[str, float]:
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return {'count': self.count}
+        result = {'count': self.count}
+        for p in (50, 90, 99):
+            result[f'p{p}'] = samples[min(len(samples) - 1, len(samples) * p // 100)]
+        result['max'] = samples[-1]
+        return result
+
+    def __str__(self) -> str:
+        stats = self.percentiles()
+        return ', '.join(f'{name}={value * 1000:.2f} ms' if name != 'count' else f'{name}={value}'
+                         for name, value in stats.items())
+
+
+class WorkerPool:
+    """Пул из size прогретых процессов.
+
+    execute можно вызывать из нескольких потоков: запрос ждёт свободный
+    процесс. Процесс заменяется, если не ответил за timeout, завершился,
+    получил MemoryError или его пиковая память выросла после прогрева
+    больше чем на max_memory байт (None - без ограничения). В Linux тот
+    же предел задаёт RLIMIT_AS процесса и действует во время выполнения.
+    """
+
+    def __init__(self, size: int = None, timeout: float = DEFAULT_TIMEOUT, max_memory: Optional[int] = None,
+                 cache_size: int = CACHE_SIZE):
+        # Процессы заменяются из потоков сервера, а fork из многопоточного
+        # процесса может унаследовать чужие блокировки. forkserver порождает
+        # их из однопоточного процесса, где парсер уже импортирован.
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context('forkserver')
+            self.context.set_forkserver_preload(['mel_parser', 'program'])
+        else:
+            self.context = multiprocessing.get_context('spawn')
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.cache_size = cache_size
+        self.latency = LatencyStats()
+        self.recycled = 0
+        self.idle = queue.Queue()
+        for _ in range(self.size):
+            self.idle.put(self._new_worker())
+
+    def _new_worker(self) -> Worker:
+        return Worker(self.context, self.cache_size, self.max_memory)
+
+    def execute(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        job = {name: request.get(name) for name in ('source', 'externs', 'globals', 'call', 'args')}
+        timeout = request.get('timeout') or self.timeout
+        worker = self.idle.get()
+        try:
+            worker.conn.send(job)
+            if worker.conn.poll(timeout):
+                reply = worker.conn.recv()
+            else:
+                reply = {'ok': False, 'error': f'Превышено время выполнения {timeout} с'}
+        except (EOFError, OSError) as e:
+            reply = {'ok': False, 'error': f'Рабочий процесс завершился: {e or type(e).__name__}'}
+        memory = reply.pop('memory', None)
+        exhausted = reply.pop('exhausted', False)
+        if 'output' not in reply or exhausted or self.max_memory is not None and memory > self.max_memory:
+            # ответа нет (тайм-аут, падение) или процесс занял слишком много памяти
+            worker.kill()
+            worker = self._new_worker()
+            self.recycled += 1
+        self.idle.put(worker)
+        reply['id'] = request.get('id')
+        reply['latency'] = time.perf_counter() - start
+        self.latency.add(reply['latency'])
+        return reply
+
+    def stats(self) -> Dict[str, Any]:
+        return {'ok': True, 'latency': self.latency.percentiles(), 'workers': self.size,
+                'recycled': self.recycled}
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': 'Запрос должен быть объектом JSON'}
+        if request.get('op') == 'stats':
+            return dict(self.stats(), id=request.get('id'))
+        if not isinstance(request.get('source'), str):
+            return {'id': request.get('id'), 'ok': False, 'error': 'Нет текста программы (source)'}
+        return self.execute(request)
+
+    def close(self):
+        workers = []
+        for _ in range(self.size):
+            workers.append(self.idle.get())
+        for worker in workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- транспорт ---
+
+def _error_reply(request, error: BaseException) -> Dict[str, Any]:
+    request_id = request.get('id') if isinstance(request, dict) else None
+    print(f'Ошибка обработки запроса {request_id!r}: {type(error).__name__}: {error}', file=sys.stderr)
+    return {'id': request_id, 'ok': False, 'error': f'Ошибка сервера: {type(error).__name__}: {error}'}
+
+
+def serve_stream(pool: WorkerPool, instream: BinaryIO, outstream: BinaryIO):
+    """Читает запросы из instream до конца потока; ответы пишутся в
+    outstream по мере готовности, в том числе не по порядку запросов.
+    Если обработка запроса упала, клиент получает ответ с ошибкой."""
+    lock = threading.Lock()
+
+    def respond(request):
+        reply = pool.handle(request)
+        with lock:
+            write_frame(outstream, reply)
+
+    def check(request, future):
+        error = future.exception()
+        if error is None:
+            return
+        try:
+            with lock:
+                write_frame(outstream, _error_reply(request, error))
+        except Exception as e:
+            print(f'Не удалось отправить ответ об ошибке: {type(e).__name__}: {e}', file=sys.stderr)
+
+    with ThreadPoolExecutor(pool.size) as executor:
+        while True:
+            request = read_frame(instream)
+            if request is None:
+                break
+            executor.submit(respond, request).add_done_callback(functools.partial(check, request))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # запросы одного соединения выполняются по очереди
+        while True:
+            request = read_frame(self.rfile)
+            if request is None:
+                return
+            try:
+                reply = self.server.pool.handle(request)
+            except Exception as e:
+                reply = _error_reply(request, e)
+            write_frame(self.wfile, reply)
+
+
+def serve_unix(pool: WorkerPool, path: str):
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.ThreadingUnixStreamServer(path, _Handler) as server:
+        server.daemon_threads = True
+        server.pool = pool
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервер выполнения программ MEL")
+    parser.add_argument('--socket', help="путь Unix-сокета; без него - stdin/stdout")
+    parser.add_argument('--workers', type=int, default=None, help="число процессов (по умолчанию - число ядер)")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="секунд на запрос")
+    parser.add_argument('--max-memory', type=int, default=None, help="предел памяти процесса сверх прогрева, МБ")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help="программ в кеше процесса")
+    args = parser.parse_args(argv)
+    max_memory = None if args.max_memory is None else args.max_memory * 1024 * 1024
+    with WorkerPool(args.workers, args.timeout, max_memory, args.cache_size) as pool:
+        try:
+            if args.socket:
+                serve_unix(pool, args.socket)
+            else:
+                serve_stream(pool, sys.stdin.buffer, sys.stdout.buffer)
+        finally:
+            print(f'задержка: {pool.latency}; заменено процессов: {pool.recycled}', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
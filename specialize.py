@@ -0,0 +1,88 @@
+import operator
+
+from mel_ast import AstNode, BinOp, BinOpNode, TypedBinOpNode, CoerceNode, LiteralNode
+from mel_types import ArrayType, INT, FLOAT, STRING, BOOL
+from rope import concat
+from vectors import VECTOR_FUNCS
+
+# (операция, тип операндов) -> прямая реализация.
+# Деление целых, как и в общем пути Interpreter.eval_BinOpNode, даёт float,
+# поэтому (DIV, int) нет: см. _specialize_node.
+SPECIALIZED_OPS = {(BinOp.DIV, FLOAT.name): operator.truediv}
+for _type in (INT, FLOAT):
+    SPECIALIZED_OPS.update({
+        (BinOp.ADD, _type.name): operator.add,
+        (BinOp.SUB, _type.name): operator.sub,
+        (BinOp.MUL, _type.name): operator.mul,
+        (BinOp.MOD, _type.name): operator.mod,
+        (BinOp.GT, _type.name): operator.gt,
+        (BinOp.GE, _type.name): operator.ge,
+        (BinOp.LT, _type.name): operator.lt,
+        (BinOp.LE, _type.name): operator.le,
+        (BinOp.EQ, _type.name): operator.eq,
+        (BinOp.NE, _type.name): operator.ne,
+    })
+SPECIALIZED_OPS.update({
+    (BinOp.ADD, STRING.name): concat,
+    (BinOp.EQ, STRING.name): operator.eq,
+    (BinOp.NE, STRING.name): operator.ne,
+    (BinOp.EQ, BOOL.name): operator.eq,
+    (BinOp.NE, BOOL.name): operator.ne,
+    (BinOp.AND, BOOL.name): operator.and_,
+    (BinOp.OR, BOOL.name): operator.or_,
+    (BinOp.BIT_AND, INT.name): operator.and_,
+    (BinOp.BIN_OR, INT.name): operator.or_,
+})
+
+
+def _coerce(node: AstNode, type_name: str) -> AstNode:
+    if node.sem_type == INT and type_name == FLOAT.name:
+        if isinstance(node, LiteralNode):
+            coerced = LiteralNode(str(float(node.value)))
+        else:
+            coerced = CoerceNode(node, FLOAT.name, float)
+        coerced.sem_type = FLOAT
+        return coerced
+    return node
+
+
+def _specialize_node(node: AstNode) -> AstNode:
+    if type(node) is not BinOpNode:
+        return node
+    left, right = node.arg1.sem_type, node.arg2.sem_type
+    if left is None or right is None:
+        return node
+    if isinstance(node.sem_type, ArrayType):
+        # поэлементная операция: приведение типов делают сами операции над числами
+        return _typed(node, node.arg1, node.arg2, VECTOR_FUNCS[node.op], str(node.sem_type))
+    if node.op == BinOp.DIV and left == INT and right == INT:
+        # результат float; операнды не приводятся: int / int точнее float / float
+        return _typed(node, node.arg1, node.arg2, operator.truediv, FLOAT.name)
+    if left == right:
+        type_name = str(left)
+    elif left in (INT, FLOAT) and right in (INT, FLOAT):
+        type_name = FLOAT.name
+    else:
+        return node
+    func = SPECIALIZED_OPS.get((node.op, type_name))
+    if func is None:
+        return node
+    return _typed(node, _coerce(node.arg1, type_name), _coerce(node.arg2, type_name), func, type_name)
+
+
+def _typed(node: BinOpNode, arg1: AstNode, arg2: AstNode, func, type_name: str) -> TypedBinOpNode:
+    specialized = TypedBinOpNode(node.op, arg1, arg2, func, type_name)
+    specialized.sem_type = node.sem_type
+    specialized.line, specialized.column = node.line, node.column
+    specialized.end_line, specialized.end_column = node.end_line, node.end_column
+    return specialized
+
+
+def specialize(prog: AstNode) -> AstNode:
+    """Заменяет BinOpNode с известными типами операндов на TypedBinOpNode.
+
+    Использует sem_type, проставленные SemanticAnalyzer, поэтому
+    вызывается после анализа. Смешанные операции int/float получают явный
+    CoerceNode для целого операнда.
+    """
+    return prog.transform(_specialize_node)
@@ -1,7 +1,27 @@
+import asyncio
+import io
+import os
+import subprocess
+import sys
 import pytest
 import mel_parser
+import binast
+import bytecode
+import ir
+import vectors
+import mel_parser_standalone
 from scope import Scope
-from semantics import SemanticAnalyzer
+from mel_ast import StmtListNode, FuncDeclNode, ForNode, WhileNode, EmptyNode, ReturnNode, TypedBinOpNode, \
+    CoerceNode, FuncCallNode, IdentNode, ConstArrayNode, LiteralNode, BinOp
+from interpreter import Interpreter
+from semantics import SemanticAnalyzer, walk
+from program import compile_program, CompileError
+from specialize import specialize
+from inliner import inline_functions
+from rope import Rope, concat
+from mel_builtins import OutputBuffer
+from cooperative import AsyncRunner, DeadlineExceeded, StepLimitExceeded
+from server import WorkerPool, read_frame, serve_stream, write_frame
 
 
 @pytest.mark.parametrize("code, expected_errors", [
@@ -45,6 +65,18 @@ from semantics import SemanticAnalyzer
     int[] arr = {1, 2, 3};
     arr[0] = "hello";
     ''', ["Присвоение string в элемент массива типа int"]),
+
+    ('''
+    int a = 7;
+    int b = 2;
+    float c = a / b;
+    ''', []),
+
+    ('''
+    int a = 7;
+    int b = 2;
+    int c = a / b;
+    ''', ["Присвоение float в переменную типа int"]),
 ])
 def test_scope_and_types(code, expected_errors):
     analyzer = SemanticAnalyzer()
@@ -54,3 +86,844 @@ def test_scope_and_types(code, expected_errors):
 
     actual_errors = [str(err) for err in analyzer.errors]
     assert actual_errors == expected_errors, f"\nОжидалось: {expected_errors}\nПолучено: {actual_errors}"
+
+
+def test_integer_division_is_float():
+    program = compile_program('int a = 7;\nint b = 2;\nfloat c = a / b;')
+    assert program.run()['c'] == 3.5
+    assert bytecode.VM(bytecode.compile_checked(program)).run()['c'] == 3.5
+
+
+def test_write_tree_limits():
+    prog = mel_parser.parse('''
+    int x = 1 + 2 * 3;
+    x = x - 1;
+    ''')
+    buf = io.StringIO()
+    prog.write_tree(buf)
+    assert tuple(buf.getvalue().splitlines()) == prog.tree
+
+    buf = io.StringIO()
+    prog.write_tree(buf, max_depth=2)
+    lines = buf.getvalue().splitlines()
+    assert all(len(line) - len(line.lstrip('│├└ ')) <= 6 for line in lines)
+    assert any(line.endswith('…') for line in lines)
+
+    buf = io.StringIO()
+    assert prog.write_tree(buf, max_nodes=4) == 4
+    assert buf.getvalue().splitlines()[-1].endswith('└ …')
+
+
+def test_diagnostics_positions_and_limit():
+    code = '''int x = 1;
+x = "a";
+y = 2;
+int[] arr = {1, 2};
+arr[0] = true;
+'''
+    analyzer = SemanticAnalyzer()
+    analyzer.analyze(mel_parser.parse(code))
+    assert [(err.line, err.column) for err in analyzer.errors] == [(2, 1), (3, 1), (5, 1)]
+    assert analyzer.errors[0].span == (2, 1, 2, 8)
+    assert not analyzer.truncated
+
+    analyzer = SemanticAnalyzer(max_errors=2)
+    analyzer.analyze(mel_parser.parse(code))
+    assert len(analyzer.errors) == 2
+    assert analyzer.truncated
+
+
+def test_parse_with_recovery():
+    code = '''int x = 1;
+x = x +* 2;
+int f(int a) {
+    int q = ;
+    return a;
+}
+int r = f("s");
+'''
+    prog, syntax_errors = mel_parser.parse_with_recovery(code)
+    assert [(err.line, err.column, err.kind) for err in syntax_errors] == [(2, 8, 'syntax'), (4, 13, 'syntax')]
+    assert isinstance(prog, StmtListNode)
+
+    analyzer = SemanticAnalyzer()
+    analyzer.analyze(prog)
+    assert [str(err) for err in analyzer.errors] == ["Передан аргумент string вместо int в функцию f"]
+
+    prog, syntax_errors = mel_parser.parse_with_recovery('int f() { return 1;')
+    assert len(syntax_errors) == 1
+    assert isinstance(prog.stmts[0], FuncDeclNode)
+
+    # один проход: много ошибок не требуют повторных разборов
+    prog, syntax_errors = mel_parser.parse_with_recovery('int x = 1 +* 2;\nint y = @3;\nint z = 3;\n' * 500)
+    assert len(syntax_errors) == 1000 and len(prog.stmts) == 500
+    assert syntax_errors[-1].line == 1499
+
+
+def test_compiled_program_contexts():
+    program = compile_program('''
+    int fact(int n) {
+        if (n <= 1) {
+            return 1;
+        }
+        return n * fact(n - 1);
+    }
+    int total = fact(limit);
+    ''', externs={'limit': 'int'})
+    assert program.new_context({'limit': 5}).run() == {'limit': 5, 'total': 120}
+    assert program.new_context({'limit': 3}).run()['total'] == 6
+    assert program.new_context().call('fact', 10) == 3628800
+    for args in ((), (1, 2)):
+        with pytest.raises(TypeError, match='ожидает 1 аргументов'):
+            program.call('fact', *args)
+    with pytest.raises(CompileError):
+        compile_program('int x = "a";')
+
+
+def test_for_loops():
+    prog = mel_parser.parse('''
+    int s = 0;
+    for (int i = 0; i < 10; i = i + 1) {
+        s = s + i;
+    }
+    int m = 0;
+    int w = 0;
+    for (m = 0; m < 10; m = m + 1) {
+        m = m + 1;
+        w = w + 1;
+    }
+    int j = 10;
+    int t = 0;
+    while (j > 0) {
+        t = t + j;
+        j = j - 3;
+    }
+    ''')
+    assert SemanticAnalyzer().analyze(prog) == []
+    # for после разбора - блок { init; while (cond) { body; step } }
+    loops = [stmt.stmts[-1] if isinstance(stmt, StmtListNode) else stmt
+             for stmt in prog.stmts if isinstance(stmt, (StmtListNode, WhileNode))]
+    assert [loop.counted is not None for loop in loops] == [True, False, True]
+
+    interpreter = Interpreter()
+    interpreter.eval(prog)
+    assert interpreter.variables == {'s': 45, 'i': 10, 'm': 10, 'w': 5, 'j': -2, 't': 22}
+
+
+def test_canonical_ast():
+    prog = mel_parser.parse('''
+    var int a, b = 2, c;
+    int n = 0;
+    for (;;) {
+        n = n + b;
+        if (n > 5) var int x, y;
+        { }
+    }
+    ''')
+    assert all(type(stmt) is not list for stmt in prog.stmts)
+    decls = prog.stmts[:3]
+    assert [len(decl.vars) for decl in decls] == [1, 1, 1]
+    assert [str(decl.vars[0]) for decl in decls] == ['a', '=', 'c']
+    assert all(decl.type is decls[0].type for decl in decls)
+
+    nodes = list(walk(prog))
+    assert not any(isinstance(sub, (ForNode, EmptyNode)) for sub in nodes)
+    loop = prog.stmts[-1].stmts[-1]
+    assert isinstance(loop, WhileNode) and loop.cond.value is True
+    assert isinstance(loop.body.stmts[0].stmts[-1].then_stmt, StmtListNode)
+    assert len(loop.body.stmts[0].stmts) == 2
+
+
+def test_specialized_binops():
+    prog = mel_parser.parse('''
+    int a = 3;
+    float b = 2.5;
+    float c = a * b + 1;
+    bool q = a < b && "x" == "x";
+    string s = "a" + "b";
+    int e = a % 2;
+    float h = a / 2;
+    ''')
+    assert SemanticAnalyzer().analyze(prog) == []
+    specialize(prog)
+    c_value = prog.stmts[2].vars[0].val
+    assert isinstance(c_value, TypedBinOpNode) and c_value.type_name == 'float'
+    assert isinstance(c_value.arg1.arg1, CoerceNode)
+    h_value = prog.stmts[6].vars[0].val
+    assert isinstance(h_value, TypedBinOpNode) and h_value.type_name == 'float'
+
+    interpreter = Interpreter()
+    interpreter.eval(prog)
+    assert interpreter.variables == {'a': 3, 'b': 2.5, 'c': 8.5, 'q': False, 's': 'ab', 'e': 1, 'h': 1.5}
+
+
+IR_PROGRAM = '''
+int fact(int n) {
+    if (n <= 1) {
+        return 1;
+    }
+    return n * fact(n - 1);
+}
+int s = 0;
+for (int i = 0; i < 10; i = i + 1) {
+    s = s + i;
+}
+int[] a = {1, 2, 3};
+a[1] = a[0] + a[2];
+int f = fact(6);
+float r = 1 * 2.5;
+bool b = s > 10 && f == 720;
+string t = "a" + "b";
+'''
+
+
+def test_ir_lowering_matches_interpreter():
+    prog = mel_parser.parse(IR_PROGRAM)
+    assert SemanticAnalyzer().analyze(prog) == []
+    specialize(prog)
+    module = ir.lower(prog)
+
+    fact = module.functions['fact']
+    assert fact.cfg() == {'entry': ('then1', 'endif2'), 'then1': (), 'endif2': ()}
+    assert 'branch %2, then1, endif2' in fact.dump()
+    assert ir.IRInterpreter(module).call('fact', 10) == 3628800
+
+    interpreter = Interpreter()
+    interpreter.eval(prog)
+    assert ir.IRInterpreter(module).run() == interpreter.variables
+
+
+def test_bytecode_vm_and_serialization(tmp_path, monkeypatch):
+    prog = mel_parser.parse(IR_PROGRAM)
+    assert SemanticAnalyzer().analyze(prog) == []
+    module = bytecode.compile_program(specialize(prog))
+
+    interpreter = Interpreter()
+    interpreter.eval(prog)
+    assert bytecode.VM(module).run() == interpreter.variables
+    assert bytecode.VM(module).call('fact', 10) == 3628800
+    # константы выражений не выполняются в цикле, а лежат в шаблоне регистров
+    assert 'preload' in module.disassemble()
+
+    data = module.to_bytes()
+    assert data == bytecode.compile_program(prog).to_bytes()
+    restored = bytecode.BytecodeModule.from_bytes(data)
+    assert restored.to_bytes() == data
+    assert bytecode.VM(restored).run() == interpreter.variables
+    with pytest.raises(ValueError):
+        bytecode.BytecodeModule.from_bytes(data[:-3])
+
+    cached = bytecode.load_or_compile(IR_PROGRAM, str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    assert bytecode.load_or_compile(IR_PROGRAM, str(tmp_path)).to_bytes() == cached.to_bytes()
+    assert bytecode.VM(cached).call('fact', 5) == 120
+    # другая версия компилятора не получает старый байткод
+    monkeypatch.setattr(bytecode, '_fingerprint', b'other compiler')
+    bytecode.load_or_compile(IR_PROGRAM, str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_binary_ast_roundtrip(tmp_path):
+    prog = mel_parser.parse(IR_PROGRAM)
+    SemanticAnalyzer().analyze(prog)
+    specialize(prog)
+    path = str(tmp_path / 'prog.mela')
+    binast.dump(prog, path)
+    assert open(path, 'rb').read() == binast.dumps(prog)
+
+    expected = Interpreter()
+    expected.eval(prog)
+    with binast.load(path) as ast:
+        fact = ast.root.stmts[0]
+        assert fact.node_type is FuncDeclNode and fact.name.name == 'fact'
+        assert ast.materialize().tree == prog.tree
+
+        interpreter = Interpreter()
+        for stmt in ast.statements():
+            interpreter.eval(stmt)
+        assert interpreter.variables == expected.variables
+
+    with pytest.raises(ValueError):
+        binast.loads(b'MELB' + bytes(100))
+
+
+def test_binary_ast_rejects_unknown_functions(monkeypatch):
+    payload = CoerceNode(LiteralNode('"1"'), 'int', eval)
+    with pytest.raises(ValueError):
+        binast.dumps(payload)
+    # файл, записанный кем-то другим: при загрузке eval не разрешён
+    monkeypatch.setitem(binast.function_table(), 'builtins.eval', eval)
+    data = binast.dumps(payload)
+    monkeypatch.undo()
+    with pytest.raises(ValueError):
+        binast.loads(data).materialize()
+
+
+MEMO_PROGRAM = '''
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+int twice(int n) {
+    return fib(n) * 2;
+}
+int[] cells = {0};
+int touch(int[] a) {
+    a[0] = a[0] + 1;
+    return a[0];
+}
+int count(int n) {
+    int s = 0;
+    for (int i = 0; i < n; i = i + 1) {
+        s = s + i;
+    }
+    return s;
+}
+'''
+
+
+def test_pure_function_memoization():
+    program = compile_program(MEMO_PROGRAM)
+    pure = {name for name, info in program.signatures.items() if 'node' in info and info['pure']}
+    assert pure == {'fib', 'twice', 'count'}
+
+    assert program.call('twice', 60) == 3096017511840
+    stats = program.memo.stats()
+    assert stats['fib'].misses == 61 and stats['fib'].hits == 58
+    assert program.call('fib', 60) == 1548008755920
+    assert program.memo.stats()['fib'].hits == 59
+
+    limited = compile_program(MEMO_PROGRAM, memo_size=2, memo_exclude=['count'])
+    for n in range(5):
+        limited.call('count', n)
+        limited.call('fib', n)
+    assert 'count' not in limited.memo.stats()
+    assert limited.memo.stats()['fib'].size == 2
+
+    assert compile_program(MEMO_PROGRAM, memoize=False).memo is None
+
+
+def test_standalone_parser_is_current():
+    # после правки грамматики: python build_parser.py
+    assert mel_parser_standalone.GRAMMAR_HASH == mel_parser.GRAMMAR_HASH
+    script = 'import sys, mel_parser; mel_parser.parse("int x = 1;"); print("lark" in sys.modules)'
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip() == 'False'
+
+
+def _many_functions(count):
+    parts = ['int g0 = 0;']
+    for k in range(1, count):
+        parts.append(f'''
+int f{k}(int n) {{
+    int s = g{k - 1};
+    for (int i = 0; i < n; i = i + 1) {{
+        s = s + f{k - 1}(i) + f{k + 1}(i);
+    }}
+    s = "bad";
+    return s;
+}}
+int g{k} = f{k}(1) + "x";
+''')
+    return ''.join(parts)
+
+
+def test_two_phase_analysis_matches_sequential():
+    code = _many_functions(80)
+    results = []
+    for workers in (None, 1, 2):
+        prog = mel_parser.parse(code)
+        analyzer = SemanticAnalyzer(workers=workers)
+        errors = analyzer.analyze(prog)
+        nodes = list(walk(prog)) + [sub for info in analyzer.functions.values() if 'node' in info
+                                     for sub in walk(info['node'].body)]
+        annotations = [(str(sub), repr(sub.sem_type), repr(getattr(sub, 'counted', None))) for sub in nodes]
+        results.append(([err.format() for err in errors], annotations))
+    assert results[0] == results[1] == results[2]
+    assert len(results[0][0]) == 3 * 79 + 1
+
+    truncated = SemanticAnalyzer(max_errors=5, workers=2)
+    assert [err.format() for err in truncated.analyze(mel_parser.parse(code))] == results[0][0][:5]
+    assert truncated.truncated
+
+
+def test_rope_concatenation():
+    base = concat('x' * 40, 'y' * 40)
+    left, right = base + 'L', base + 'R'
+    assert type(left) is Rope and left == 'x' * 40 + 'y' * 40 + 'L'
+    assert right == 'x' * 40 + 'y' * 40 + 'R' and base == 'x' * 40 + 'y' * 40
+    assert 'a' + base + base == 'a' + str(base) * 2
+    assert hash(base) == hash(str(base)) and len(left) == 81 and right > left
+
+    code = '''
+    string s = "";
+    string[] parts = {"", ""};
+    int i = 0;
+    while (i < 200) {
+        s = s + "ab";
+        i = i + 1;
+    }
+    parts[1] = s + "!";
+    bool same = s == parts[1];
+    '''
+    for optimize in (False, True):
+        variables = compile_program(code, optimize=optimize).run()
+        assert type(variables['s']) is str and variables['s'] == 'ab' * 200
+        assert type(variables['parts'][1]) is str and variables['same'] is False
+
+    interpreter = Interpreter()
+    interpreter.eval(mel_parser.parse(code))
+    assert type(interpreter.variables['s']) is Rope
+
+
+BUILTINS_PROGRAM = '''
+float hyp(float a, float b) {
+    return sqrt(a * a + b * b);
+}
+int[] xs = {4, 5, 6};
+int n = len(xs);
+float h = hyp(3.0, 4.0);
+string s = upper(substr("builtin", 0, 4)) + itos(n);
+print(s);
+write(h);
+print(true);
+'''
+
+
+def test_builtin_functions():
+    program = compile_program(BUILTINS_PROGRAM)
+    assert program.signatures['hyp']['pure']
+    out = io.StringIO()
+    variables = program.new_context(output=OutputBuffer(out)).run()
+    assert (variables['n'], variables['h'], variables['s']) == (3, 5.0, 'BUIL3')
+    assert out.getvalue() == 'BUIL3\n5.0true\n'
+
+    module = bytecode.compile_program(mel_parser.parse(BUILTINS_PROGRAM))
+    vm_out = io.StringIO()
+    assert bytecode.VM(module, OutputBuffer(vm_out)).run()['s'] == 'BUIL3'
+    assert vm_out.getvalue() == out.getvalue()
+
+    with pytest.raises(CompileError, match='Передан аргумент'):
+        compile_program('int n = len(5);')
+    program = compile_program('int f(int x) { print(x); return x; }')
+    assert not program.signatures['f']['pure']
+    with pytest.raises(CompileError, match='print не возвращает значения'):
+        compile_program('int x = print(1);')
+    with pytest.raises(CompileError, match='write не возвращает значения'):
+        compile_program('int y = 1 + write(1);')
+    program = compile_program('int a = 0 - 3;\nint y = abs(a);\nfloat z = abs(0.5 - 2.0);')
+    assert program.run() == {'a': -3, 'y': 3, 'z': 1.5}
+    with pytest.raises(CompileError):
+        compile_program('int y = abs(1.5);')
+
+
+VECTOR_PROGRAM = '''
+float[] xs = {1.0, 2.0, 3.0};
+int[] ks = {1, 2, 3};
+float[] ys = xs * 2.0 + ks;
+bool[] big = ys > 5.0;
+float total = sum(ys);
+int top = max(ks);
+bool same = ks == ks;
+'''
+
+
+def test_vector_arithmetic():
+    program = compile_program(VECTOR_PROGRAM)
+    expected = {'ys': [3.0, 6.0, 9.0], 'big': [False, True, True], 'total': 18.0, 'top': 3, 'same': True}
+    variables = program.run()
+    assert {name: variables[name] for name in expected} == expected
+
+    prog = mel_parser.parse(VECTOR_PROGRAM)
+    assert SemanticAnalyzer().analyze(prog) == []
+    module = bytecode.compile_program(prog)
+    variables = bytecode.VM(bytecode.BytecodeModule.from_bytes(module.to_bytes())).run()
+    assert {name: variables[name] for name in expected} == expected
+
+    with pytest.raises(CompileError, match='неприменима'):
+        compile_program('string[] s = {"a"}; string[] t = s + s;')
+    with pytest.raises(ValueError, match='разной длины'):
+        compile_program('int[] a = {1, 2}; int[] b = {1}; int[] c = a - b;').run()
+
+
+def test_long_vectors_match_python_arithmetic():
+    # начиная с NUMPY_MIN_LENGTH результат тот же, что у коротких массивов
+    n = vectors.NUMPY_MIN_LENGTH
+    big = [2 ** 62] * n
+    assert vectors.vector_binop(BinOp.MUL, big, 4) == [2 ** 64] * n
+    assert vectors.vector_binop(BinOp.ADD, big, big) == [2 ** 63] * n
+    floats = [float(i) for i in range(n)]
+    assert vectors.vector_binop(BinOp.DIV, floats, 2.0) == [i / 2.0 for i in range(n)]
+    with pytest.raises(ZeroDivisionError):
+        vectors.vector_binop(BinOp.DIV, floats, floats)
+    with pytest.raises(ZeroDivisionError):
+        vectors.vector_binop(BinOp.MOD, list(range(n)), 0)
+
+
+BATCH_PROGRAM = '''
+float score(float x, int k) {
+    return x * 2.0 - k / 2 + sqrt(x);
+}
+int clamp(int v) {
+    if (v > 10) {
+        return 10;
+    }
+    return v;
+}
+'''
+
+
+def test_batch_calls():
+    program = compile_program(BATCH_PROGRAM)
+    assert set(program.kernels) == {'score'}
+    xs, ks = [1.0, 4.0, 9.0], [2, 3, 4]
+    expected = [program.call('score', x, k) for x, k in zip(xs, ks)]
+    assert list(program.call_batch('score', zip(xs, ks))) == expected
+    assert program.call_columns('score', [xs, ks]) == expected
+    assert program.call_columns('score', [xs, ks], vectorize=False) == expected
+    assert program.call_columns('clamp', [[5, 50]]) == [5, 10]
+
+    results = program.call_batch('clamp', iter([(1,), (20,), ()]))
+    assert next(results) == 1 and next(results) == 10
+    with pytest.raises(TypeError):
+        next(results)
+    with pytest.raises(ValueError, match='разной длины'):
+        program.call_columns('score', [xs, ks[:2]])
+
+
+TAIL_PROGRAM = '''
+int count(int n, int acc) {
+    if (n == 0) {
+        return acc;
+    }
+    return count(n - 1, acc + 2);
+}
+int gcd(int a, int b) {
+    if (b == 0) {
+        return a;
+    }
+    return gcd(b, a % b);
+}
+int fact(int n) {
+    if (n < 2) {
+        return 1;
+    }
+    return n * fact(n - 1);
+}
+'''
+
+
+def test_tail_calls():
+    prog = mel_parser.parse(TAIL_PROGRAM)
+    assert SemanticAnalyzer().analyze(prog) == []
+    tails = [sub.tail for func in prog.stmts for sub in walk(func.body) if isinstance(sub, ReturnNode)]
+    assert sorted(tails) == [False, False, False, False, True, True]
+
+    depth = sys.getrecursionlimit() * 10
+    program = compile_program(TAIL_PROGRAM, memoize=False)
+    assert program.call('count', depth, 0) == 2 * depth
+    assert program.call('gcd', 1071, 462) == 21
+    assert program.call('fact', 10) == 3628800
+
+    module = ir.lower(prog)
+    assert ir.IRInterpreter(module).call('count', depth, 0) == 2 * depth
+    vm = bytecode.VM(bytecode.compile_module(module))
+    assert vm.call('count', depth, 0) == 2 * depth
+    assert vm.call('gcd', 1071, 462) == 21
+
+
+INLINE_PROGRAM = '''
+float sq(float x) {
+    return x * x;
+}
+float hyp(float a, float b) {
+    return sqrt(sq(a) + sq(b));
+}
+int twice(int n) {
+    return n + n;
+}
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+int k = 3;
+int t = twice(k + 1);
+float h = hyp(3.0, 4.0);
+'''
+
+
+def test_inlining():
+    program = compile_program(INLINE_PROGRAM)
+    report = program.inlining
+    assert report.counts() == {'sq': 2, 'hyp': 1}
+    assert 'twice' not in report.counts() and 'fib' in report.rejected
+    assert all(call.line is not None for call in report.inlined)
+    calls = [sub.func.name for stmt in program.body for sub in walk(stmt) if isinstance(sub, FuncCallNode)]
+    assert calls == ['twice', 'sqrt']
+    assert program.run() == {'k': 3, 't': 8, 'h': 5.0}
+    assert program.call('hyp', 6.0, 8.0) == 10.0
+
+    plain = compile_program(INLINE_PROGRAM, inline=False)
+    assert plain.inlining is None and plain.run() == program.run()
+    assert compile_program(INLINE_PROGRAM, optimize=False).inlining is None
+
+    prog = mel_parser.parse(INLINE_PROGRAM)
+    analyzer = SemanticAnalyzer()
+    analyzer.analyze(prog)
+    prog, report = inline_functions(prog, analyzer.functions, budget=3)
+    assert report.growth <= 3 and len(report.inlined) == 1
+
+
+DEAD_CODE_PROGRAM = '''
+class Unused {
+    int v = 1;
+}
+class Point {
+    int x = 0;
+}
+int work(int n) {
+    int scratch = n * 3;
+    int t = n + 1;
+    t = n + 2;
+    int acc = 0;
+    int i = 0;
+    while (i < n) {
+        int tmp = i * i;
+        acc = acc + i;
+        i = i + 1;
+    }
+    return acc + t;
+}
+int helper(int n) {
+    return n;
+}
+int a = 5;
+a = work(4);
+int b = 2;
+Point p = new Point();
+p.x = 3;
+work(2);
+print(a);
+'''
+
+
+def test_dead_code_elimination():
+    output = io.StringIO()
+    program = compile_program(DEAD_CODE_PROGRAM, entry_points=())
+    report = program.dead_code
+    assert (report.stores, report.declarations, report.expressions) == (2, 2, 1)
+    assert report.functions == ('helper',) and report.classes == ('Unused',)
+    assert list(program.functions) == ['work'] and list(program.classes) == ['Point']
+    assert program.new_context(output=OutputBuffer(output)).run() == {'a': 12, 'b': 2, 'p': {'x': 3}}
+    assert output.getvalue() == '12\n'
+
+    loop = next(stmt for stmt in program.functions['work'].body.stmts if isinstance(stmt, WhileNode))
+    assert len(loop.body.stmts) == 2 and loop.counted.body.stmts == loop.body.stmts[:1]
+
+    # без точек входа хост может вызвать любую функцию
+    program = compile_program(DEAD_CODE_PROGRAM)
+    assert program.dead_code.functions == () and program.call('helper', 7) == 7
+    assert compile_program(DEAD_CODE_PROGRAM, eliminate=False).dead_code is None
+
+    # return верхнего уровня завершает программу: её переменные живы
+    for source in ('int x = 5; return 0;', 'int x = 5; int y = x + 1; if (y > 0) { x = 7; return 1; } x = 9;'):
+        expected = compile_program(source, optimize=False).run()
+        program = compile_program(source)
+        assert program.run() == expected
+        assert bytecode.VM(bytecode.compile_checked(program)).run() == expected
+
+
+CSE_PROGRAM = '''
+int f(int[] a, int i, int b) {
+    int x = a[i] * b + 1;
+    int y = a[i] * b + 2;
+    a[i] = 7;
+    int z = a[i] * b;
+    b = b + 1;
+    return x + y + z + a[i] * b;
+}
+int g(int n, int k, int d) {
+    int s = 0;
+    int i = 0;
+    while (i < n) {
+        s = s + i * (k + 1) + k % d;
+        i = i + 1;
+    }
+    return s;
+}
+int k = 4;
+int p = k * k + 1;
+int q = k * k + 2;
+int[] arr = {1, 2, 3};
+int r = f(arr, 1, 3);
+'''
+
+
+def test_common_subexpressions():
+    program = compile_program(CSE_PROGRAM, memoize=False)
+    plain = compile_program(CSE_PROGRAM, optimize=False)
+    assert program.cse.reused >= 2 and program.cse.hoisted == 1
+    assert program.run() == plain.run() == {'k': 4, 'p': 17, 'q': 18, 'arr': [1, 7, 3], 'r': 64}
+    assert program.call('g', 5, 2, 1) == plain.call('g', 5, 2, 1) == 30
+    # k % d не выносится из цикла: при n = 0 деления на ноль нет
+    assert program.call('g', 0, 2, 0) == 0
+    names = {sub.name for stmt in program.body for sub in walk(stmt) if isinstance(sub, IdentNode)}
+    assert any(name.startswith('$') for name in names)
+    loop = next(stmt for stmt in program.functions['g'].body.stmts if isinstance(stmt, WhileNode))
+    assert loop.counted is not None and loop.counted.body.stmts == loop.body.stmts[:-1]
+
+    # x без значения равен None: x * 2 нельзя вычислять до цикла, который не выполняется
+    source = 'int f(int n) { int x; int s = 0; int i = 0; while (i < n) { s = s + x * 2; i = i + 1; } return s; }'
+    assert compile_program(source).call('f', 0) == compile_program(source, optimize=False).call('f', 0) == 0
+
+    # временные переменные не видны хосту ни в одном исполнителе
+    program = compile_program('int a = 3; int b = 4; int c = a * b + 1; int d = a * b + 2;')
+    expected = {'a': 3, 'b': 4, 'c': 13, 'd': 14}
+    module = bytecode.compile_checked(program)
+    assert program.run() == expected
+    assert ir.IRInterpreter(ir.lower(bytecode._program_ast(program))).run() == expected
+    assert bytecode.VM(module).run() == expected
+    assert asyncio.run(AsyncRunner(module).run()) == expected
+
+
+CONST_ARRAY_PROGRAM = '''
+class Box {
+    int[] cells = {0, 0, 0};
+    int size = 3;
+}
+int lookup(int i) {
+    int[] table = {10, 20, 30, 40};
+    return table[i] + len(table);
+}
+int bump(int i) {
+    int[] counts = {1, 1, 1};
+    counts[i] = counts[i] + 1;
+    return sum(counts);
+}
+Box a = new Box();
+Box b = new Box();
+int[] top = {5, 6};
+top[0] = 7;
+int x = lookup(2) + lookup(1);
+int y = bump(0) + bump(0);
+'''
+
+
+def test_constant_arrays():
+    program = compile_program(CONST_ARRAY_PROGRAM)
+    folded = {}
+    for func in program.functions.values():
+        for sub in walk(func.body):
+            if isinstance(sub, ConstArrayNode):
+                folded[func.name.name] = sub.shared
+    assert folded == {'lookup': True, 'bump': False}
+    context = program.new_context()
+    result = context.run()
+    assert result['x'] == 58 and result['y'] == 8 and result['top'] == [7, 6]
+    # объекты получают собственные копии массива-поля
+    assert result['a']['cells'] is not result['b']['cells'] and result['a'] == {'cells': [0, 0, 0], 'size': 3}
+    assert program.run()['top'] == [7, 6]
+    assert compile_program(CONST_ARRAY_PROGRAM, optimize=False).run() == program.run()
+
+
+ASYNC_PROGRAM = '''
+int count(int n) {
+    int s = 0;
+    int i = 0;
+    while (i < n) {
+        s = s + i;
+        i = i + 1;
+    }
+    return s;
+}
+int r = count(n);
+print(r);
+'''
+
+
+def test_async_runner():
+    module = bytecode.compile_checked(compile_program(ASYNC_PROGRAM, externs={'n': 'int'}))
+    forever = bytecode.compile_checked(compile_program('int i = 0;\nwhile (true) { i = i + 1; }'))
+    stream = io.StringIO()
+
+    async def scenario():
+        runner = AsyncRunner(module, slice_steps=100)
+        # выполнения чередуются: обе программы длиннее одной порции
+        first, second = await asyncio.gather(runner.run({'n': 1000}, OutputBuffer(stream)),
+                                             runner.run({'n': 2000}, OutputBuffer(stream)))
+        assert first['r'] == 499500 and second['r'] == 1999000
+        assert await runner.call('count', 10) == 45
+        with pytest.raises(StepLimitExceeded) as error:
+            await AsyncRunner(module, slice_steps=100, max_steps=500).run({'n': 1000})
+        assert error.value.steps == 500
+        assert (await AsyncRunner(module, max_steps=5000).run({'n': 100}))['r'] == 4950
+        with pytest.raises(DeadlineExceeded):
+            await AsyncRunner(forever, timeout=0.05).run()
+
+    asyncio.run(scenario())
+    assert stream.getvalue().split() == ['499500', '1999000']
+    assert bytecode.VM(module).run({'n': 1000})['r'] == 499500
+
+
+def test_worker_pool_server():
+    source = 'int twice(int a) { return a * 2; }\nint r = twice(n);\nprint(r);'
+    requests = io.BytesIO()
+    for i in range(4):
+        write_frame(requests, {'id': i, 'source': source, 'externs': {'n': 'int'}, 'globals': {'n': i}})
+    write_frame(requests, {'id': 'call', 'source': source, 'externs': {'n': 'int'}, 'call': 'twice', 'args': [21]})
+    write_frame(requests, {'id': 'bad', 'source': 'int x = "s";'})
+    write_frame(requests, {'id': 'loop', 'source': 'while (true) { }', 'timeout': 0.5})
+    requests.seek(0)
+    responses = io.BytesIO()
+    with WorkerPool(2) as pool:
+        serve_stream(pool, requests, responses)
+        responses.seek(0)
+        replies = {}
+        while (reply := read_frame(responses)) is not None:
+            replies[reply['id']] = reply
+        assert [replies[i]['result']['r'] for i in range(4)] == [0, 2, 4, 6]
+        assert replies[3]['output'] == '6\n' and any(replies[i]['cached'] for i in range(4))
+        assert replies['call']['result'] == 42
+        assert not replies['bad']['ok'] and 'Ошибки компиляции' in replies['bad']['error']
+        assert not replies['loop']['ok'] and pool.recycled == 1
+        # заменённый процесс продолжает принимать запросы
+        assert all(pool.handle({'source': 'int x = 1;'})['ok'] for _ in range(2))
+        stats = pool.handle({'op': 'stats'})['latency']
+        assert stats['count'] == 9 and stats['p50'] <= stats['p99'] <= stats['max']
+
+    with WorkerPool(1, max_memory=64 * 1024 * 1024) as pool:
+        reply = pool.handle({'source': 'float[] a = zeros(100000000);'})
+        assert not reply['ok'] and 'MemoryError' in reply['error'] and pool.recycled == 1
+        assert pool.handle({'source': 'float[] a = zeros(1000);'})['ok'] and pool.recycled == 1
+        # упавшая обработка запроса - ответ с ошибкой, а не потерянный запрос
+        pool.execute = None
+        requests = io.BytesIO()
+        write_frame(requests, {'id': 'broken', 'source': 'int x = 1;'})
+        requests.seek(0)
+        responses = io.BytesIO()
+        serve_stream(pool, requests, responses)
+        responses.seek(0)
+        reply = read_frame(responses)
+        assert reply['id'] == 'broken' and not reply['ok'] and 'Ошибка сервера' in reply['error']
+
+
+def test_server_stdio_framing():
+    # предупреждения интерпретатора не должны попадать в канал кадров
+    requests = io.BytesIO()
+    write_frame(requests, {'id': 1, 'source': 'int x;\nint z = x;\nprint(1);'})
+    write_frame(requests, {'id': 2, 'source': 'int y = 2;'})
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    completed = subprocess.run([sys.executable, server, '--workers', '1'], input=requests.getvalue(),
+                               capture_output=True, timeout=60)
+    assert completed.returncode == 0
+    responses = io.BytesIO(completed.stdout)
+    replies = {}
+    while (reply := read_frame(responses)) is not None:
+        replies[reply['id']] = reply
+    assert replies[1]['ok'] and replies[1]['output'] == '1\n'
+    assert replies[2]['result'] == {'y': 2}
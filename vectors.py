@@ -0,0 +1,111 @@
+"""Поэлементные операции над массивами MEL.
+
+`a + b`, `a * 2.0`, `a < b` над int[]/float[] (и массивом со скаляром)
+дают новый массив. Массивы MEL во время выполнения - списки Python,
+поэтому длинные массивы float переводятся в массивы NumPy и обратно
+(.tolist()), а короткие, целые - и все, если NumPy не установлен, -
+считаются генератором списка. Результат не зависит от пути: целые
+NumPy (int64) молча переполняются, поэтому int[] всегда считаются
+списком, а деление на ноль, которое NumPy превращает в inf/nan, тоже
+уходит в списки и бросает ZeroDivisionError. == и != по-прежнему
+сравнивают массивы целиком.
+"""
+import operator
+from typing import Callable
+
+from mel_ast import BinOp
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - NumPy необязателен
+    numpy = None
+
+# Короче этого перевод в NumPy и обратно дороже самой операции
+NUMPY_MIN_LENGTH = 64
+
+VECTOR_OPS = {
+    BinOp.ADD: operator.add,
+    BinOp.SUB: operator.sub,
+    BinOp.MUL: operator.mul,
+    BinOp.DIV: operator.truediv,
+    BinOp.MOD: operator.mod,
+    BinOp.GT: operator.gt,
+    BinOp.GE: operator.ge,
+    BinOp.LT: operator.lt,
+    BinOp.LE: operator.le,
+}
+
+
+def vector_binop(op: BinOp, left, right) -> list:
+    func = VECTOR_OPS[op]
+    left_list, right_list = type(left) is list, type(right) is list
+    if left_list and right_list and len(left) != len(right):
+        raise ValueError(f"Массивы разной длины: {len(left)} и {len(right)}")
+    length = len(left) if left_list else len(right)
+    if numpy is not None and length >= NUMPY_MIN_LENGTH:
+        result = _numpy_binop(op, func, left, right)
+        if result is not None:
+            return result
+    if left_list and right_list:
+        return [func(x, y) for x, y in zip(left, right)]
+    if left_list:
+        return [func(x, right) for x in left]
+    return [func(left, y) for y in right]
+
+
+# Целые больше по модулю не представимы в float64 точно
+_EXACT_INT = 2 ** 53
+
+
+def _numpy_operand(value):
+    """Операнд для NumPy или None, если результат мог бы отличаться от
+    вычисления над числами Python."""
+    if type(value) is list:
+        array = numpy.asarray(value)
+        return array if array.dtype == numpy.float64 else None
+    if type(value) is float or type(value) is int and -_EXACT_INT <= value <= _EXACT_INT:
+        return value
+    return None
+
+
+def _numpy_binop(op: BinOp, func, left, right):
+    left, right = _numpy_operand(left), _numpy_operand(right)
+    if left is None or right is None:
+        return None
+    if op in (BinOp.DIV, BinOp.MOD) and not numpy.all(right):
+        # деление на ноль: списки бросят ZeroDivisionError
+        return None
+    return func(left, right).tolist()
+
+
+def _vector(op: BinOp) -> Callable[[object, object], list]:
+    def apply(left, right):
+        return vector_binop(op, left, right)
+
+    # binast сохраняет функции по модулю и имени
+    apply.__name__ = apply.__qualname__ = f'vector_{op.name.lower()}'
+    return apply
+
+
+vector_add = _vector(BinOp.ADD)
+vector_sub = _vector(BinOp.SUB)
+vector_mul = _vector(BinOp.MUL)
+vector_div = _vector(BinOp.DIV)
+vector_mod = _vector(BinOp.MOD)
+vector_gt = _vector(BinOp.GT)
+vector_ge = _vector(BinOp.GE)
+vector_lt = _vector(BinOp.LT)
+vector_le = _vector(BinOp.LE)
+
+# Реализации для TypedBinOpNode над массивами
+VECTOR_FUNCS = {
+    BinOp.ADD: vector_add,
+    BinOp.SUB: vector_sub,
+    BinOp.MUL: vector_mul,
+    BinOp.DIV: vector_div,
+    BinOp.MOD: vector_mod,
+    BinOp.GT: vector_gt,
+    BinOp.GE: vector_ge,
+    BinOp.LT: vector_lt,
+    BinOp.LE: vector_le,
+}